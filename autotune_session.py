@@ -0,0 +1,107 @@
+"""
+Pick the intra and inter op thread counts, and optionally the cpus, of the training and of the inference sessions.
+Every candidate runs a short benchmarks.throughput_benchmark in a process of its own, tensorflow creates its thread
+pools once per process. The fastest candidate of each mode is written to SESSION_CONFIG_PATH, where
+utils.session_config reads it for the later sessions on this host.
+
+    python autotune_session.py
+    python autotune_session.py --modes inference --intra 4 8 16 --inter 1 2 --affinity
+"""
+import argparse
+import glob
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from benchmarks.throughput_benchmark import run_benchmark
+from utils.session_config import PURPOSES, load_tuned, save_tuned
+
+import faster_rcnn_configs as frc
+
+
+def _thread_counts(max_threads):
+    counts, count = {max_threads}, 1
+    while count < max_threads:
+        counts.add(count)
+        count *= 2
+    return sorted(counts)
+
+
+def _sockets(cpus):
+    """
+    :return: [[cpus of a socket]] of the given cpus, a single group when the topology is unknown.
+    """
+    sockets = defaultdict(list)
+    for cpu in cpus:
+        paths = glob.glob('/sys/devices/system/cpu/cpu{}/topology/physical_package_id'.format(cpu))
+        socket = 0
+        if paths:
+            with open(paths[0]) as f:
+                socket = int(f.read())
+        sockets[socket].append(cpu)
+    return [sockets[socket] for socket in sorted(sockets)]
+
+
+def candidates(intra_counts, inter_counts, affinity=False):
+    """
+    Thread settings to try, tensorflow defaults first. With affinity, the process is also pinned to as many cpus as
+    intra op threads, and to the cpus of one socket on several socket hosts. cpus [] runs on all cpus.
+    """
+    allowed = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count()))
+    sockets = _sockets(allowed)
+
+    settings = [{'intra_op_threads': 0, 'inter_op_threads': 0, 'cpus': []}]
+    for intra in intra_counts:
+        for inter in inter_counts:
+            settings.append({'intra_op_threads': intra, 'inter_op_threads': inter, 'cpus': []})
+            if affinity and intra < len(allowed):
+                settings.append({'intra_op_threads': intra, 'inter_op_threads': inter, 'cpus': allowed[:intra]})
+            if affinity and len(sockets) > 1 and intra <= len(sockets[0]):
+                settings.append({'intra_op_threads': intra, 'inter_op_threads': inter, 'cpus': sockets[0]})
+    return settings
+
+
+def _main():
+    parser = argparse.ArgumentParser(description='Tune the thread counts of the training and inference sessions.')
+    parser.add_argument('--modes', nargs='+', choices=['train', 'inference'], default=['train', 'inference'])
+    parser.add_argument('--intra', type=int, nargs='+', default=None, help='Powers of 2 up to the cpu count.')
+    parser.add_argument('--inter', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--affinity', action='store_true', help='Also try pinning the process to fewer cpus.')
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--steps', type=int, default=10)
+    parser.add_argument('--output', default=frc.SESSION_CONFIG_PATH)
+    args = parser.parse_args()
+
+    # Candidates are passed explicitly, neither INTRA_OP_THREADS nor previous tuned settings apply to them.
+    intra_counts = args.intra or _thread_counts(os.cpu_count())
+    settings = candidates(intra_counts, args.inter, args.affinity)
+    print(f'{len(settings)} candidates for {", ".join(args.modes)}')
+
+    # Modes which are not tuned now keep their previous settings.
+    tuned = {purpose: load_tuned(purpose, args.output) for purpose in PURPOSES if load_tuned(purpose, args.output)}
+    context = get_context('spawn')
+    for mode in args.modes:
+        results = []
+        for threads in settings:
+            with ProcessPoolExecutor(1, mp_context=context) as executor:
+                result = executor.submit(run_benchmark, mode, {}, frc.IMAGE_BATCH_SIZE, args.warmup, args.steps,
+                                         1, 0, threads).result()
+            results.append((result['mean_ms'], threads))
+            cpus = len(threads['cpus']) if threads['cpus'] else 'all'
+            print(f'{mode:<10} intra: {threads["intra_op_threads"] or "default":<8}',
+                  f'inter: {threads["inter_op_threads"] or "default":<8} cpus: {cpus:<5}',
+                  f'| mean: {result["mean_ms"]:8.1f}ms | p99: {result["p99_ms"]:8.1f}ms')
+
+        default_ms = results[0][0]
+        best_ms, best = min(results, key=lambda result: result[0])
+        tuned[mode] = dict(best, mean_ms=best_ms, default_mean_ms=default_ms)
+        print(f'{mode}: intra {best["intra_op_threads"]}, inter {best["inter_op_threads"]}, '
+              f'cpus {best["cpus"] or "all"}: {best_ms:.1f}ms, {default_ms / best_ms:.2f}x the defaults')
+
+    save_tuned(tuned, args.output)
+    print(f'Settings written to {args.output}')
+
+
+if __name__ == '__main__':
+    _main()
@@ -0,0 +1,140 @@
+"""
+Convert a checkpoint of the branch per cardinality ResNeXt blocks (variables conv<b>_<n>_<k>_c<i>) to the grouped
+convolution blocks of resnext50 (variables conv<b>_<n>_<k>).
+
+    python -m backbones.convert_resnext_checkpoint --input ./logs/<run>/model/<model>.ckpt-1000 \
+        --output ./converted/model.ckpt --check
+
+The reduce and grouped convolutions are concatenations of the branches, batch norm is per channel so their
+statistics are concatenated as well. The expand convolutions are summed after a batch norm each: the moving
+statistics of every branch are folded into its weights and the offsets summed into the single batch norm of the
+grouped block, which is exact with frozen batch norm. Optimizer slots of the branch variables are dropped.
+
+The folding is for inference only. The grouped block has one batch norm where the branches had one each, so
+training from a converted checkpoint trains a different model than the branch one, and its batch statistics in
+training mode differ from the start. Load converted checkpoints with RESNEXT_GROUPED_CONV = True.
+"""
+import argparse
+import re
+from collections import defaultdict
+
+import numpy as np
+import tensorflow as tf
+
+from backbones import resnext50
+
+
+_BRANCH_PATTERN = re.compile(r'^(?P<layer>.*conv\d+_\d+_(?P<conv>[123]))_c(?P<branch>\d+)/(?P<name>.+)$')
+
+_BN_STATISTICS = ('BatchNorm/beta', 'BatchNorm/gamma', 'BatchNorm/moving_mean', 'BatchNorm/moving_variance')
+
+
+def _concat_branches(branches, axis):
+    return np.concatenate([branches[i] for i in sorted(branches)], axis=axis)
+
+
+def _convert_layer(conv, variables, epsilon):
+    """
+    :param conv: '1' reduce, '2' grouped or '3' expand convolution.
+    :param variables: {variable name in the layer: {branch: value}}
+    :return: {variable name in the layer: value} of the grouped layer.
+    """
+    if conv in ('1', '2'):
+        return {name: _concat_branches(branches, axis=-1) for name, branches in variables.items()
+                if name == 'weights' or name in _BN_STATISTICS}
+
+    weights = variables['weights']
+    scales, offsets = {}, 0.
+    for i in sorted(weights):
+        gamma = variables['BatchNorm/gamma'][i] if 'BatchNorm/gamma' in variables else 1.
+        beta = variables['BatchNorm/beta'][i] if 'BatchNorm/beta' in variables else 0.
+        scales[i] = gamma / np.sqrt(variables['BatchNorm/moving_variance'][i] + epsilon)
+        offsets = offsets + beta - variables['BatchNorm/moving_mean'][i] * scales[i]
+
+    # The batch norm of the grouped layer is the identity plus the summed offsets.
+    num_outputs = weights[0].shape[-1]
+    return {'weights': np.concatenate([weights[i] * scales[i] for i in sorted(weights)], axis=2),
+            'BatchNorm/beta': np.float32(offsets),
+            'BatchNorm/moving_mean': np.zeros((num_outputs,), dtype=np.float32),
+            'BatchNorm/moving_variance': np.full((num_outputs,), 1. - epsilon, dtype=np.float32)}
+
+
+def convert_variables(variables, epsilon=None):
+    """
+    :param variables: {name: value} of a branch checkpoint.
+    :return: {name: value} of the grouped checkpoint, variables of other layers are kept as they are.
+    """
+    epsilon = resnext50._bn_params['epsilon'] if epsilon is None else epsilon
+
+    layers = defaultdict(lambda: defaultdict(dict))
+    converted = {}
+    for name, value in variables.items():
+        match = _BRANCH_PATTERN.match(name)
+        if match is None:
+            converted[name] = value
+        elif match.group('name') == 'weights' or match.group('name') in _BN_STATISTICS:
+            layer_variables = layers[(match.group('layer'), match.group('conv'))]
+            layer_variables[match.group('name')][int(match.group('branch'))] = value
+        # Optimizer slots of the branches, as weights/Adam, have no grouped counterpart.
+
+    for (layer, conv), layer_variables in layers.items():
+        for name, value in _convert_layer(conv, layer_variables, epsilon).items():
+            converted['{}/{}'.format(layer, name)] = np.float32(value)
+    return converted
+
+
+def convert_checkpoint(input_path, output_path):
+    reader = tf.train.load_checkpoint(input_path)
+    variables = {name: reader.get_tensor(name) for name in reader.get_variable_to_shape_map()}
+    converted = convert_variables(variables)
+
+    # Values are fed to assign ops, the graph stays small whatever the size of the checkpoint.
+    graph = tf.Graph()
+    with graph.as_default():
+        var_list, assign_ops, feed_dict = {}, [], {}
+        for name, value in converted.items():
+            dtype = tf.as_dtype(value.dtype)
+            var_list[name] = tf.Variable(tf.zeros(value.shape, dtype), name='converted')
+            placeholder = tf.placeholder(dtype, value.shape)
+            assign_ops.append(tf.assign(var_list[name], placeholder))
+            feed_dict[placeholder] = value
+        saver = tf.train.Saver(var_list)
+        with tf.Session(graph=graph) as sess:
+            sess.run(assign_ops, feed_dict=feed_dict)
+            saver.save(sess, output_path)
+    return len(variables), len(converted)
+
+
+def check_conversion(input_path, output_path, image_size=224, seed=0):
+    """
+    Run the branch and the grouped backbone with frozen batch norm on the same random image.
+    :return: maximum absolute difference of the feature maps.
+    """
+    image = np.random.RandomState(seed).uniform(0, 255, (1, image_size, image_size, 3)).astype(np.float32)
+    outputs = []
+    for grouped, path in ((False, input_path), (True, output_path)):
+        graph = tf.Graph()
+        with graph.as_default():
+            net = resnext50.inference(tf.constant(image), is_training=False, grouped=grouped)
+            saver = tf.train.Saver(tf.global_variables())
+            with tf.Session(graph=graph) as sess:
+                saver.restore(sess, path)
+                outputs.append(sess.run(net))
+    return float(np.max(np.abs(outputs[0] - outputs[1])))
+
+
+def _main():
+    parser = argparse.ArgumentParser(description='Convert a branch ResNeXt checkpoint to grouped convolutions.')
+    parser.add_argument('--input', required=True, help='Checkpoint prefix of the branch blocks.')
+    parser.add_argument('--output', required=True, help='Checkpoint prefix to write.')
+    parser.add_argument('--check', action='store_true', help='Compare the backbone outputs of both checkpoints.')
+    args = parser.parse_args()
+
+    num_variables, num_converted = convert_checkpoint(args.input, args.output)
+    print(f'{num_variables} variables converted to {num_converted}: {args.output}')
+    if args.check:
+        print(f'max feature difference: {check_conversion(args.input, args.output):.3g}')
+
+
+if __name__ == '__main__':
+    _main()
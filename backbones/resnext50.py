@@ -1,6 +1,8 @@
 import tensorflow as tf
 from tensorflow.contrib import slim
 
+import faster_rcnn_configs as frc
+
 
 _bn_params = {'decay': 0.995, 'epsilon': 0.0001}
 _l2_weight = 0.0005
@@ -8,7 +10,11 @@ _l2_weight = 0.0005
 # STRIDE_SIZE = 16
 
 
-def _conv2d_block(net, filters, block_num, conv_num, cardinality=32, projection=False, is_trining=True):
+def _conv2d_block(net, filters, block_num, conv_num, cardinality=32, projection=False, is_trining=True,
+                  grouped=False):
+    if grouped:
+        return _grouped_conv2d_block(net, filters, block_num, conv_num, cardinality, projection, is_trining)
+
     with slim.arg_scope([slim.conv2d], padding='SAME', activation_fn=tf.nn.relu,
                         normalizer_fn=slim.batch_norm,
                         normalizer_params=_bn_params,
@@ -38,8 +44,64 @@ def _conv2d_block(net, filters, block_num, conv_num, cardinality=32, projection=
         return tf.nn.relu(net + residul_net, name='conv{}_relu'.format(block_num))
 
 
-def inference(inputs, is_training=True, name='resnext50'):
-    with tf.variable_scope(name, 'resnext50'):
+def _grouped_conv2d(net, num_outputs, kernel_size, groups, trainable=True, scope=None):
+    """
+    Convolution of groups independent slices of the input channels, with one weight variable
+    [kernel_size, kernel_size, input_channels / groups, num_outputs], followed by batch norm and relu.
+    The output channels [i * num_outputs / groups, (i + 1) * num_outputs / groups) only see the input group i.
+    """
+    input_channels = net.get_shape().as_list()[-1]
+    with tf.variable_scope(scope):
+        weights = slim.model_variable('weights',
+                                      shape=[kernel_size, kernel_size, input_channels // groups, num_outputs],
+                                      initializer=slim.xavier_initializer(),
+                                      regularizer=slim.l2_regularizer(_l2_weight),
+                                      trainable=trainable)
+
+        # CPU kernels of tf.nn.conv2d have no group support, split the input and the weights instead.
+        net_groups = tf.split(net, groups, axis=3)
+        weight_groups = tf.split(weights, groups, axis=3)
+        net = tf.concat([tf.nn.conv2d(net_group, weight_group, [1, 1, 1, 1], padding='SAME')
+                         for net_group, weight_group in zip(net_groups, weight_groups)], axis=3)
+
+        net = slim.batch_norm(net, trainable=trainable, scope='BatchNorm', **_bn_params)
+    return tf.nn.relu(net)
+
+
+def _grouped_conv2d_block(net, filters, block_num, conv_num, cardinality=32, projection=False, is_trining=True):
+    """
+    Block of cardinality branches as three convolutions: the 1 x 1 reduce convolutions of all branches are one
+    convolution, the 3 x 3 convolutions one grouped convolution and the 1 x 1 expand convolutions, summed, one
+    convolution. The expand convolution has a single batch norm instead of one per branch, so the block only computes
+    the same function as the branches with frozen batch norm: training it is training a different model.
+    Its variables are named conv<b>_<n>_<k>, convert branch checkpoints with backbones.convert_resnext_checkpoint.
+    """
+    with slim.arg_scope([slim.conv2d], padding='SAME', activation_fn=tf.nn.relu,
+                        normalizer_fn=slim.batch_norm,
+                        normalizer_params=_bn_params,
+                        weights_regularizer=slim.l2_regularizer(_l2_weight),
+                        trainable=is_trining):
+        residul_net = slim.conv2d(net, filters, [1, 1], 2 if projection else 1,
+                                  scope='conv{}_{}_1'.format(block_num, conv_num))
+        residul_net = _grouped_conv2d(residul_net, filters, 3, cardinality, trainable=is_trining,
+                                      scope='conv{}_{}_2'.format(block_num, conv_num))
+        residul_net = slim.conv2d(residul_net, 2 * filters, [1, 1], activation_fn=None,
+                                  scope='conv{}_{}_3'.format(block_num, conv_num))
+
+        if projection:
+            net = slim.conv2d(net, 2 * filters, [3, 3], 2, activation_fn=None, normalizer_fn=slim.batch_norm,
+                              normalizer_params=_bn_params, weights_regularizer=slim.l2_regularizer(_l2_weight),
+                              scope='conv{}_branch'.format(block_num))
+
+        return tf.nn.relu(net + residul_net, name='conv{}_relu'.format(block_num))
+
+
+def inference(inputs, is_training=True, name='resnext50', grouped=None):
+    """
+    :param grouped: grouped convolution blocks instead of the branches, frc.RESNEXT_GROUPED_CONV by default.
+    """
+    grouped = frc.RESNEXT_GROUPED_CONV if grouped is None else grouped
+    with tf.variable_scope(name, 'resnext50'), slim.arg_scope([slim.batch_norm], is_training=is_training):
 
         # conv1 224 x 224 x 3 => 112 x 112 x 64
         with tf.variable_scope(name + '_conv1'):
@@ -55,37 +117,39 @@ def inference(inputs, is_training=True, name='resnext50'):
         with tf.variable_scope(name + '_conv2'):
             for i in range(3):
                 if i == 0:
-                    net = _conv2d_block(net, 128, 2, i, projection=True)
+                    net = _conv2d_block(net, 128, 2, i, projection=True, is_trining=is_training, grouped=grouped)
                 else:
-                    net = _conv2d_block(net, 128, 2, i)
+                    net = _conv2d_block(net, 128, 2, i, is_trining=is_training, grouped=grouped)
 
         # conv3 56 x 56 x 256 => 28 x 28 x 512
         with tf.variable_scope(name + '_conv3'):
             for i in range(4):
                 if i == 0:
-                    net = _conv2d_block(net, 256, 3, i, projection=True)
+                    net = _conv2d_block(net, 256, 3, i, projection=True, is_trining=is_training, grouped=grouped)
                 else:
-                    net = _conv2d_block(net, 256, 3, i)
+                    net = _conv2d_block(net, 256, 3, i, is_trining=is_training, grouped=grouped)
 
         # conv4 28 x 28 x 512 => 14 x 14 x 1024
         with tf.variable_scope(name + '_conv4'):
             for i in range(6):
                 if i == 0:
-                    net = _conv2d_block(net, 512, 4, i, projection=True)
+                    net = _conv2d_block(net, 512, 4, i, projection=True, is_trining=is_training, grouped=grouped)
                 else:
-                    net = _conv2d_block(net, 512, 4, i)
+                    net = _conv2d_block(net, 512, 4, i, is_trining=is_training, grouped=grouped)
     return net
 
 
-def head(net):
-    with tf.variable_scope('resnext50', reuse=tf.AUTO_REUSE):
+def head(net, is_training=True, grouped=None):
+    grouped = frc.RESNEXT_GROUPED_CONV if grouped is None else grouped
+    with tf.variable_scope('resnext50', reuse=tf.AUTO_REUSE), \
+            slim.arg_scope([slim.batch_norm], is_training=is_training):
         # conv5 14 x 14 x 1024 => 7 x 7 x 2048
         with tf.variable_scope('resnext50_conv5'):
             for i in range(3):
                 if i == 0:
-                    net = _conv2d_block(net, 1024, 5, i, projection=True)
+                    net = _conv2d_block(net, 1024, 5, i, projection=True, is_trining=is_training, grouped=grouped)
                 else:
-                    net = _conv2d_block(net, 1024, 5, i)
+                    net = _conv2d_block(net, 1024, 5, i, is_trining=is_training, grouped=grouped)
 
         # global average pooling
         net = tf.reduce_mean(net, axis=[1, 2], name='global_average_pooling')
@@ -14,7 +14,7 @@ def inference(inputs, num_layers=11, is_training=True, name='vgg'):
     assert num_layers in [11, 13, 16, 19]
 
     name = name + str(num_layers)
-    with tf.variable_scope(name):
+    with tf.variable_scope(name), slim.arg_scope([slim.batch_norm], is_training=is_training):
         with slim.arg_scope([slim.conv2d], padding='SAME', activation_fn=tf.nn.leaky_relu,
                             normalizer_fn=slim.batch_norm, normalizer_params=_bn_params,
                             weights_regularizer=slim.l2_regularizer(_l2_weight), trainable=is_training):
@@ -59,7 +59,7 @@ def head(net, feature_dim=1024, num_layers=11, is_training=True, name='vgg'):
     assert num_layers in [11, 13, 16, 19]
 
     name = name + str(num_layers)
-    with tf.variable_scope(name, reuse=tf.AUTO_REUSE):
+    with tf.variable_scope(name, reuse=tf.AUTO_REUSE), slim.arg_scope([slim.batch_norm], is_training=is_training):
         with slim.arg_scope([slim.conv2d, slim.fully_connected], activation_fn=tf.nn.leaky_relu,
                             weights_regularizer=slim.l2_regularizer(_l2_weight), trainable=is_training):
             with slim.arg_scope([slim.conv2d], padding='SAME',
@@ -82,6 +82,10 @@ def head(net, feature_dim=1024, num_layers=11, is_training=True, name='vgg'):
                 # net = slim.fully_connected(net, feature_dim, activation_fn=None, scope=name + '_fc8')
 
                 # Change fully connected to 1 x 1 convolution and global average pooling.
-                net = slim.repeat(net, 2, slim.conv2d, num_outputs=feature_dim, kernel_size=[1, 1])
+                # Same variable names as slim.repeat without scope, whose default scope would become Repeat_1 when
+                # head is called again, as the chunked head does.
+                with tf.variable_scope('Repeat'):
+                    for i in range(2):
+                        net = slim.conv2d(net, feature_dim, [1, 1], scope='{}_{}'.format(slim.conv2d.__name__, i + 1))
         net = tf.reduce_mean(net, axis=[1, 2], name='global_average_pooling')
     return net
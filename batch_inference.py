@@ -0,0 +1,181 @@
+"""
+Headless batch inference with a model written by export_model.py. Images are read from directories, glob patterns,
+image files or shard directories written by toy_dataset.build_shards, and one JSON line is written per image.
+
+    python batch_inference.py --model ./export --output detections.jsonl ./images ./data/shapes '/data/*.png'
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from detector import Detector
+from toy_dataset.shards import Shard, list_shards
+from utils.session_config import pin_process, session_config
+
+import faster_rcnn_configs as frc
+
+
+_IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+
+def image_sources(inputs):
+    """
+    Expand inputs into (name, loader) pairs, loader() returns the image. Shard images are named <prefix>:<index>.
+    """
+    for path in inputs:
+        if os.path.isdir(path):
+            prefixes = list_shards(path)
+            if prefixes:
+                for prefix in prefixes:
+                    shard = Shard(prefix)
+                    for i in range(len(shard)):
+                        yield '{}:{}'.format(prefix, i), lambda shard=shard, i=i: shard[i][0]
+                continue
+            paths = sorted(os.path.join(path, name) for name in os.listdir(path)
+                           if name.lower().endswith(_IMAGE_EXTENSIONS))
+        elif os.path.isfile(path):
+            paths = [path]
+        else:
+            paths = sorted(glob.glob(path))
+
+        for image_path in paths:
+            yield image_path, lambda image_path=image_path: cv2.imread(image_path, cv2.IMREAD_COLOR)
+
+
+def _load(source, image_shape):
+    name, loader = source
+    start_time = time.time()
+    image = loader()
+    if image is None:
+        return name, None, None, time.time() - start_time
+
+    original_shape = image.shape[:2]
+    if tuple(original_shape) != tuple(image_shape):
+        image = cv2.resize(image, (image_shape[1], image_shape[0]))
+    return name, np.asarray(image, dtype=np.uint8), original_shape, time.time() - start_time
+
+
+def _loaded_images(sources, image_shape, num_workers, prefetch):
+    """
+    Load images with num_workers threads, up to prefetch images ahead, in the order of sources.
+    """
+    if num_workers <= 0:
+        for source in sources:
+            yield _load(source, image_shape)
+        return
+
+    with ThreadPoolExecutor(num_workers) as executor:
+        pending = deque()
+        for source in sources:
+            pending.append(executor.submit(_load, source, image_shape))
+            if len(pending) >= prefetch:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _batches(loaded_images, batch_size):
+    batch = []
+    for name, image, original_shape, load_time in loaded_images:
+        if image is None:
+            print('Cannot read {}'.format(name), file=sys.stderr)
+            continue
+        batch.append((name, image, original_shape, load_time))
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _record(name, original_shape, image_shape, boxes, scores, classes, class_names, latency, load_time):
+    # Boxes are scaled back to the original image size
+    scale_y = original_shape[0] / image_shape[0]
+    scale_x = original_shape[1] / image_shape[1]
+    boxes = boxes * np.float32([scale_x, scale_y, scale_x, scale_y])
+    return {'image': name,
+            'boxes': np.round(np.float64(boxes), 2).tolist(),
+            'scores': np.round(np.float64(scores), 4).tolist(),
+            'categories': [int(category) for category in classes],
+            'category_names': [class_names[category] if category < len(class_names) else str(category)
+                               for category in classes],
+            'latency_ms': round(latency * 1000, 3),
+            'load_ms': round(load_time * 1000, 3)}
+
+
+def run_batch_inference(detector, inputs, output, batch_size=None, num_workers=4, score_threshold=None):
+    """
+    Detect objects in all images of inputs and write one JSON line per image to output.
+    :param detector: detector.Detector
+    :param inputs: Directories, shard directories, glob patterns or image files.
+    :param output: Writable text file.
+    :param batch_size: Images of one detector call, the exported batch size by default.
+    :param num_workers: Threads reading and resizing images.
+    :param score_threshold: Detections with lower scores are not written.
+    :return: number of images, wall time and the latency of each batch in seconds.
+    """
+    batch_size = batch_size or detector.batch_size
+    score_threshold = frc.TEST_SCORE_THRESHOLD if score_threshold is None else score_threshold
+
+    loaded_images = _loaded_images(image_sources(inputs), detector.image_shape, num_workers,
+                                   prefetch=max(2 * batch_size, num_workers))
+    num_images, latencies = 0, []
+    start_time = time.time()
+    for batch in _batches(loaded_images, batch_size):
+        batch_start_time = time.time()
+        results = detector.detect(np.stack([image for _, image, _, _ in batch]))
+        latency = time.time() - batch_start_time
+        latencies.append(latency)
+
+        for (name, _, original_shape, load_time), (boxes, scores, classes) in zip(batch, results):
+            selected = scores >= score_threshold
+            record = _record(name, original_shape, detector.image_shape, boxes[selected], scores[selected],
+                             classes[selected], detector.class_names, latency, load_time)
+            output.write(json.dumps(record) + '\n')
+        output.flush()
+        num_images += len(batch)
+    return num_images, time.time() - start_time, latencies
+
+
+def _main():
+    parser = argparse.ArgumentParser(description='Run an exported detector over a set of images.')
+    parser.add_argument('inputs', nargs='+', help='Image directories, shard directories, glob patterns or images.')
+    parser.add_argument('--model', required=True, help='Directory written by export_model.py.')
+    parser.add_argument('--output', default='-', help='JSONL file, standard output by default.')
+    parser.add_argument('--batch-size', type=int, default=None, help='Exported batch size by default.')
+    parser.add_argument('--workers', type=int, default=4, help='Threads reading images.')
+    parser.add_argument('--score-threshold', type=float, default=frc.TEST_SCORE_THRESHOLD)
+    args = parser.parse_args()
+
+    pin_process('inference')
+    detector = Detector(args.model, config=session_config('inference'))
+    print(f'Model loaded in {detector.load_time:.3}s', file=sys.stderr)
+
+    output = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        num_images, wall_time, latencies = run_batch_inference(detector, args.inputs, output, args.batch_size,
+                                                               args.workers, args.score_threshold)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        detector.close()
+
+    if num_images == 0:
+        print('No image found.', file=sys.stderr)
+        return
+
+    p50, p95, p99 = np.percentile(np.float64(latencies) * 1000, [50, 95, 99])
+    print(f'{num_images} images in {wall_time:.3}s | {num_images / wall_time:.1f} images/s',
+          f'| batch latency p50: {p50:.1f}ms p95: {p95:.1f}ms p99: {p99:.1f}ms', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    _main()
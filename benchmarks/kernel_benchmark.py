@@ -0,0 +1,184 @@
+"""
+Time and peak memory of the NumPy box and target assignment kernels over a sweep of image sizes (anchor counts),
+ground truth boxes per image and proposal counts. Results are written as JSON and compared with a previous result
+file, a kernel slower than its baseline by more than --threshold is reported as a regression and the exit status
+is 1.
+
+    python -m benchmarks.kernel_benchmark --output kernels.json
+    python -m benchmarks.kernel_benchmark --baseline kernels.json --threshold 0.1
+    python -m benchmarks.kernel_benchmark --image-sizes 448 --num-gt 4 16 --kernels get_overlaps_py encode_bboxes
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from region_proposal_network import generate_rpn_labels_py, get_anchor_geometry, get_overlaps_py, \
+    process_proposal_targets_py, rpn_feature_shape
+from utils.anchor_cache import shift_anchors
+from utils.anchor_utils import encode_bboxes, generate_anchors
+
+import faster_rcnn_configs as frc
+
+
+def random_gt_bboxes(num_gt, image_size, random):
+    """
+    num_gt ground truth boxes [x1, y1, x2, y2, label] int32 inside a square image, as the input pipeline gives them.
+    """
+    sizes = random.randint(16, max(17, image_size // 3), (num_gt, 2))
+    corners = random.randint(0, image_size - sizes)
+    return np.hstack([corners, corners + sizes - 1, random.randint(1, frc.NUM_CLS + 1, (num_gt, 1))]).astype(np.int32)
+
+
+def random_proposals(num_proposals, gt_bboxes, image_size, random):
+    # Half jittered ground truth, half anywhere in the image, as rpn proposals early in training.
+    num_jittered = num_proposals // 2
+    jittered = gt_bboxes[random.randint(0, len(gt_bboxes), num_jittered), :4] + \
+        random.normal(0, 8, (num_jittered, 4))
+    corners = random.uniform(0, image_size - 1, (num_proposals - num_jittered, 2, 2))
+    anywhere = np.hstack([corners.min(axis=1), corners.max(axis=1)])
+    boxes = np.clip(np.vstack([jittered, anywhere]), 0, image_size - 1)
+    boxes = np.hstack([np.minimum(boxes[:, :2], boxes[:, 2:]), np.maximum(boxes[:, :2], boxes[:, 2:])])
+    return boxes.astype(np.float32)
+
+
+def _cases(image_sizes, num_gts, num_proposals, seed):
+    """
+    :return: [(kernel name, params, function)], the inputs of every case are built here, out of the timings.
+    """
+    cases = []
+    for image_size in image_sizes:
+        image_shape = [image_size, image_size]
+        feature_shape = rpn_feature_shape(image_shape)
+        anchors = get_anchor_geometry(feature_shape, image_shape).anchors
+        anchor_params = {'image_size': image_size, 'num_anchors': len(anchors)}
+
+        # Base anchors and their shifts over the feature map, as an uncached anchor lookup.
+        cases.append(('generate_anchors', anchor_params,
+                      lambda feature_shape=feature_shape: shift_anchors(
+                          generate_anchors(original_anchor=[1, 1, frc.ANCHOR_BASE_SIZE - 1, frc.ANCHOR_BASE_SIZE - 1],
+                                           scales=frc.ANCHOR_SCALE, ratios=frc.ANCHOR_RATE),
+                          feature_shape, frc.FEATURE_STRIDE)))
+
+        random = np.random.RandomState(seed)
+        matched_gt = random_gt_bboxes(len(anchors), image_size, random)[:, :4]
+        cases.append(('encode_bboxes', anchor_params,
+                      lambda anchors=anchors, matched_gt=matched_gt: encode_bboxes(anchors, matched_gt)))
+
+        for num_gt in num_gts:
+            gt_bboxes = random_gt_bboxes(num_gt, image_size, np.random.RandomState(seed))
+            params = dict(anchor_params, num_gt=num_gt)
+            cases.append(('get_overlaps_py', params,
+                          lambda anchors=anchors, gt_bboxes=gt_bboxes: get_overlaps_py(anchors, gt_bboxes[:, :4])))
+            cases.append(('generate_rpn_labels_py', params,
+                          lambda anchors=anchors, gt_bboxes=gt_bboxes, image_shape=image_shape,
+                          feature_shape=feature_shape:
+                          generate_rpn_labels_py(anchors, gt_bboxes, image_shape, feature_shape)))
+
+            for num_proposal in num_proposals:
+                rois = random_proposals(num_proposal, gt_bboxes, image_size, np.random.RandomState(seed))
+                cases.append(('process_proposal_targets_py',
+                              {'image_size': image_size, 'num_gt': num_gt, 'num_proposals': num_proposal},
+                              lambda rois=rois, gt_bboxes=gt_bboxes: process_proposal_targets_py(rois, gt_bboxes)))
+    return cases
+
+
+def _key(result):
+    return '{} {}'.format(result['kernel'], json.dumps(result['params'], sort_keys=True))
+
+
+def run_case(function, repeats, seed=0):
+    """
+    :return: median and minimum milliseconds of repeats calls and the peak megabytes allocated by one call.
+    """
+    # The kernels sample with np.random, every call sees the same random state.
+    np.random.seed(seed)
+    function()
+
+    times = []
+    for _ in range(repeats):
+        np.random.seed(seed)
+        start_time = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start_time)
+
+    # tracemalloc slows the allocations down, the peak is measured on a separate call.
+    np.random.seed(seed)
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'median_ms': float(np.median(times) * 1000),
+            'min_ms': float(np.min(times) * 1000),
+            'peak_mb': peak / 2 ** 20}
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare the minimum times of results with the cases of the same kernel and params in baseline, the minimum is
+    the least disturbed by other processes.
+    :return: [(key, baseline ms, ms, ratio, regression)] of the cases found in both.
+    """
+    baseline_results = {_key(result): result for result in baseline['results']}
+    comparisons = []
+    for result in results:
+        key = _key(result)
+        if key not in baseline_results:
+            continue
+        baseline_ms = baseline_results[key]['min_ms']
+        ratio = result['min_ms'] / max(baseline_ms, 1e-9)
+        comparisons.append((key, baseline_ms, result['min_ms'], ratio, ratio > 1 + threshold))
+    return comparisons
+
+
+def _main():
+    parser = argparse.ArgumentParser(description='Benchmark the NumPy box and target assignment kernels.')
+    parser.add_argument('--image-sizes', type=int, nargs='+', default=[frc.IMAGE_SHAPE[0], 640, 896])
+    parser.add_argument('--num-gt', type=int, nargs='+', default=[4, frc.TOY_OBJECTS_PER_IMAGE, 64])
+    parser.add_argument('--num-proposals', type=int, nargs='+', default=[frc.RPN_PROPOSAL_MAX_TRAIN, 6000])
+    parser.add_argument('--kernels', nargs='+', default=None, help='Kernels to run, all by default.')
+    parser.add_argument('--repeats', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='JSON file to write the results to.')
+    parser.add_argument('--baseline', default=None, help='JSON results of a previous run to compare with.')
+    parser.add_argument('--threshold', type=float, default=0.1, help='Slowdown reported as regression, 0.1: 10%%.')
+    args = parser.parse_args()
+
+    results = []
+    print(f'{"kernel":<30}{"params":<60}{"median ms":>10}{"min ms":>10}{"peak MB":>10}')
+    for kernel, params, function in _cases(args.image_sizes, args.num_gt, args.num_proposals, args.seed):
+        if args.kernels and kernel not in args.kernels:
+            continue
+        result = dict(kernel=kernel, params=params, **run_case(function, args.repeats, args.seed))
+        results.append(result)
+        print(f'{kernel:<30}{json.dumps(params):<60}{result["median_ms"]:>10.3f}{result["min_ms"]:>10.3f}'
+              f'{result["peak_mb"]:>10.2f}')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'python': platform.python_version(),
+                       'numpy': np.__version__,
+                       'machine': platform.machine(),
+                       'processor': platform.processor(),
+                       'repeats': args.repeats,
+                       'results': results}, f, indent=2)
+        print(f'Results written to {args.output}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            comparisons = compare(results, json.load(f), args.threshold)
+        print(f'\n{"case":<90}{"baseline ms":>12}{"ms":>10}{"ratio":>8}')
+        for key, baseline_ms, ms, ratio, regression in comparisons:
+            print(f'{key:<90}{baseline_ms:>12.3f}{ms:>10.3f}{ratio:>8.2f}{"  REGRESSION" if regression else ""}')
+        num_regressions = sum(comparison[-1] for comparison in comparisons)
+        print(f'{num_regressions} regression(s) over {args.threshold:.0%} in {len(comparisons)} compared cases')
+        if num_regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    _main()
@@ -0,0 +1,90 @@
+"""
+Compare utils.nms with tf.image.non_max_suppression on the RPN proposal workload: RPN_TOP_K_NMS_TRAIN jittered
+anchors, RPN_NMS_IOU_THRESHOLD and RPN_PROPOSAL_MAX_TRAIN.
+
+    python -m benchmarks.nms_benchmark --repeats 20
+"""
+import argparse
+import math
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from utils.anchor_cache import cached_anchors
+from utils.nms import nms, soft_nms, batched_nms
+
+import faster_rcnn_configs as frc
+
+
+def rpn_workload(num_boxes, seed=0):
+    """
+    num_boxes proposals like process_rpn_proposals sees them: anchors of a feature map large enough, jittered,
+    clipped to the image and sorted by score.
+    """
+    side = int(math.ceil(math.sqrt(num_boxes / frc.ANCHOR_NUM)))
+    image_size = side * frc.FEATURE_STRIDE
+    anchors = cached_anchors([side, side], frc.FEATURE_STRIDE, frc.ANCHOR_BASE_SIZE, frc.ANCHOR_SCALE,
+                             frc.ANCHOR_RATE)
+
+    random = np.random.RandomState(seed)
+    sizes = np.tile(anchors[:, 2:] - anchors[:, :2] + 1, 2)
+    boxes = anchors + random.normal(0, 0.1, anchors.shape).astype(np.float32) * sizes
+    boxes = np.clip(boxes, 0, image_size - 1).astype(np.float32)
+    scores = random.rand(len(boxes)).astype(np.float32)
+
+    order = np.argsort(-scores, kind='stable')[:num_boxes]
+    return boxes[order], scores[order]
+
+
+def _time(function, repeats):
+    function()
+    start_time = time.time()
+    for _ in range(repeats):
+        result = function()
+    return result, (time.time() - start_time) / repeats
+
+
+def _main():
+    parser = argparse.ArgumentParser(description='Benchmark NumPy NMS against tf.image.non_max_suppression.')
+    parser.add_argument('--num-boxes', type=int, default=frc.RPN_TOP_K_NMS_TRAIN)
+    parser.add_argument('--repeats', type=int, default=10)
+    parser.add_argument('--threads', type=int, default=frc.NUM_CLS)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    boxes, scores = rpn_workload(args.num_boxes, args.seed)
+    iou_threshold, max_output_size = frc.RPN_NMS_IOU_THRESHOLD, frc.RPN_PROPOSAL_MAX_TRAIN
+    print(f'{len(boxes)} boxes, iou threshold {iou_threshold}, max output {max_output_size}')
+
+    keep, numpy_time = _time(lambda: nms(boxes, scores, iou_threshold, max_output_size), args.repeats)
+
+    graph = tf.Graph()
+    with graph.as_default():
+        boxes_input = tf.placeholder(tf.float32, [None, 4])
+        scores_input = tf.placeholder(tf.float32, [None])
+        keep_op = tf.image.non_max_suppression(boxes_input, scores_input, max_output_size, iou_threshold)
+    with tf.Session(graph=graph) as sess:
+        feed_dict = {boxes_input: boxes, scores_input: scores}
+        tf_keep, tf_time = _time(lambda: sess.run(keep_op, feed_dict=feed_dict), args.repeats)
+
+    same = len(keep) == len(tf_keep) and np.array_equal(keep, tf_keep)
+    print(f'numpy nms:      {numpy_time * 1000:8.2f} ms, {len(keep)} kept')
+    print(f'tf nms:         {tf_time * 1000:8.2f} ms, {len(tf_keep)} kept, same selection: {same}')
+
+    for method in ('linear', 'gaussian'):
+        soft_keep, soft_time = _time(lambda: soft_nms(boxes, scores, iou_threshold, method=method,
+                                                      max_output_size=max_output_size)[0], args.repeats)
+        print(f'soft-nms {method:8}{soft_time * 1000:8.2f} ms, {len(soft_keep)} kept')
+
+    # Class aware NMS over the same boxes split into NUM_CLS categories.
+    categories = np.random.RandomState(args.seed).randint(1, frc.NUM_CLS + 1, len(boxes))
+    for num_threads in sorted({1, args.threads}):
+        batched_keep, batched_time = _time(lambda: batched_nms(boxes, scores, categories, iou_threshold,
+                                                               max_output_size, num_threads=num_threads)[0],
+                                           args.repeats)
+        print(f'batched nms, {num_threads} thread(s): {batched_time * 1000:8.2f} ms, {len(batched_keep)} kept')
+
+
+if __name__ == '__main__':
+    _main()
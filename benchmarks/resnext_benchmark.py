@@ -0,0 +1,74 @@
+"""
+Compare the branch per cardinality and the grouped convolution ResNeXt blocks: graph build time, graph size and
+forward time of the backbone and of the head on a batch of rois.
+
+    python -m benchmarks.resnext_benchmark --image-size 448 --num-rois 64 --repeats 5
+"""
+import argparse
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from backbones import resnext50
+
+
+def _benchmark(grouped, image_size, num_rois, roi_size, repeats, train_step):
+    graph = tf.Graph()
+    with graph.as_default():
+        images = tf.placeholder(tf.float32, [1, image_size, image_size, 3])
+        rois = tf.placeholder(tf.float32, [num_rois, roi_size, roi_size, 1024])
+
+        start_time = time.time()
+        features = resnext50.inference(images, is_training=train_step, grouped=grouped)
+        head = resnext50.head(rois, is_training=train_step, grouped=grouped)
+        fetches = [features, head]
+        if train_step:
+            loss = tf.reduce_mean(features) + tf.reduce_mean(head)
+            with tf.control_dependencies(tf.get_collection(tf.GraphKeys.UPDATE_OPS)):
+                fetches.append(tf.train.GradientDescentOptimizer(0.01).minimize(loss))
+        build_time = time.time() - start_time
+
+        num_ops = len(graph.get_operations())
+        num_variables = len(tf.global_variables())
+        num_parameters = int(sum(np.prod(var.get_shape().as_list()) for var in tf.trainable_variables()))
+
+        random = np.random.RandomState(0)
+        feed_dict = {images: random.uniform(0, 255, (1, image_size, image_size, 3)).astype(np.float32),
+                     rois: random.uniform(0, 1, (num_rois, roi_size, roi_size, 1024)).astype(np.float32)}
+        with tf.Session(graph=graph) as sess:
+            sess.run(tf.global_variables_initializer())
+            sess.run(fetches, feed_dict=feed_dict)
+
+            start_time = time.time()
+            for _ in range(repeats):
+                sess.run(fetches, feed_dict=feed_dict)
+            step_time = (time.time() - start_time) / repeats
+
+    return build_time, num_ops, num_variables, num_parameters, step_time
+
+
+def _main():
+    parser = argparse.ArgumentParser(description='Benchmark the branch and grouped ResNeXt blocks.')
+    parser.add_argument('--image-size', type=int, default=224)
+    parser.add_argument('--num-rois', type=int, default=64, help='Rois through the head.')
+    parser.add_argument('--roi-size', type=int, default=7, help='Size of the pooled roi features.')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--train', action='store_true', help='Time a training step instead of a forward pass.')
+    args = parser.parse_args()
+
+    print(f'image {args.image_size}x{args.image_size}, {args.num_rois} rois of {args.roi_size}x{args.roi_size},',
+          'training step' if args.train else 'forward pass')
+    for grouped in (False, True):
+        build_time, num_ops, num_variables, num_parameters, step_time = _benchmark(
+            grouped, args.image_size, args.num_rois, args.roi_size, args.repeats, args.train)
+        print(f'{"grouped" if grouped else "branches":8}',
+              f'| build: {build_time:7.2f}s',
+              f'| ops: {num_ops:6}',
+              f'| variables: {num_variables:5}',
+              f'| parameters: {num_parameters / 1e6:6.2f}M',
+              f'| step: {step_time * 1000:8.1f}ms')
+
+
+if __name__ == '__main__':
+    _main()
@@ -0,0 +1,86 @@
+"""
+Peak resident memory and latency of the inference RCNN head for several FASTER_RCNN_HEAD_CHUNK_SIZE values. Every
+chunk size runs in its own process, so the peak memory of one run does not hide the next one. All runs restore the
+same random weights and their outputs are compared with the unchunked head.
+
+    python -m benchmarks.roi_head_benchmark --num-rois 2000 --chunk-sizes 0 500 250 100
+"""
+import argparse
+import os
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+import faster_rcnn_configs as frc
+
+
+def _run(chunk_size, num_rois, repeats, checkpoint_path, save):
+    # TensorFlow is only imported by the child processes, the parent stays small.
+    import tensorflow as tf
+    from faster_rcnn import faster_rcnn
+
+    image_height, image_width = frc.IMAGE_SHAPE
+    random = np.random.RandomState(0)
+    features_value = random.uniform(0, 1, (1, image_height // frc.FEATURE_STRIDE, image_width // frc.FEATURE_STRIDE,
+                                           512)).astype(np.float32)
+    corners = random.uniform(0, 1, (num_rois, 2, 2)) * [image_width - 1, image_height - 1]
+    rois_value = np.hstack([corners.min(axis=1), corners.max(axis=1)]).astype(np.float32)
+
+    graph = tf.Graph()
+    with graph.as_default():
+        features = tf.constant(features_value)
+        rois = tf.constant(rois_value)
+        cls_score, bbox_pred = faster_rcnn(features, rois, frc.IMAGE_SHAPE, is_training=False,
+                                           head_chunk_size=chunk_size)
+        saver = tf.train.Saver(tf.global_variables())
+
+        with tf.Session(graph=graph) as sess:
+            if save:
+                sess.run(tf.global_variables_initializer())
+                saver.save(sess, checkpoint_path)
+            else:
+                saver.restore(sess, checkpoint_path)
+
+            # ru_maxrss is the peak of the process in KB, taken before and after the runs.
+            base_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            outputs = sess.run([cls_score, bbox_pred])
+            start_time = time.time()
+            for _ in range(repeats):
+                sess.run([cls_score, bbox_pred])
+            latency = (time.time() - start_time) / max(1, repeats)
+            peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return outputs, latency, (peak_memory - base_memory) / 1024.
+
+
+def _main():
+    parser = argparse.ArgumentParser(description='Benchmark the chunked RCNN head.')
+    parser.add_argument('--num-rois', type=int, default=frc.RPN_PROPOSAL_MAX_TRAIN)
+    parser.add_argument('--chunk-sizes', type=int, nargs='+', default=[500, 250, 100, 50])
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f'{frc.BACKBONE} head, {args.num_rois} rois')
+    context = get_context('spawn')
+    with tempfile.TemporaryDirectory() as checkpoint_dir:
+        checkpoint_path = os.path.join(checkpoint_dir, 'head.ckpt')
+        reference = None
+        for chunk_size in [0] + [size for size in args.chunk_sizes if size > 0]:
+            with ProcessPoolExecutor(1, mp_context=context) as executor:
+                outputs, latency, peak_memory = executor.submit(_run, chunk_size, args.num_rois, args.repeats,
+                                                                checkpoint_path, reference is None).result()
+            if reference is None:
+                reference = outputs
+            difference = max(float(np.max(np.abs(output - expected))) for output, expected in zip(outputs, reference))
+            print(f'chunk size {chunk_size or "all":>5}',
+                  f'| latency: {latency * 1000:8.1f}ms',
+                  f'| peak memory increase: {peak_memory:8.1f}MB',
+                  f'| max output difference: {difference:.3g}')
+
+
+if __name__ == '__main__':
+    _main()
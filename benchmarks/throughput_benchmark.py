@@ -0,0 +1,218 @@
+"""
+End to end training and inference throughput on synthetic toy images, for several backbones, image shapes and
+proposal budgets. Every run builds its graph from faster_rcnn_configs with the given overrides in a process of its
+own, so neither the overrides nor the peak memory leak into the next run. The synthetic batches are generated
+before the graph and embedded into it, the measured steps only select one of them.
+
+    python -m benchmarks.throughput_benchmark --modes train inference --backbones vgg resnext50 --output runs.json
+    python -m benchmarks.throughput_benchmark --modes inference --image-shapes 448x448 640x640 --proposals 300 1000
+    python -m benchmarks.throughput_benchmark --set RPN_TOP_K_NMS_TRAIN=6000 --set FASTER_RCNN_HEAD_CHUNK_SIZE=250
+"""
+import argparse
+import ast
+import itertools
+import json
+import os
+import platform
+import resource
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+import faster_rcnn_configs as frc
+
+
+def apply_overrides(overrides):
+    """
+    Set the faster_rcnn_configs values of overrides {name: value}, unknown names are rejected.
+    """
+    for name, value in overrides.items():
+        if not hasattr(frc, name):
+            raise ValueError('faster_rcnn_configs has no {}.'.format(name))
+        setattr(frc, name, value)
+
+
+def synthetic_batches(num_batches, batch_size, seed=0):
+    """
+    :return: images [num_batches, batch_size, height, width, 3] uint8, gt_bboxes [num_batches, batch_size, N, 5]
+    padded with rows of -1 and the rpn targets of every image when frc.RPN_TARGETS_IN_INPUT, None otherwise.
+    """
+    from region_proposal_network import generate_rpn_targets_py, pad_gt_bboxes
+    from toy_dataset.shape_generator import generate_shape_images
+
+    num_images = num_batches * batch_size
+    images, bboxes, labels, _ = generate_shape_images(num_images, frc.IMAGE_SHAPE, n=frc.TOY_OBJECTS_PER_IMAGE,
+                                                      seeds=np.arange(seed, seed + num_images))
+    gt_bboxes = [np.hstack([bboxes[i], labels[i][:, np.newaxis]]).astype(np.int32) for i in range(num_images)]
+
+    rpn_targets = None
+    if frc.RPN_TARGETS_IN_INPUT:
+        targets = [generate_rpn_targets_py(image_gt_bboxes, frc.IMAGE_SHAPE) for image_gt_bboxes in gt_bboxes]
+        rpn_targets = tuple(np.stack([target[k] for target in targets]).reshape(
+            (num_batches, batch_size) + targets[0][k].shape) for k in range(2))
+
+    padded = pad_gt_bboxes(gt_bboxes)
+    return (images.reshape((num_batches, batch_size) + images.shape[1:]),
+            padded.reshape((num_batches, batch_size) + padded.shape[1:]), rpn_targets)
+
+
+def _build(mode, all_images, all_gt_bboxes, all_rpn_targets):
+    import tensorflow as tf
+
+    batch_index = tf.placeholder(tf.int32, [], name='batch_index')
+    images = tf.to_float(tf.gather(tf.constant(all_images), batch_index))
+    image_shape = tf.constant(np.int32(frc.IMAGE_SHAPE))
+
+    if mode == 'train':
+        from train import build_network, build_total_loss
+
+        gt_bboxes = tf.gather(tf.constant(all_gt_bboxes), batch_index)
+        rpn_targets = None
+        if all_rpn_targets is not None:
+            rpn_targets = tuple(tf.gather(tf.constant(targets), batch_index) for targets in all_rpn_targets)
+        loss_dict = build_network(images, image_shape, gt_bboxes, rpn_targets)[3]
+        global_step = tf.train.get_or_create_global_step()
+        fetches = tf.train.AdamOptimizer(frc.LEARNING_RATE_SCHEDULAR[0]).minimize(build_total_loss(loss_dict),
+                                                                                  global_step=global_step)
+    else:
+        from faster_rcnn import detect
+
+        fetches = detect(images, image_shape)
+    return batch_index, fetches
+
+
+def run_benchmark(mode, overrides, batch_size, warmup, steps, num_batches, seed, threads=None):
+    """
+    Build and run the graph of mode, train or inference, meant to run in a process of its own.
+    :param threads: {'intra_op_threads', 'inter_op_threads', 'cpus'} of the session, the configured or tuned
+    settings of utils.session_config otherwise.
+    """
+    # TensorFlow and the model are only imported by the child processes, after the overrides.
+    import tensorflow as tf
+    from utils.session_config import pin_process, session_config
+
+    apply_overrides(overrides)
+    batches = synthetic_batches(num_batches, batch_size, seed)
+
+    graph = tf.Graph()
+    start_time = time.perf_counter()
+    with graph.as_default():
+        batch_index, fetches = _build(mode, *batches)
+        init_op = tf.group(tf.global_variables_initializer(), tf.local_variables_initializer())
+    graph_build_time = time.perf_counter() - start_time
+
+    threads = threads or {}
+    purpose = 'train' if mode == 'train' else 'inference'
+    cpus = pin_process(purpose, threads.get('cpus'))
+    config = session_config(purpose, threads.get('intra_op_threads'), threads.get('inter_op_threads'))
+
+    with tf.Session(graph=graph, config=config) as sess:
+        start_time = time.perf_counter()
+        sess.run(init_op)
+        session_init_time = time.perf_counter() - start_time
+
+        for step in range(warmup):
+            sess.run(fetches, feed_dict={batch_index: step % num_batches})
+
+        latencies = []
+        start_time = time.perf_counter()
+        for step in range(steps):
+            step_start_time = time.perf_counter()
+            sess.run(fetches, feed_dict={batch_index: step % num_batches})
+            latencies.append(time.perf_counter() - step_start_time)
+        total_time = time.perf_counter() - start_time
+
+    latencies = np.float64(latencies) * 1000
+    return {'graph_build_s': graph_build_time,
+            'session_init_s': session_init_time,
+            'steps_per_second': steps / total_time,
+            'images_per_second': steps * batch_size / total_time,
+            'mean_ms': float(np.mean(latencies)),
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p99_ms': float(np.percentile(latencies, 99)),
+            # ru_maxrss is in KB on Linux.
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.,
+            'intra_op_threads': config.intra_op_parallelism_threads,
+            'inter_op_threads': config.inter_op_parallelism_threads,
+            'cpus': cpus}
+
+
+def _override(text):
+    name, _, value = text.partition('=')
+    try:
+        value = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        pass
+    return name.strip(), value
+
+
+def _image_shape(text):
+    return [int(size) for size in text.lower().split('x')]
+
+
+def _commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _main():
+    parser = argparse.ArgumentParser(description='Benchmark training and inference throughput on synthetic data.')
+    parser.add_argument('--modes', nargs='+', choices=['train', 'inference'], default=['train', 'inference'])
+    parser.add_argument('--backbones', nargs='+', default=[frc.BACKBONE])
+    parser.add_argument('--image-shapes', type=_image_shape, nargs='+', default=[frc.IMAGE_SHAPE],
+                        help='<height>x<width>')
+    parser.add_argument('--proposals', type=int, nargs='+', default=[None],
+                        help='RPN_PROPOSAL_MAX_TRAIN for training, RPN_PROPOSAL_MAX_TEST for inference.')
+    parser.add_argument('--batch-size', type=int, default=frc.IMAGE_BATCH_SIZE)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--num-batches', type=int, default=4, help='Distinct synthetic batches cycled through.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--set', type=_override, action='append', default=[], metavar='NAME=VALUE',
+                        help='Any other faster_rcnn_configs value, for all runs.')
+    parser.add_argument('--output', default=None, help='JSON file to write the results to.')
+    args = parser.parse_args()
+
+    results = []
+    context = get_context('spawn')
+    for mode, backbone, image_shape, proposals in itertools.product(args.modes, args.backbones, args.image_shapes,
+                                                                    args.proposals):
+        overrides = dict(args.set, BACKBONE=backbone, IMAGE_SHAPE=image_shape, IMAGE_BATCH_SIZE=args.batch_size)
+        if proposals is not None:
+            overrides['RPN_PROPOSAL_MAX_TRAIN' if mode == 'train' else 'RPN_PROPOSAL_MAX_TEST'] = proposals
+        unknown = [name for name in overrides if not hasattr(frc, name)]
+        if unknown:
+            parser.error('faster_rcnn_configs has no {}'.format(', '.join(unknown)))
+
+        with ProcessPoolExecutor(1, mp_context=context) as executor:
+            result = executor.submit(run_benchmark, mode, overrides, args.batch_size, args.warmup, args.steps,
+                                     args.num_batches, args.seed).result()
+        result = dict(mode=mode, backbone=backbone, image_shape=image_shape, proposals=proposals,
+                      batch_size=args.batch_size, overrides=overrides, **result)
+        results.append(result)
+        print(f'{mode:<10}{backbone:<10}{"x".join(map(str, image_shape)):<10}',
+              f'proposals: {proposals or "default":<8}',
+              f'| {result["images_per_second"]:7.2f} images/s',
+              f'| p50: {result["p50_ms"]:8.1f}ms | p99: {result["p99_ms"]:8.1f}ms',
+              f'| graph: {result["graph_build_s"]:6.2f}s',
+              f'| peak rss: {result["peak_rss_mb"]:8.1f}MB')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'commit': _commit(),
+                       'host': {'machine': platform.machine(), 'processor': platform.processor(),
+                                'cpus': os.cpu_count(), 'python': platform.python_version()},
+                       'warmup': args.warmup,
+                       'steps': args.steps,
+                       'results': results}, f, indent=2)
+        print(f'Results written to {args.output}')
+
+
+if __name__ == '__main__':
+    _main()
@@ -0,0 +1,291 @@
+"""
+Local HTTP detection server for a model written by export_model.py. Concurrent requests are coalesced into batches
+of up to --max-batch-size images, a batch waits at most --max-wait-ms for more requests once its first request
+arrived. Requests beyond --max-queue waiting images are rejected with 503.
+
+    python detection_server.py --model ./export --port 8080
+    curl --data-binary @image.png http://127.0.0.1:8080/detect
+    curl http://127.0.0.1:8080/metrics
+"""
+import argparse
+import json
+import queue
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+from detector import Detector
+from utils.session_config import pin_process, session_config
+
+import faster_rcnn_configs as frc
+
+
+class _Request(object):
+    def __init__(self, image):
+        self.image = image
+        self.enqueue_time = time.time()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        # Set when the client stopped waiting, the request is then dropped instead of run.
+        self.cancelled = False
+
+
+class LatencyWindow(object):
+    """
+    Latencies of the last window_size events, thread safe.
+    """
+
+    def __init__(self, window_size=1000):
+        self._latencies = deque(maxlen=window_size)
+        self._lock = threading.Lock()
+
+    def add(self, latency):
+        with self._lock:
+            self._latencies.append(latency)
+
+    def percentiles(self, percents=(50, 95, 99)):
+        with self._lock:
+            latencies = np.float64(self._latencies)
+        if len(latencies) == 0:
+            return [None] * len(percents)
+        return [round(value * 1000, 3) for value in np.percentile(latencies, percents)]
+
+
+class MicroBatcher(object):
+    """
+    Queue of images and the thread running them through the detector in batches. A batch is run as soon as it
+    has max_batch_size images or max_wait seconds after its first image.
+    """
+
+    def __init__(self, detector, max_batch_size=None, max_wait=0.005, max_queue=64):
+        self.detector = detector
+        self.max_batch_size = max_batch_size or detector.batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue(maxsize=max_queue)
+
+        self._lock = threading.Lock()
+        self.num_requests = 0
+        self.num_rejected = 0
+        self.num_cancelled = 0
+        self.num_batches = 0
+        self.num_batched_images = 0
+        self.request_latency = LatencyWindow()
+        self.batch_latency = LatencyWindow()
+
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, image):
+        """
+        Queue one image. Raises queue.Full when max_queue images are already waiting.
+        """
+        request = _Request(image)
+        try:
+            self._queue.put_nowait(request)
+        except queue.Full:
+            with self._lock:
+                self.num_rejected += 1
+            raise
+        with self._lock:
+            self.num_requests += 1
+        return request
+
+    def cancel(self, request):
+        """
+        Drop a request its client no longer waits for, unless it is already done.
+        """
+        with self._lock:
+            if not request.done.is_set() and not request.cancelled:
+                request.cancelled = True
+                self.num_cancelled += 1
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def _get(self, timeout):
+        # Cancelled requests are skipped, they never take a place in a batch.
+        deadline = time.time() + timeout
+        while True:
+            request = self._queue.get(timeout=max(0., deadline - time.time()))
+            if not request.cancelled:
+                return request
+
+    def _next_batch(self):
+        try:
+            batch = [self._get(0.1)]
+        except queue.Empty:
+            return []
+
+        deadline = time.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._get(timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while self._running:
+            # Requests cancelled while the batch was filling are dropped as well.
+            batch = [request for request in self._next_batch() if not request.cancelled]
+            if not batch:
+                continue
+
+            start_time = time.time()
+            try:
+                results = self.detector.detect(np.stack([request.image for request in batch]))
+            except Exception as e:
+                results = [None] * len(batch)
+                for request in batch:
+                    request.error = e
+            self.batch_latency.add(time.time() - start_time)
+            with self._lock:
+                self.num_batches += 1
+                self.num_batched_images += len(batch)
+
+            for request, result in zip(batch, results):
+                request.result = result
+                self.request_latency.add(time.time() - request.enqueue_time)
+                request.done.set()
+
+    def metrics(self):
+        request_p50, request_p95, request_p99 = self.request_latency.percentiles()
+        batch_p50, batch_p95, batch_p99 = self.batch_latency.percentiles()
+        with self._lock:
+            counts = {'requests': self.num_requests,
+                      'rejected': self.num_rejected,
+                      'cancelled': self.num_cancelled,
+                      'batches': self.num_batches,
+                      'mean_batch_size': self.num_batched_images / max(1, self.num_batches)}
+        return {'queue_depth': self.queue_depth(),
+                **counts,
+                'latency_ms': {'p50': request_p50, 'p95': request_p95, 'p99': request_p99},
+                'batch_latency_ms': {'p50': batch_p50, 'p95': batch_p95, 'p99': batch_p99}}
+
+    def close(self):
+        self._running = False
+        self._thread.join()
+
+
+def _handler(batcher, class_names, score_threshold, timeout):
+    image_shape = batcher.detector.image_shape
+
+    class DetectionHandler(BaseHTTPRequestHandler):
+        def _reply(self, status, body, headers=None):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == '/metrics':
+                self._reply(200, batcher.metrics())
+            elif self.path == '/healthz':
+                self._reply(200, {'status': 'ok'})
+            else:
+                self._reply(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if self.path != '/detect':
+                self._reply(404, {'error': 'not found'})
+                return
+
+            # The body is an encoded image, PNG, JPEG or any format cv2 reads.
+            data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if image is None:
+                self._reply(400, {'error': 'cannot decode image'})
+                return
+
+            original_shape = image.shape[:2]
+            if tuple(original_shape) != tuple(image_shape):
+                image = cv2.resize(image, (image_shape[1], image_shape[0]))
+
+            try:
+                request = batcher.submit(image)
+            except queue.Full:
+                self._reply(503, {'error': 'server busy'}, {'Retry-After': '1'})
+                return
+
+            if not request.done.wait(timeout):
+                batcher.cancel(request)
+                self._reply(504, {'error': 'timeout'})
+                return
+            if request.error is not None:
+                self._reply(500, {'error': str(request.error)})
+                return
+
+            boxes, scores, classes = request.result
+            selected = scores >= score_threshold
+            scale_y, scale_x = original_shape[0] / image_shape[0], original_shape[1] / image_shape[1]
+            boxes = boxes[selected] * np.float32([scale_x, scale_y, scale_x, scale_y])
+            classes = classes[selected]
+            self._reply(200, {'boxes': np.round(np.float64(boxes), 2).tolist(),
+                              'scores': np.round(np.float64(scores[selected]), 4).tolist(),
+                              'categories': [int(category) for category in classes],
+                              'category_names': [class_names[category] if category < len(class_names)
+                                                 else str(category) for category in classes]})
+
+        def log_message(self, format, *args):
+            # One line per request would dominate the cost under load.
+            pass
+
+    return DetectionHandler
+
+
+def warm_up(detector, runs=3):
+    """
+    Run the detector on blank images, the first runs allocate memory and pick kernels.
+    """
+    images = np.zeros((detector.batch_size,) + tuple(detector.image_shape) + (3,), dtype=np.uint8)
+    for _ in range(runs):
+        detector.run(images)
+
+
+def _main():
+    parser = argparse.ArgumentParser(description='Serve an exported detector over HTTP.')
+    parser.add_argument('--model', required=True, help='Directory written by export_model.py.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--max-batch-size', type=int, default=None, help='Exported batch size by default.')
+    parser.add_argument('--max-wait-ms', type=float, default=5.)
+    parser.add_argument('--max-queue', type=int, default=64, help='Waiting images before requests are rejected.')
+    parser.add_argument('--timeout', type=float, default=30., help='Seconds a request waits for its detections.')
+    parser.add_argument('--score-threshold', type=float, default=frc.TEST_SCORE_THRESHOLD)
+    args = parser.parse_args()
+
+    start_time = time.time()
+    pin_process('inference')
+    detector = Detector(args.model, config=session_config('inference'))
+    warm_up(detector)
+    print(f'Model loaded in {detector.load_time:.3}s, warmed up in {time.time() - start_time:.3}s')
+
+    batcher = MicroBatcher(detector, args.max_batch_size, args.max_wait_ms / 1000, args.max_queue)
+    server = ThreadingHTTPServer((args.host, args.port),
+                                 _handler(batcher, detector.class_names, args.score_threshold, args.timeout))
+    print(f'Serving on http://{args.host}:{args.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+        detector.close()
+
+
+if __name__ == '__main__':
+    _main()
@@ -0,0 +1,122 @@
+"""
+Run a model written by export_model.py, or its quantized version written by quantize_model.py. Only TensorFlow and
+NumPy are imported, the project modules, the backbones and the training checkpoints are not needed.
+
+    detector = Detector('./export')
+    boxes, scores, classes = detector.detect(images)[0]
+"""
+import json
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+
+# TF1 API of the float detector, also under TensorFlow 2 where quantize_model.py runs. Before 1.13 it is tf itself.
+tf_v1 = getattr(getattr(tf, 'compat', None), 'v1', tf)
+
+
+class Detector(object):
+    """
+    Frozen inference graph and the session running it. The model directory holds model.json and either the frozen
+    GraphDef or the SavedModel, the frozen GraphDef is preferred as it loads faster.
+    """
+
+    def __init__(self, model_dir, use_saved_model=False, config=None):
+        start_time = time.time()
+        with open(os.path.join(model_dir, 'model.json')) as f:
+            self.metadata = json.load(f)
+
+        self.batch_size = self.metadata['batch_size']
+        self.image_shape = tuple(self.metadata['image_shape'])
+        self.class_names = self.metadata['class_names']
+
+        self.graph = tf_v1.Graph()
+        self.sess = tf_v1.Session(graph=self.graph, config=config)
+        with self.graph.as_default():
+            if use_saved_model:
+                tf_v1.saved_model.loader.load(self.sess, [tf_v1.saved_model.tag_constants.SERVING],
+                                              os.path.join(model_dir, 'saved_model'))
+            else:
+                graph_def = tf_v1.GraphDef()
+                with tf_v1.gfile.GFile(os.path.join(model_dir, 'frozen_inference_graph.pb'), 'rb') as f:
+                    graph_def.ParseFromString(f.read())
+                tf_v1.import_graph_def(graph_def, name='')
+
+        self._images = self.graph.get_tensor_by_name(self.metadata['input'] + ':0')
+        outputs = self.metadata['outputs']
+        self._outputs = [self.graph.get_tensor_by_name(outputs[key] + ':0')
+                         for key in ('boxes', 'scores', 'classes', 'batch_indices')]
+        self.load_time = time.time() - start_time
+
+    def run(self, images):
+        """
+        Run one batch of exactly batch_size images.
+        :return: boxes [D, 4], scores [D], classes [D] and batch_indices [D] of all detections of the batch.
+        """
+        return self.sess.run(self._outputs, feed_dict={self._images: images})
+
+    def detect(self, images):
+        """
+        Detect objects in any number of images, split into runs of batch_size images. The last run is padded.
+        :param images: [N, height, width, 3] uint8 images of image_shape.
+        :return: (boxes, scores, classes) of each image.
+        """
+        images = np.asarray(images, dtype=np.uint8)
+        if images.ndim == 3:
+            images = images[np.newaxis]
+        if tuple(images.shape[1:3]) != self.image_shape:
+            raise ValueError('Expected images of shape {}, got {}.'.format(self.image_shape, images.shape[1:3]))
+
+        results = []
+        for start in range(0, len(images), self.batch_size):
+            batch = images[start:start + self.batch_size]
+            num_images = len(batch)
+            if num_images < self.batch_size:
+                padding = np.zeros((self.batch_size - num_images,) + batch.shape[1:], dtype=np.uint8)
+                batch = np.concatenate([batch, padding])
+
+            boxes, scores, classes, batch_indices = self.run(batch)
+            for i in range(num_images):
+                selected = batch_indices == i
+                results.append((boxes[selected], scores[selected], classes[selected]))
+        return results
+
+    def close(self):
+        self.sess.close()
+
+
+class QuantizedDetector(Detector):
+    """
+    TensorFlow Lite model written by quantize_model.py next to the frozen graph, same interface as Detector. It
+    holds Select TF ops, run it with the TensorFlow pip package, 2.4 or later.
+    """
+
+    def __init__(self, model_dir, model_name='quantized_model.tflite', num_threads=None):
+        start_time = time.time()
+        with open(os.path.join(model_dir, 'model.json')) as f:
+            self.metadata = json.load(f)
+
+        self.batch_size = self.metadata['batch_size']
+        self.image_shape = tuple(self.metadata['image_shape'])
+        self.class_names = self.metadata['class_names']
+
+        self.interpreter = tf.lite.Interpreter(model_path=os.path.join(model_dir, model_name))
+        # Not every TensorFlow version can set the thread count, the interpreter default is used then.
+        if num_threads and hasattr(self.interpreter, 'set_num_threads'):
+            self.interpreter.set_num_threads(num_threads)
+        self.interpreter.allocate_tensors()
+
+        self._input_index = self.interpreter.get_input_details()[0]['index']
+        output_indexes = {detail['name']: detail['index'] for detail in self.interpreter.get_output_details()}
+        outputs = self.metadata['outputs']
+        self._output_indexes = [output_indexes[outputs[key]] for key in ('boxes', 'scores', 'classes', 'batch_indices')]
+        self.load_time = time.time() - start_time
+
+    def run(self, images):
+        self.interpreter.set_tensor(self._input_index, np.asarray(images, dtype=np.uint8))
+        self.interpreter.invoke()
+        return [self.interpreter.get_tensor(index) for index in self._output_indexes]
+
+    def close(self):
+        self.interpreter = None
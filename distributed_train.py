@@ -0,0 +1,151 @@
+"""
+Data parallel training with several trainer processes, on one host or on several. Every worker task runs
+train.run_training on its own input stream, the variables live on the ps tasks and the gradients of all the workers
+are averaged at every step, worker 0 is the chief writing the summaries and checkpoints.
+
+On one host, --num-workers launches the ps and worker tasks on free localhost ports, each worker pinned to its own
+share of the cpus:
+
+    python distributed_train.py --num-workers 4
+
+On several hosts, run every task of the same cluster with its job name and index:
+
+    python distributed_train.py --cluster '{"ps": ["host0:2222"], "worker": ["host0:2223", "host1:2222"]}' \\
+        --job-name worker --task-index 1
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import tensorflow as tf
+
+from train import run_training
+
+import faster_rcnn_configs as frc
+
+
+def _free_ports(count):
+    # Ports are held until all of them are picked, so no port is given twice.
+    sockets = []
+    for _ in range(count):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('localhost', 0))
+        sockets.append(sock)
+    ports = [sock.getsockname()[1] for sock in sockets]
+    for sock in sockets:
+        sock.close()
+    return ports
+
+
+def local_cluster(num_workers, num_ps=1):
+    """
+    :return: {'ps': [address], 'worker': [address]} on free localhost ports.
+    """
+    addresses = ['localhost:{}'.format(port) for port in _free_ports(num_ps + num_workers)]
+    return {'ps': addresses[:num_ps], 'worker': addresses[num_ps:]}
+
+
+def split_cpus(num_workers):
+    """
+    :return: [[cpus]] contiguous cpus of every worker, the input workers of a trainer share its cpus. None when
+    there are fewer cpus than workers.
+    """
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count()))
+    share = len(cpus) // num_workers
+    if share == 0:
+        return None
+    return [cpus[i * share:(i + 1) * share] for i in range(num_workers)]
+
+
+def _cluster(text):
+    if os.path.exists(text):
+        with open(text) as f:
+            return json.load(f)
+    return json.loads(text)
+
+
+def _cpus(text):
+    return [int(cpu) for cpu in text.split(',') if cpu]
+
+
+def run_task(cluster, job_name, task_index, cpus=None):
+    cluster = tf.train.ClusterSpec(cluster)
+    if job_name == 'ps':
+        # Parameter servers only hold and update the variables, on the cpu.
+        server = tf.train.Server(cluster, job_name='ps', task_index=task_index,
+                                 config=tf.ConfigProto(device_count={'GPU': 0}))
+        server.join()
+    else:
+        run_training(cluster, task_index, cpus)
+
+
+def launch_local(num_workers, num_ps=1, pin=True, gpu_ids=None, grace_time=60.):
+    """
+    Run the ps and worker tasks of a local cluster as subprocesses until the chief is done.
+    :param grace_time: seconds the other workers have to finish after the chief, before they are terminated.
+    :return: exit code of the chief.
+    """
+    cluster = local_cluster(num_workers, num_ps)
+    cpus = split_cpus(num_workers) if pin else None
+    command = [sys.executable, os.path.abspath(__file__), '--cluster', json.dumps(cluster)]
+    print(f'Cluster: {json.dumps(cluster)}')
+
+    ps_tasks = [subprocess.Popen(command + ['--job-name', 'ps', '--task-index', str(i)]) for i in range(num_ps)]
+    workers = []
+    for i in range(num_workers):
+        worker_command = command + ['--job-name', 'worker', '--task-index', str(i)]
+        if cpus:
+            worker_command += ['--cpus', ','.join(map(str, cpus[i]))]
+        if gpu_ids:
+            worker_command += ['--gpu-id', str(gpu_ids[i % len(gpu_ids)])]
+        workers.append(subprocess.Popen(worker_command))
+
+    try:
+        exit_code = workers[0].wait()
+        deadline = time.time() + grace_time
+        for worker in workers[1:]:
+            try:
+                worker.wait(max(0., deadline - time.time()))
+            except subprocess.TimeoutExpired:
+                # A worker can stay blocked on a step the chief no longer takes part in.
+                worker.terminate()
+    finally:
+        for task in workers + ps_tasks:
+            if task.poll() is None:
+                task.terminate()
+        for task in workers + ps_tasks:
+            task.wait()
+    return exit_code
+
+
+def _main():
+    parser = argparse.ArgumentParser(description='Data parallel training on a local or multi host cluster.')
+    parser.add_argument('--num-workers', type=int, default=None, help='Launch a local cluster of that many workers.')
+    parser.add_argument('--num-ps', type=int, default=1)
+    parser.add_argument('--no-pin', action='store_true', help='Do not split the cpus between the local workers.')
+    parser.add_argument('--gpu-ids', type=int, nargs='+', default=None,
+                        help='GPUs of the local workers in MODE 0, worker i uses the (i % count)-th.')
+    parser.add_argument('--cluster', type=_cluster, default=None,
+                        help='JSON {"ps": [host:port], "worker": [host:port]} or a file holding it.')
+    parser.add_argument('--job-name', choices=['ps', 'worker'], default='worker')
+    parser.add_argument('--task-index', type=int, default=0)
+    parser.add_argument('--cpus', type=_cpus, default=None, help='Comma separated cpus to pin the task to.')
+    parser.add_argument('--gpu-id', type=int, default=None, help='GPU of the task in MODE 0, GPU_ID otherwise.')
+    args = parser.parse_args()
+
+    if args.num_workers is not None:
+        sys.exit(launch_local(args.num_workers, args.num_ps, not args.no_pin, args.gpu_ids))
+    if args.cluster is None:
+        parser.error('either --num-workers or --cluster is required')
+
+    if args.gpu_id is not None:
+        frc.GPU_ID = args.gpu_id
+    run_task(args.cluster, args.job_name, args.task_index, args.cpus)
+
+
+if __name__ == '__main__':
+    _main()
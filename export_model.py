@@ -0,0 +1,163 @@
+"""
+Export the inference path to a frozen GraphDef and a SavedModel. Variables are folded into constants, only the
+inference graph of faster_rcnn.detect is kept, so no summary, optimizer slot, py_func or ground truth input remains.
+Load the exported model with detector.Detector, without importing the project.
+
+    python export_model.py --output ./export
+    python export_model.py --checkpoint ./logs/<run>/model/<model>.ckpt-1000 --output ./export --batch-size 4
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+
+import tensorflow as tf
+
+from faster_rcnn import detect
+
+import faster_rcnn_configs as frc
+
+
+FROZEN_GRAPH_NAME = 'frozen_inference_graph.pb'
+SAVED_MODEL_DIR = 'saved_model'
+METADATA_NAME = 'model.json'
+
+# Names of the graph inputs and outputs, shared with detector.py
+INPUT_NAME = 'images'
+OUTPUT_NAMES = {'boxes': 'boxes', 'scores': 'scores', 'classes': 'classes', 'batch_indices': 'batch_indices'}
+
+
+def latest_checkpoint(summary_path=None):
+    """
+    Latest checkpoint of the latest training run under summary_path, as test.py looks it up.
+    """
+    summary_path = frc.SUMMARY_PATH if summary_path is None else summary_path
+    runs = sorted(os.listdir(summary_path)) if os.path.isdir(summary_path) else []
+    for run in reversed(runs):
+        checkpoint_path = tf.train.latest_checkpoint(os.path.join(summary_path, run, 'model'))
+        if checkpoint_path:
+            return checkpoint_path
+    return None
+
+
+def build_export_graph(batch_size=1):
+    """
+    Inference graph with a uint8 image input and named outputs. The image shape is a constant, so every shape
+    the graph depends on is known when it is frozen.
+    :return: graph and the names of its output nodes.
+    """
+    graph = tf.Graph()
+    with graph.as_default():
+        images = tf.placeholder(tf.uint8, [batch_size, frc.IMAGE_SHAPE[0], frc.IMAGE_SHAPE[1], 3], name=INPUT_NAME)
+        image_shape = tf.constant(frc.IMAGE_SHAPE, dtype=tf.int32, name='image_shape')
+
+        final_bboxes, final_scores, final_categories, batch_indices = detect(tf.to_float(images), image_shape)
+
+        tf.identity(final_bboxes, name=OUTPUT_NAMES['boxes'])
+        tf.identity(final_scores, name=OUTPUT_NAMES['scores'])
+        tf.to_int32(final_categories, name=OUTPUT_NAMES['classes'])
+        tf.identity(batch_indices, name=OUTPUT_NAMES['batch_indices'])
+    return graph, list(OUTPUT_NAMES.values())
+
+
+def freeze_graph(checkpoint_path, batch_size=1):
+    """
+    Restore the inference variables from a training checkpoint and fold them into constants.
+    :return: frozen GraphDef
+    """
+    graph, output_names = build_export_graph(batch_size)
+    with graph.as_default():
+        # Only the variables of the inference graph are restored, optimizer slots are never loaded.
+        saver = tf.train.Saver(tf.global_variables())
+        with tf.Session(graph=graph) as sess:
+            saver.restore(sess, checkpoint_path)
+            graph_def = tf.graph_util.convert_variables_to_constants(sess, graph.as_graph_def(), output_names)
+
+    graph_def = tf.graph_util.extract_sub_graph(graph_def, output_names)
+    py_funcs = [node.name for node in graph_def.node if node.op in ('PyFunc', 'PyFuncStateless')]
+    if py_funcs:
+        raise ValueError('The inference graph still depends on the py_funcs {}.'.format(py_funcs))
+    return graph_def
+
+
+def write_saved_model(graph_def, export_dir):
+    """
+    Wrap a frozen GraphDef into a SavedModel with a serving_default signature images -> boxes, scores, classes,
+    batch_indices. The SavedModel holds no variable.
+    """
+    if os.path.exists(export_dir):
+        shutil.rmtree(export_dir)
+
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.import_graph_def(graph_def, name='')
+        with tf.Session(graph=graph) as sess:
+            inputs = {INPUT_NAME: graph.get_tensor_by_name(INPUT_NAME + ':0')}
+            outputs = {key: graph.get_tensor_by_name(name + ':0') for key, name in OUTPUT_NAMES.items()}
+            signature = tf.saved_model.signature_def_utils.predict_signature_def(inputs, outputs)
+
+            builder = tf.saved_model.builder.SavedModelBuilder(export_dir)
+            builder.add_meta_graph_and_variables(
+                sess, [tf.saved_model.tag_constants.SERVING],
+                signature_def_map={tf.saved_model.signature_constants.DEFAULT_SERVING_SIGNATURE_DEF_KEY: signature})
+            builder.save()
+
+
+def export_model(checkpoint_path, output_dir, batch_size=1):
+    """
+    Write the frozen GraphDef, the SavedModel and model.json, the input and output names used by detector.py.
+    :return: paths of the frozen graph and of the SavedModel.
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    graph_def = freeze_graph(checkpoint_path, batch_size)
+
+    frozen_graph_path = os.path.join(output_dir, FROZEN_GRAPH_NAME)
+    with tf.gfile.GFile(frozen_graph_path, 'wb') as f:
+        f.write(graph_def.SerializeToString())
+
+    saved_model_dir = os.path.join(output_dir, SAVED_MODEL_DIR)
+    write_saved_model(graph_def, saved_model_dir)
+
+    metadata = {'input': INPUT_NAME,
+                'outputs': OUTPUT_NAMES,
+                'batch_size': batch_size,
+                'image_shape': list(frc.IMAGE_SHAPE),
+                'class_names': frc.CLS_NAMES + ['circle', 'rectangle', 'triangle'],
+                'checkpoint': checkpoint_path}
+    with open(os.path.join(output_dir, METADATA_NAME), 'w') as f:
+        json.dump(metadata, f, indent=2)
+    return frozen_graph_path, saved_model_dir
+
+
+def _size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def _main():
+    parser = argparse.ArgumentParser(description='Export the inference graph of a training checkpoint.')
+    parser.add_argument('--checkpoint', default=None, help='Checkpoint prefix, the latest one by default.')
+    parser.add_argument('--output', required=True, help='Directory of the exported model.')
+    parser.add_argument('--batch-size', type=int, default=1, help='Static number of images of one run.')
+    args = parser.parse_args()
+
+    checkpoint_path = args.checkpoint or latest_checkpoint()
+    if not checkpoint_path:
+        raise ValueError('No available model.')
+
+    start_time = time.time()
+    frozen_graph_path, saved_model_dir = export_model(checkpoint_path, args.output, args.batch_size)
+
+    checkpoint_size = sum(_size(path) for path in tf.gfile.Glob(checkpoint_path + '.*'))
+    print(f'Exported {checkpoint_path} in {time.time() - start_time:.3}s')
+    print(f'checkpoint:   {checkpoint_size / 2 ** 20:8.1f} MB')
+    print(f'frozen graph: {_size(frozen_graph_path) / 2 ** 20:8.1f} MB  {frozen_graph_path}')
+    print(f'saved model:  {_size(saved_model_dir) / 2 ** 20:8.1f} MB  {saved_model_dir}')
+
+
+if __name__ == '__main__':
+    _main()
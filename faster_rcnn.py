@@ -4,22 +4,31 @@ from importlib import import_module
 import tensorflow as tf
 from tensorflow.contrib import slim
 
+from region_proposal_network import rpn
 from utils.anchor_utils import decode_bboxes
 from utils.losses import smooth_l1_loss_rcnn
 
 import faster_rcnn_configs as frc
 
 
-def faster_rcnn(features, rois, image_shape, is_training=True):
+def faster_rcnn(features, rois, image_shape, is_training=True, roi_batch_indices=None, head_chunk_size=None):
+    """
+    :param head_chunk_size: Inference only, rois run through the head in chunks of head_chunk_size rois. None uses
+    frc.FASTER_RCNN_HEAD_CHUNK_SIZE, 0 runs all rois at once.
+    """
+    head_chunk_size = frc.FASTER_RCNN_HEAD_CHUNK_SIZE if head_chunk_size is None else head_chunk_size
     with tf.variable_scope('rcnn'):
         # ROI Pooling
-        roi_features = roi_pooling(features, rois, image_shape)
+        roi_features = roi_pooling(features, rois, image_shape, roi_batch_indices)
 
         if 'backbones' not in sys.path:
             sys.path.append('backbones')
         cnn = import_module(frc.BACKBONE, package='backbones')
         # Fully connected
-        net_flatten = cnn.head(roi_features)
+        if is_training or not head_chunk_size:
+            net_flatten = cnn.head(roi_features, is_training=is_training)
+        else:
+            net_flatten = _chunked_head(cnn, roi_features, head_chunk_size)
 
         with slim.arg_scope([slim.fully_connected], weights_regularizer=slim.l2_regularizer(frc.L2_WEIGHT),
                             weights_initializer=slim.variance_scaling_initializer(1.0, mode='FAN_AVG', uniform=True),
@@ -33,6 +42,77 @@ def faster_rcnn(features, rois, image_shape, is_training=True):
     return cls_score, bbox_pred
 
 
+def _chunked_head(cnn, roi_features, chunk_size):
+    """
+    Run the head with frozen batch norm on chunks of chunk_size rois, one chunk after the other. The peak memory of
+    the head follows chunk_size instead of the number of rois. Batch norm in training mode would normalize every
+    chunk on its own, so this is for inference only.
+    """
+    # Variables are created outside of the while loop of map_fn, the chunks reuse them.
+    feature_dim = cnn.head(roi_features[:0], is_training=False).get_shape().as_list()[-1]
+
+    num_rois = tf.shape(roi_features)[0]
+    num_chunks = (num_rois + chunk_size - 1) // chunk_size
+    padded_features = tf.pad(roi_features, [[0, num_chunks * chunk_size - num_rois], [0, 0], [0, 0], [0, 0]])
+    chunks = tf.reshape(padded_features, [-1, chunk_size] + roi_features.get_shape().as_list()[1:])
+
+    net = tf.map_fn(lambda chunk: cnn.head(chunk, is_training=False), chunks, dtype=tf.float32,
+                    parallel_iterations=1, back_prop=False, name='chunked_head')
+    return tf.reshape(net, [-1, feature_dim])[:num_rois]
+
+
+def backbone_features(inputs, is_training=True):
+    """
+    Feature map shared by the RPN and the RCNN head: the backbone of frc.BACKBONE and the rpn_feature convolution.
+    """
+    if 'backbones' not in sys.path:
+        sys.path.append('backbones')
+    cnn = import_module(frc.BACKBONE, package='backbones')
+    # CNN
+    feature_map = cnn.inference(inputs, is_training=is_training)
+
+    features = slim.conv2d(feature_map, 512, [3, 3], normalizer_fn=slim.batch_norm,
+                           normalizer_params={'decay': 0.995, 'epsilon': 0.0001, 'is_training': is_training},
+                           weights_regularizer=slim.l2_regularizer(frc.L2_WEIGHT),
+                           scope='rpn_feature')
+    return features
+
+
+def detect(inputs, image_shape):
+    """
+    Inference graph: backbone, RPN proposals and RCNN head with frozen batch norm, the test time proposal budgets
+    and no ground truth, target or loss. Detections of all images are concatenated.
+    :param inputs: Images [batch_size, height, width, 3], float32.
+    :param image_shape: [image_height, image_width], shared by all images of the batch.
+    :return: final_bboxes, final_scores, final_categories and detection_batch_indices, the image of each detection.
+    """
+    batch_size = inputs.get_shape().as_list()[0] or frc.IMAGE_BATCH_SIZE
+
+    features = backbone_features(inputs, is_training=False)
+    rois, roi_batch_indices = rpn(features, image_shape, is_training=False)
+    cls_score, bbox_pred = faster_rcnn(features, rois, image_shape, is_training=False,
+                                       roi_batch_indices=roi_batch_indices)
+    cls_prob = slim.softmax(cls_score)
+
+    all_bboxes, all_scores, all_categories, detection_batch_indices = [], [], [], []
+    for i in range(batch_size):
+        image_indices = tf.reshape(tf.where(tf.equal(roi_batch_indices, i)), [-1])
+        bboxes, scores, categories = process_faster_rcnn(tf.gather(rois, image_indices),
+                                                         tf.gather(bbox_pred, image_indices),
+                                                         tf.gather(cls_prob, image_indices), image_shape)
+        all_bboxes.append(bboxes)
+        all_scores.append(scores)
+        all_categories.append(categories)
+        detection_batch_indices.append(tf.fill([tf.shape(scores)[0]], i))
+
+    with tf.name_scope('detections'):
+        final_bboxes = tf.concat(all_bboxes, axis=0, name='final_bboxes')
+        final_scores = tf.concat(all_scores, axis=0, name='final_scores')
+        final_categories = tf.concat(all_categories, axis=0, name='final_categories')
+        detection_batch_indices = tf.concat(detection_batch_indices, axis=0, name='batch_indices')
+    return final_bboxes, final_scores, final_categories, detection_batch_indices
+
+
 def process_faster_rcnn(rois, bbox_pred, scores, image_shape):
     with tf.variable_scope('postprocess_faster_rcnn'):
         rois = tf.stop_gradient(rois)
@@ -40,45 +120,42 @@ def process_faster_rcnn(rois, bbox_pred, scores, image_shape):
         bbox_pred = tf.stop_gradient(bbox_pred)
         scores = tf.stop_gradient(scores)
 
-        bboxes_pred_list = tf.unstack(bbox_pred, axis=1)
-        score_list = tf.unstack(scores, axis=1)
-
-        all_cls_bboxex = []
-        all_cls_scores = []
-        categories = []
+        # Skip the background class 0, decode the bounding boxes of all other classes at once.
+        num_rois = tf.shape(rois)[0]
+        bbox_pred = tf.reshape(bbox_pred[:, 1:, :], [-1, 4])
+        scores = tf.reshape(scores[:, 1:], [-1])
+        categories = tf.tile(tf.range(1, frc.NUM_CLS + 1), [num_rois])
+        tiled_rois = tf.reshape(tf.tile(rois[:, tf.newaxis, :], [1, frc.NUM_CLS, 1]), [-1, 4])
 
-        for i in range(frc.NUM_CLS + 1):
-            encoded_bbox = bboxes_pred_list[i]
-            score = score_list[i]
+        decoded_bbox = decode_bboxes(bbox_pred, tiled_rois, scale_factor=None)     # frc.ROI_SCALE_FACTORS
 
-            decoded_bbox = decode_bboxes(encoded_bbox, rois, scale_factor=None)     # frc.ROI_SCALE_FACTORS
+        # clip bounding to image shape
+        predict_x_min, predict_y_min, predict_x_max, predict_y_max = tf.unstack(decoded_bbox, axis=1)
+        image_height, image_width = tf.to_float(image_shape[0]), tf.to_float(image_shape[1])
+        predict_x_min = tf.maximum(0., tf.minimum(image_width - 1, predict_x_min))
+        predict_y_min = tf.maximum(0., tf.minimum(image_height - 1, predict_y_min))
 
-            # clip bounding to image shape
-            predict_x_min, predict_y_min, predict_x_max, predict_y_max = tf.unstack(decoded_bbox, axis=1)
-            image_height, image_width = tf.to_float(image_shape[0]), tf.to_float(image_shape[1])
-            predict_x_min = tf.maximum(0., tf.minimum(image_width - 1, predict_x_min))
-            predict_y_min = tf.maximum(0., tf.minimum(image_height - 1, predict_y_min))
+        predict_x_max = tf.maximum(0., tf.minimum(image_width - 1, predict_x_max))
+        predict_y_max = tf.maximum(0., tf.minimum(image_height - 1, predict_y_max))
 
-            predict_x_max = tf.maximum(0., tf.minimum(image_width - 1, predict_x_max))
-            predict_y_max = tf.maximum(0., tf.minimum(image_height - 1, predict_y_max))
+        predict_bboxes = tf.stack([predict_x_min, predict_y_min, predict_x_max, predict_y_max], axis=1)
 
-            predict_bboxes = tf.stack([predict_x_min, predict_y_min, predict_x_max, predict_y_max], axis=1)
+        # Drop low scores before NMS
+        candidate_ind = tf.reshape(tf.where(scores >= frc.FASTER_RCNN_SCORE_PRE_FILTER), [-1])
+        predict_bboxes = tf.gather(predict_bboxes, candidate_ind)
+        scores = tf.gather(scores, candidate_ind)
+        categories = tf.gather(categories, candidate_ind)
 
-            # NMS
-            keep_ind = tf.image.non_max_suppression(predict_bboxes, score,
-                                                    frc.FASTER_RCNN_NMS_MAX_BOX_PER_CLASS,
-                                                    frc.FASTER_RCNN_NMS_IOU_THRESHOLD)
+        # Class aware NMS in a single pass: boxes of each class are shifted by an offset larger than the image,
+        # so boxes of different classes never overlap.
+        class_offsets = tf.to_float(categories) * (tf.maximum(image_height, image_width) + 1)
+        keep_ind = tf.image.non_max_suppression(predict_bboxes + class_offsets[:, tf.newaxis], scores,
+                                                frc.FASTER_RCNN_MAX_DETECTIONS,
+                                                frc.FASTER_RCNN_NMS_IOU_THRESHOLD)
 
-            per_cls_boxes = tf.gather(predict_bboxes, keep_ind)
-            per_cls_scores = tf.gather(score, keep_ind)
-
-            all_cls_bboxex.append(per_cls_boxes)
-            all_cls_scores.append(per_cls_scores)
-            categories.append(tf.ones_like(per_cls_scores) * i)
-
-        final_bboxes = tf.concat(all_cls_bboxex, axis=0, name='final_bboxes')
-        final_scores = tf.concat(all_cls_scores, axis=0, name='final_scores')
-        final_categories = tf.concat(categories, axis=0, name='final_categories')
+        final_bboxes = tf.gather(predict_bboxes, keep_ind, name='final_bboxes')
+        final_scores = tf.gather(scores, keep_ind, name='final_scores')
+        final_categories = tf.to_float(tf.gather(categories, keep_ind), name='final_categories')
 
     return final_bboxes, final_scores, final_categories
 
@@ -90,14 +167,18 @@ def build_faster_rcnn_losses(bbox_pred, bbox_targets, cls_score, labels, num_cls
     return bbox_loss, cls_loss
 
 
-def roi_pooling(features, rois, image_shape):
+def roi_pooling(features, rois, image_shape, roi_batch_indices=None):
     with tf.variable_scope('roi_pooling'):
         img_h, img_w = tf.cast(image_shape[0], tf.float32), tf.cast(image_shape[1], tf.float32)
         N = tf.shape(rois)[0]
 
+        # Index of the image in the batch each roi is cropped from, all rois from image 0 if not given.
+        if roi_batch_indices is None:
+            roi_batch_indices = tf.zeros((N,), tf.int32)
+
         normalized_rois = _normalize_rois(rois, img_h, img_w)
 
-        cropped_roi_features = tf.image.crop_and_resize(features, normalized_rois, tf.zeros((N,), tf.int32),
+        cropped_roi_features = tf.image.crop_and_resize(features, normalized_rois, roi_batch_indices,
                                                         crop_size=[frc.FASTER_RCNN_ROI_SIZE, frc.FASTER_RCNN_ROI_SIZE])
 
         roi_features = slim.max_pool2d(cropped_roi_features,
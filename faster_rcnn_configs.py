@@ -3,30 +3,48 @@
 # SYSTEM CONFIGS
 MODE = 0    # gpu: 0    cpu: 1
 GPU_ID = 0
+INTRA_OP_THREADS = 0    # threads of one op, 0: tuned value or tensorflow default
+INTER_OP_THREADS = 0    # ops run in parallel, 0: tuned value or tensorflow default
+SESSION_CONFIG_PATH = './session_config.json'   # thread counts and cpus written by autotune_session.py
 
 # DATA CONFIGS
 IMAGE_BATCH_SIZE = 1
 IMAGE_SHAPE = [448, 448]
-DATASET_PATH = None
+DATASET_PATH = None   # directory of shards written by toy_dataset.build_shards, None: generate on the fly
 ANNO_PATH = None
 LABEL_PATH = None
+INPUT_WORKERS = 4   # processes generating training samples, 0: generate in the training loop
+INPUT_PREFETCH = 8  # samples prepared ahead of the training step
 NUM_CLS = 3     # Exclude background
 CLS_NAMES = ['BG']
+TOY_OBJECTS_PER_IMAGE = 9   # shapes in each generated toy image
 
 # TRAIN CONFIGS
 BACKBONE = 'vgg'
+# ResNeXt blocks as grouped convolutions instead of cardinality branches. Other variable names and a single batch
+# norm per expand convolution: branch checkpoints need backbones.convert_resnext_checkpoint, exact for inference only.
+RESNEXT_GROUPED_CONV = False
 FEATURE_STRIDE = 16
 
 L2_WEIGHT = 0.0005
 
 MODEL_NAME = BACKBONE + '_Faster_RCNN'
 PRE_TRAIN_MODEL_PATH = None
+# Checkpoints are written every SAVE_MODEL_ITER steps, the latest SAVE_MODEL_KEEP_LAST are kept and those whose
+# step is a multiple of SAVE_MODEL_MAXIMUM_ITERS are never deleted.
 SAVE_MODEL_ITER = 100
+SAVE_MODEL_KEEP_LAST = 5
 SAVE_MODEL_MAXIMUM_ITERS = 10000
 MAXIMUM_ITERS = 20000
 
 SUMMARY_PATH = './logs'
 REFRESH_LOGS_ITERS = 10
+# Log steps waiting for the image summary renderer, more are dropped.
+SUMMARY_RENDER_PENDING = 2
+# Trace PROFILE_STEPS training steps after PROFILE_WARMUP_STEPS, print the time of each stage and write a Chrome
+# trace to the log directory. 0 disables profiling.
+PROFILE_STEPS = 0
+PROFILE_WARMUP_STEPS = 20
 
 ADD_GT_BOX_TO_TRAIN = True
 
@@ -41,15 +59,20 @@ ANCHOR_BASE_SIZE = 16
 ANCHOR_SCALE = [8, 16, 32]
 ANCHOR_RATE = [0.5, 1.0, 2.0]
 ANCHOR_NUM = len(ANCHOR_SCALE) * len(ANCHOR_RATE)
+ANCHOR_CACHE_SIZE = 8   # feature map geometries kept in the anchor cache
 ROI_SCALE_FACTORS = [5., 5., 10., 10.]
+IOU_CHUNK_MEMORY_CAP = 64 * 1024 * 1024     # bytes of temporaries per chunk when computing ious, 0: no limit
 
 # RPN_CONFIGS
 RPN_KERNEL_SIZE = 3
 RPN_IOU_POSITIVE_THRESHOLD = 0.7
 RPN_IOU_NEGATIVE_THRESHOLD = 0.3
 RPN_FOREGROUND_FRACTION = 0.5
+RPN_GRID_MATCHING = True    # match gt boxes with anchors through the anchor grid instead of all anchors
+RPN_TARGETS_IN_INPUT = False   # compute rpn targets in the input workers instead of a py_func in the graph
 
 RPN_TOP_K_NMS_TRAIN = 12000
+RPN_TOP_K_NMS_TEST = 6000
 RPN_PROPOSAL_MAX_TRAIN = 2000
 RPN_PROPOSAL_MAX_TEST = 300
 
@@ -67,14 +90,18 @@ RPN_LOCATION_LOSS_WEIGHTS = 1.0
 # FASTER_RCNN_CONFIGS
 FASTER_RCNN_ROI_SIZE = 14
 FASTER_RCNN_POOL_KERNEL_SIZE = 2
+FASTER_RCNN_HEAD_CHUNK_SIZE = 0     # inference only: rois through the head at once, 0: all rois, lower peak memory
 
 FASTER_RCNN_NMS_IOU_THRESHOLD = 0.2
 FASTER_RCNN_NMS_MAX_BOX_PER_CLASS = 100
+FASTER_RCNN_MAX_DETECTIONS = NUM_CLS * FASTER_RCNN_NMS_MAX_BOX_PER_CLASS    # cap of the class aware NMS
+FASTER_RCNN_SCORE_PRE_FILTER = 0.05     # detections with lower scores are dropped before NMS
 
 FASTER_RCNN_IOU_POSITIVE_THRESHOLD = 0.5
 FASTER_RCNN_IOU_NEGATIVE_THRESHOLD = 0.0
 FASTER_RCNN_MINIBATCH_SIZE = 256
 FASTER_RCNN_POSITIVE_RATE = 0.75
+PROPOSAL_TARGETS_IN_GRAPH = True   # sample proposal targets with tensorflow ops instead of a py_func
 
 FASTER_RCNN_CLASSIFICATION_LOSS_WEIGHTS = 1.0
 FASTER_RCNN_LOCATION_LOSS_WEIGHTS = 1.0
@@ -0,0 +1,197 @@
+import queue
+import threading
+import time
+from collections import deque
+from multiprocessing import Pool
+
+import numpy as np
+import tensorflow as tf
+
+from toy_dataset.shape_generator import generate_shape_images
+from toy_dataset.shards import Shard, ShardReader
+from region_proposal_network import generate_rpn_targets_py, pad_gt_bboxes
+
+import faster_rcnn_configs as frc
+
+
+def _training_sample(seed):
+    # Each sample has its own seed, forked workers would share the same random state otherwise.
+    images, bboxes, labels, _ = generate_shape_images(1, frc.IMAGE_SHAPE, n=frc.TOY_OBJECTS_PER_IMAGE, seeds=[seed])
+    gt_bboxes = np.hstack([bboxes[0], labels[0][:, np.newaxis]]).astype(np.int32)
+    return _with_rpn_targets(images[0], gt_bboxes)
+
+
+# Shards opened by this process, by prefix.
+_open_shards = {}
+
+
+def _shard_sample(prefix, i):
+    # Workers read the images themselves, only their position is sent to them.
+    if prefix not in _open_shards:
+        _open_shards[prefix] = Shard(prefix)
+    image, gt_bboxes = _open_shards[prefix][i]
+    return _with_rpn_targets(np.array(image), gt_bboxes)
+
+
+def _with_rpn_targets(image, gt_bboxes):
+    if frc.RPN_TARGETS_IN_INPUT:
+        rpn_bbox_targets, rpn_labels = generate_rpn_targets_py(gt_bboxes, frc.IMAGE_SHAPE)
+        return image, gt_bboxes, rpn_bbox_targets, rpn_labels
+    return image, gt_bboxes, None, None
+
+
+class InputPipeline(object):
+    """
+    tf.data input pipeline. Samples are generated by a pool of worker processes, up to prefetch samples ahead of
+    the training step, grouped into batches by a thread one batch ahead, and handed to the graph through a
+    tf.data.Dataset.
+    The pool is forked when the pipeline is created, so create it before the session.
+    With a dataset_path, samples are streamed from the shards written by toy_dataset.build_shards instead, the
+    trainer task_index of num_tasks reading its own part of them, the workers read the images and assign their
+    rpn targets.
+    """
+
+    def __init__(self, batch_size=None, num_workers=None, prefetch=None, seed=None, dataset_path=None,
+                 task_index=0, num_tasks=1):
+        self.batch_size = frc.IMAGE_BATCH_SIZE if batch_size is None else batch_size
+        self.num_workers = frc.INPUT_WORKERS if num_workers is None else num_workers
+        self.prefetch = frc.INPUT_PREFETCH if prefetch is None else prefetch
+        self.seed = np.random.randint(0, 2 ** 31 - 1) if seed is None else seed
+        self.dataset_path = frc.DATASET_PATH if dataset_path is None else dataset_path
+
+        self._reader = None
+        if self.dataset_path:
+            self._reader = ShardReader(self.dataset_path, shuffle=True, seed=self.seed, task_index=task_index,
+                                       num_tasks=num_tasks)
+            if list(self._reader.image_shape[:2]) != list(frc.IMAGE_SHAPE):
+                raise ValueError('Images of {} have shape {}, IMAGE_SHAPE is {}.'.format(
+                    self.dataset_path, self._reader.image_shape[:2], frc.IMAGE_SHAPE))
+
+        self._pool = Pool(self.num_workers) if self.num_workers > 0 else None
+
+        # Next batch, put by the producer thread started with the first step.
+        self._buffer = queue.Queue(maxsize=1)
+        self._producer = None
+        self._stopped = threading.Event()
+
+        # Batches taken by the training step and batches it had to wait for.
+        self.num_batches = 0
+        self.num_stalls = 0
+        self.stall_time = 0.
+
+    def _tasks(self):
+        """
+        :return: iterator of (function, args) producing the samples, run by the workers when there are.
+        """
+        if self._reader is not None:
+            for prefix, i in self._reader.positions():
+                yield _shard_sample, (prefix, i)
+
+        seed = 0
+        while True:
+            yield _training_sample, ((self.seed + seed) % (2 ** 32),)
+            seed += 1
+
+    def _samples(self):
+        tasks = self._tasks()
+        if self._pool is None:
+            for function, args in tasks:
+                yield function(*args)
+
+        pending = deque()
+        while True:
+            while len(pending) < max(1, self.prefetch):
+                function, args = next(tasks)
+                pending.append(self._pool.apply_async(function, args))
+            yield pending.popleft().get()
+
+    def _batches(self):
+        samples = self._samples()
+        while True:
+            batch = [next(samples) for _ in range(self.batch_size)]
+            images = np.stack([sample[0] for sample in batch])
+            gt_bboxes = pad_gt_bboxes([sample[1] for sample in batch])
+
+            if frc.RPN_TARGETS_IN_INPUT:
+                rpn_bbox_targets = np.stack([sample[2] for sample in batch])
+                rpn_labels = np.stack([sample[3] for sample in batch])
+                yield images, gt_bboxes, np.int32(frc.IMAGE_SHAPE), rpn_bbox_targets, rpn_labels
+            else:
+                yield images, gt_bboxes, np.int32(frc.IMAGE_SHAPE)
+
+    def _put(self, item):
+        while not self._stopped.is_set():
+            try:
+                self._buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce(self):
+        try:
+            for batch in self._batches():
+                if not self._put(batch):
+                    return
+        except Exception as error:
+            # Raised in the training step.
+            self._put(error)
+
+    def _next_batch(self):
+        """
+        Batches pulled by IteratorGetNext, there is no prefetch behind it: the time spent here is the time the
+        training step is blocked on its input.
+        """
+        if self._producer is None:
+            self._producer = threading.Thread(target=self._produce, daemon=True)
+            self._producer.start()
+
+        while True:
+            try:
+                batch = self._buffer.get_nowait()
+            except queue.Empty:
+                start_time = time.time()
+                batch = self._buffer.get()
+                self.num_stalls += 1
+                self.stall_time += time.time() - start_time
+            if isinstance(batch, Exception):
+                raise batch
+            self.num_batches += 1
+            yield batch
+
+    def get_next(self):
+        """
+        :return: images [batch_size, height, width, 3] float32, gt_bboxes [batch_size, N, 5] padded with rows of
+        -1, image_shape [2] and rpn_targets (rpn_bbox_targets, rpn_labels) or None.
+        """
+        image_height, image_width = frc.IMAGE_SHAPE
+        output_types = (tf.uint8, tf.int32, tf.int32)
+        output_shapes = (tf.TensorShape([self.batch_size, image_height, image_width, 3]),
+                         tf.TensorShape([self.batch_size, None, 5]),
+                         tf.TensorShape([2]))
+        if frc.RPN_TARGETS_IN_INPUT:
+            output_types += (tf.float32, tf.float32)
+            output_shapes += (tf.TensorShape([self.batch_size, None, 4]), tf.TensorShape([self.batch_size, None, 1]))
+
+        with tf.name_scope('inputs'):
+            dataset = tf.data.Dataset.from_generator(self._next_batch, output_types, output_shapes)
+            elements = dataset.make_one_shot_iterator().get_next()
+
+            images = tf.to_float(elements[0], name='images')
+            gt_bboxes = tf.identity(elements[1], name='ground_truth_bbox')
+            image_shape = tf.identity(elements[2], name='image_shape')
+            rpn_targets = tuple(elements[3:]) if frc.RPN_TARGETS_IN_INPUT else None
+        return images, gt_bboxes, image_shape, rpn_targets
+
+    def stats(self):
+        """
+        :return: number of batches taken by the training step, number of them it waited for and its total wait
+        time in seconds.
+        """
+        return self.num_batches, self.num_stalls, self.stall_time
+
+    def close(self):
+        self._stopped.set()
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
@@ -0,0 +1,186 @@
+"""
+Post-training INT8 quantization of a model written by export_model.py. The frozen graph is converted to TensorFlow
+Lite, batch norm is folded into the convolutions and the weights and activations of the backbone and head
+convolutions are quantized to 8 bits with ranges calibrated on sample images. Ops without an integer kernel, as the
+NMS and the roi crops, stay float TensorFlow ops.
+The float and the quantized models are then run on the same evaluation images and compared.
+
+Calibrating a graph holding Select TF ops needs TensorFlow 2.4 or later, the TF1 converters reject it. Export the
+model with the training environment and run this script with TensorFlow 2.
+
+    python quantize_model.py --model ./export --calibration-images 200 --eval-images 100
+    python quantize_model.py --model ./export --dataset ./data/shapes
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from detector import Detector, QuantizedDetector
+from toy_dataset.shape_generator import generate_shape_images
+from toy_dataset.shards import ShardReader
+from utils.overlaps import bbox_overlaps
+
+import faster_rcnn_configs as frc
+
+
+QUANTIZED_MODEL_NAME = 'quantized_model.tflite'
+REPORT_NAME = 'quantization_report.json'
+# First version calibrating the full integer quantization of graphs with Select TF ops.
+MIN_TF_VERSION = (2, 4)
+
+
+def sample_images(num_images, image_shape, dataset_path=None, seed=0):
+    """
+    num_images uint8 images, read in order from the shards of dataset_path or generated with seeds seed, seed + 1...
+    """
+    if dataset_path:
+        reader = ShardReader(dataset_path, shuffle=False, repeat=False)
+        images = []
+        for image, _ in reader:
+            if len(images) == num_images:
+                break
+            images.append(np.array(image))
+        return np.stack(images)
+
+    images, _, _, _ = generate_shape_images(num_images, image_shape, n=frc.TOY_OBJECTS_PER_IMAGE,
+                                            seeds=np.arange(seed, seed + num_images))
+    return images
+
+
+def quantize(model_dir, calibration_images):
+    """
+    Convert the frozen graph of model_dir to a quantized TensorFlow Lite model.
+    :return: path of the quantized model.
+    """
+    tf_version = tuple(int(v) for v in tf.__version__.split('.')[:2])
+    if tf_version < MIN_TF_VERSION:
+        raise RuntimeError('Quantizing the detector needs TensorFlow {}.{} or later, found {}.'.format(
+            *MIN_TF_VERSION, tf.__version__))
+
+    with open(os.path.join(model_dir, 'model.json')) as f:
+        metadata = json.load(f)
+    batch_size = metadata['batch_size']
+
+    # The frozen graph converter is the TF1 one.
+    converter = tf.compat.v1.lite.TFLiteConverter.from_frozen_graph(
+        os.path.join(model_dir, 'frozen_inference_graph.pb'),
+        input_arrays=[metadata['input']],
+        output_arrays=[metadata['outputs'][key] for key in ('boxes', 'scores', 'classes', 'batch_indices')],
+        input_shapes={metadata['input']: [batch_size] + metadata['image_shape'] + [3]})
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    # NMS, crop_and_resize and the dynamic shape ops run as TensorFlow ops.
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS, tf.lite.OpsSet.SELECT_TF_OPS]
+
+    def representative_dataset():
+        for start in range(0, len(calibration_images) - batch_size + 1, batch_size):
+            yield [calibration_images[start:start + batch_size]]
+
+    converter.representative_dataset = representative_dataset
+
+    quantized_model_path = os.path.join(model_dir, QUANTIZED_MODEL_NAME)
+    with open(quantized_model_path, 'wb') as f:
+        f.write(converter.convert())
+    return quantized_model_path
+
+
+def _timed_detect(detector, images):
+    results, latencies = [], []
+    for start in range(0, len(images), detector.batch_size):
+        start_time = time.time()
+        results.extend(detector.detect(images[start:start + detector.batch_size]))
+        latencies.append(time.time() - start_time)
+    return results, latencies
+
+
+def compare_detections(float_results, quantized_results, score_threshold, iou_threshold=0.5):
+    """
+    Match the float detections of each image with the quantized detections of the same class, greedily by iou.
+    :return: agreement statistics: matched rate, mean iou and mean absolute score difference of the matches.
+    """
+    num_float, num_quantized, ious, score_deltas = 0, 0, [], []
+    for (boxes, scores, classes), (q_boxes, q_scores, q_classes) in zip(float_results, quantized_results):
+        selected, q_selected = scores >= score_threshold, q_scores >= score_threshold
+        boxes, scores, classes = boxes[selected], scores[selected], classes[selected]
+        q_boxes, q_scores, q_classes = q_boxes[q_selected], q_scores[q_selected], q_classes[q_selected]
+        num_float += len(boxes)
+        num_quantized += len(q_boxes)
+        if len(boxes) == 0 or len(q_boxes) == 0:
+            continue
+
+        overlaps = bbox_overlaps(boxes, q_boxes)
+        overlaps[classes[:, np.newaxis] != q_classes[np.newaxis, :]] = 0
+        for i in np.argsort(-scores):
+            j = np.argmax(overlaps[i])
+            if overlaps[i, j] < iou_threshold:
+                continue
+            ious.append(overlaps[i, j])
+            score_deltas.append(abs(float(scores[i]) - float(q_scores[j])))
+            overlaps[:, j] = 0
+
+    return {'float_detections': num_float,
+            'quantized_detections': num_quantized,
+            'matched': len(ious),
+            'matched_rate': len(ious) / max(1, num_float),
+            'mean_iou': float(np.mean(ious)) if ious else None,
+            'mean_score_delta': float(np.mean(score_deltas)) if score_deltas else None,
+            'max_score_delta': float(np.max(score_deltas)) if score_deltas else None}
+
+
+def _latency_report(latencies, batch_size):
+    latencies = np.float64(latencies) * 1000
+    return {'mean_ms': float(np.mean(latencies)),
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p95_ms': float(np.percentile(latencies, 95)),
+            'images_per_second': float(batch_size * 1000 / np.mean(latencies))}
+
+
+def _main():
+    parser = argparse.ArgumentParser(description='Quantize an exported detector to INT8 and compare it with float.')
+    parser.add_argument('--model', required=True, help='Directory written by export_model.py.')
+    parser.add_argument('--dataset', default=None, help='Shards of calibration and evaluation images, optional.')
+    parser.add_argument('--calibration-images', type=int, default=200)
+    parser.add_argument('--eval-images', type=int, default=100)
+    parser.add_argument('--score-threshold', type=float, default=frc.TEST_SCORE_THRESHOLD)
+    args = parser.parse_args()
+
+    with open(os.path.join(args.model, 'model.json')) as f:
+        image_shape = json.load(f)['image_shape']
+
+    # Calibration and evaluation images do not overlap.
+    images = sample_images(args.calibration_images + args.eval_images, image_shape, args.dataset)
+    calibration_images, eval_images = images[:args.calibration_images], images[args.calibration_images:]
+
+    start_time = time.time()
+    quantized_model_path = quantize(args.model, calibration_images)
+    print(f'Quantized with {len(calibration_images)} images in {time.time() - start_time:.3}s: '
+          f'{quantized_model_path}')
+
+    float_detector = Detector(args.model)
+    quantized_detector = QuantizedDetector(args.model)
+    try:
+        float_results, float_latencies = _timed_detect(float_detector, eval_images)
+        quantized_results, quantized_latencies = _timed_detect(quantized_detector, eval_images)
+    finally:
+        float_detector.close()
+        quantized_detector.close()
+
+    report = {'eval_images': len(eval_images),
+              'score_threshold': args.score_threshold,
+              'size_mb': {'float': os.path.getsize(os.path.join(args.model, 'frozen_inference_graph.pb')) / 2 ** 20,
+                          'quantized': os.path.getsize(quantized_model_path) / 2 ** 20},
+              'load_time_s': {'float': float_detector.load_time, 'quantized': quantized_detector.load_time},
+              'latency': {'float': _latency_report(float_latencies, float_detector.batch_size),
+                          'quantized': _latency_report(quantized_latencies, quantized_detector.batch_size)},
+              'agreement': compare_detections(float_results, quantized_results, args.score_threshold)}
+
+    with open(os.path.join(args.model, REPORT_NAME), 'w') as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    _main()
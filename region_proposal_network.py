@@ -3,59 +3,148 @@ from tensorflow.contrib import slim
 
 import numpy as np
 
-from utils.anchor_utils import encode_bboxes, generate_anchors
+from utils.anchor_cache import anchor_geometry, cached_anchors
+from utils.anchor_grid import grid_overlaps_reduced
+from utils.anchor_utils import bbox_overlaps_tf, encode_bboxes, encode_bboxes_tf, generate_anchors
+from utils.overlaps import bbox_overlaps, bbox_overlaps_reduced
 from utils.losses import smooth_l1_loss_rpn
+from utils.profiling import timed_py_func
 
 import faster_rcnn_configs as frc
 
 
-def rpn(features, image_shape, gt_bboxes):
+def rpn(features, image_shape, gt_bboxes=None, rpn_targets=None, is_training=True):
+    """
+    Region proposal network. Targets, proposals and proposal sampling are computed for each image of the batch.
+    :param features: Feature map of the backbone, [batch_size, height, width, channels].
+    :param image_shape: [image_height, image_width], shared by all images of the batch.
+    :param gt_bboxes: Ground truth bounding boxes [x1, y1, x2, y2, label]. [batch_size, N, 5] padded with rows of -1
+    as pad_gt_bboxes does, or [N, 5] for a single image. Not used when is_training is False.
+    :param rpn_targets: Optional (rpn_bbox_targets, rpn_labels) computed by the input pipeline with
+    generate_rpn_targets_py, [batch_size, K, 4] and [batch_size, K, 1]. The generate_rpn_labels_py py_func is
+    skipped when they are given.
+    :param is_training: False builds the inference path only: no ground truth, no py_func, no losses, frozen batch
+    norm and the test time proposal budgets RPN_TOP_K_NMS_TEST and RPN_PROPOSAL_MAX_TEST.
+    :return: rpn_cls_loss, rpn_cls_acc, rpn_bbox_loss, rois, labels, bbox_targets, roi_batch_indices when training,
+    rois and roi_batch_indices otherwise.
+    """
+    batch_size = features.get_shape().as_list()[0] or frc.IMAGE_BATCH_SIZE
+
     with tf.variable_scope('rpn'):
         # rpn_cls_score
         rpn_cls_score = slim.conv2d(features, 2 * frc.ANCHOR_NUM, [1, 1],
                                     normalizer_fn=slim.batch_norm,
-                                    normalizer_params={'decay': frc.RPN_BN_DECACY, 'epsilon': frc.RPN_BN_EPS},
+                                    normalizer_params={'decay': frc.RPN_BN_DECACY, 'epsilon': frc.RPN_BN_EPS,
+                                                       'is_training': is_training},
                                     weights_regularizer=slim.l2_regularizer(frc.RPN_WEIGHTS_L2_PENALITY_FACTOR),
                                     activation_fn=None, scope='rpn_cls_score')
-        rpn_cls_score = tf.reshape(rpn_cls_score, [-1, 2])
+        rpn_cls_score = tf.reshape(rpn_cls_score, [batch_size, -1, 2])
         rpn_cls_prob = slim.softmax(rpn_cls_score, scope='rpn_cls_pred')
 
         # rpn_bbox_pred
         rpn_bbox_pred = slim.conv2d(features, frc.ANCHOR_NUM * (frc.NUM_CLS + 1), [1, 1],
                                     activation_fn=None, scope='rpn_bbox_pred')
-        rpn_bbox_pred = tf.reshape(rpn_bbox_pred, [-1, 4])
+        rpn_bbox_pred = tf.reshape(rpn_bbox_pred, [batch_size, -1, 4])
 
-        featuremap_height, featuremap_width = tf.shape(features)[1], tf.shape(features)[2]
-        featuremap_height = tf.cast(featuremap_height, dtype=tf.float32)
-        featuremap_width = tf.cast(featuremap_width, dtype=tf.float32)
+        # Anchors are an in-graph constant from the anchor cache when the feature map shape is static.
+        featuremap_height, featuremap_width = features.get_shape().as_list()[1:3]
+        if featuremap_height is None or featuremap_width is None:
+            featuremap_height, featuremap_width = tf.shape(features)[1], tf.shape(features)[2]
+            featuremap_height = tf.cast(featuremap_height, dtype=tf.float32)
+            featuremap_width = tf.cast(featuremap_width, dtype=tf.float32)
 
         anchors = make_anchors_in_image(frc.ANCHOR_BASE_SIZE, featuremap_width, featuremap_height,
                                         feature_stride=frc.FEATURE_STRIDE)
 
+        if not is_training:
+            all_rois, roi_batch_indices = [], []
+            for i in range(batch_size):
+                with tf.name_scope('rpn_proposals'):
+                    rois, _ = process_rpn_proposals(anchors, rpn_cls_prob[i], rpn_bbox_pred[i], image_shape,
+                                                    is_training=False)
+                all_rois.append(rois)
+                roi_batch_indices.append(tf.fill([tf.shape(rois)[0]], i))
+            return tf.concat(all_rois, axis=0), tf.concat(roi_batch_indices, axis=0)
+
+        if gt_bboxes.get_shape().ndims == 2:
+            gt_bboxes = gt_bboxes[tf.newaxis]
+        image_gt_bboxes = [unpad_gt_bboxes(gt_bboxes[i]) for i in range(batch_size)]
+
         # generate labels and bboxes to train rpn
-        rpn_bbox_targets, rpn_labels = tf.py_func(generate_rpn_labels_py, [anchors, gt_bboxes, image_shape],
-                                                  [tf.float32, tf.float32])
+        if rpn_targets is None:
+            rpn_bbox_targets, rpn_labels = [], []
+            for i in range(batch_size):
+                image_bbox_targets, image_labels = tf.py_func(timed_py_func(generate_rpn_labels_py),
+                                                              [anchors, image_gt_bboxes[i], image_shape,
+                                                               tf.shape(features)[1:3]],
+                                                              [tf.float32, tf.float32], name='generate_rpn_labels')
+                rpn_bbox_targets.append(image_bbox_targets)
+                rpn_labels.append(image_labels)
+            rpn_bbox_targets = tf.concat(rpn_bbox_targets, axis=0)
+            rpn_labels = tf.concat(rpn_labels, axis=0)
+        else:
+            # Precomputed targets are laid out on the feature map shape derived from the image shape.
+            if isinstance(featuremap_height, int) and isinstance(featuremap_width, int) and \
+                    [featuremap_height, featuremap_width] != rpn_feature_shape(frc.IMAGE_SHAPE):
+                raise ValueError('Feature map shape {} does not match the shape {} of precomputed rpn targets, '
+                                 'use an IMAGE_SHAPE divisible by FEATURE_STRIDE.'.format(
+                                     [featuremap_height, featuremap_width], rpn_feature_shape(frc.IMAGE_SHAPE)))
+            rpn_bbox_targets, rpn_labels = rpn_targets
         rpn_labels = tf.to_int32(rpn_labels)
         rpn_labels = tf.reshape(rpn_labels, [-1])
         rpn_bbox_targets = tf.reshape(rpn_bbox_targets, [-1, 4])
 
-        # rpn_losses
-        rpn_cls_loss, rpn_cls_acc, rpn_bbox_loss = build_rpn_losses(rpn_cls_score, rpn_cls_prob,
-                                                                    rpn_bbox_pred, rpn_bbox_targets,
-                                                                    rpn_labels)
+        # rpn_losses over all anchors of the batch
+        rpn_cls_loss, rpn_cls_acc, rpn_bbox_loss = build_rpn_losses(tf.reshape(rpn_cls_score, [-1, 2]),
+                                                                    tf.reshape(rpn_cls_prob, [-1, 2]),
+                                                                    tf.reshape(rpn_bbox_pred, [-1, 4]),
+                                                                    rpn_bbox_targets, rpn_labels)
 
         # Get RCNN rois
         with tf.control_dependencies([rpn_labels]):
-            # process rpn proposals, including clip, decode, nms
-            rois, roi_scores = process_rpn_proposals(anchors, rpn_cls_prob, rpn_bbox_pred, image_shape)
-            rois, labels, bbox_targets = tf.py_func(process_proposal_targets_py, [rois, gt_bboxes],
-                                                    [tf.float32, tf.int32, tf.float32])
+            all_rois, all_labels, all_bbox_targets, roi_batch_indices = [], [], [], []
+            for i in range(batch_size):
+                # process rpn proposals, including clip, decode, nms
+                with tf.name_scope('rpn_proposals'):
+                    rois, roi_scores = process_rpn_proposals(anchors, rpn_cls_prob[i], rpn_bbox_pred[i], image_shape)
+                if frc.PROPOSAL_TARGETS_IN_GRAPH:
+                    rois, labels, bbox_targets = process_proposal_targets(rois, image_gt_bboxes[i])
+                else:
+                    rois, labels, bbox_targets = tf.py_func(timed_py_func(process_proposal_targets_py),
+                                                            [rois, image_gt_bboxes[i]],
+                                                            [tf.float32, tf.int32, tf.float32],
+                                                            name='proposal_targets')
+
+                rois = tf.reshape(rois, [-1, 4])
+                all_rois.append(rois)
+                all_labels.append(tf.reshape(tf.to_int32(labels), [-1]))
+                all_bbox_targets.append(tf.reshape(bbox_targets, [-1, 4 * (frc.NUM_CLS + 1)]))
+                roi_batch_indices.append(tf.fill([tf.shape(rois)[0]], i))
+
+            rois = tf.concat(all_rois, axis=0)
+            labels = tf.concat(all_labels, axis=0)
+            bbox_targets = tf.concat(all_bbox_targets, axis=0)
+            roi_batch_indices = tf.concat(roi_batch_indices, axis=0)
+
+    return rpn_cls_loss, rpn_cls_acc, rpn_bbox_loss, rois, labels, bbox_targets, roi_batch_indices
+
+
+def unpad_gt_bboxes(gt_bboxes):
+    """
+    Remove the padding rows of the ground truth of one image, rows with label -1.
+    """
+    return tf.boolean_mask(gt_bboxes, tf.not_equal(gt_bboxes[:, -1], -1))
 
-            rois = tf.reshape(rois, [-1, 4])
-            labels = tf.reshape(tf.to_int32(labels), [-1])
-            bbox_targets = tf.reshape(bbox_targets, [-1, 4 * (frc.NUM_CLS + 1)])
 
-    return rpn_cls_loss, rpn_cls_acc, rpn_bbox_loss, rois, labels, bbox_targets
+def pad_gt_bboxes(gt_bboxes_list):
+    """
+    Stack ground truth of several images to [batch_size, N, 5], shorter ones are padded with rows of -1.
+    """
+    max_num = max([1] + [len(gt_bboxes) for gt_bboxes in gt_bboxes_list])
+    padded = np.full((len(gt_bboxes_list), max_num, 5), -1, dtype=np.int32)
+    for i, gt_bboxes in enumerate(gt_bboxes_list):
+        padded[i, :len(gt_bboxes)] = gt_bboxes
+    return padded
 
 
 def build_rpn_losses(rpn_cls_score, rpn_cls_prob, rpn_bbox_pred, rpn_bbox_targets, rpn_labels):
@@ -91,7 +180,13 @@ def build_rpn_losses(rpn_cls_score, rpn_cls_prob, rpn_bbox_pred, rpn_bbox_target
     return rpn_cls_loss, rpn_cls_acc, rpn_bbox_loss
 
 
-def process_rpn_proposals(anchors, rpn_cls_pred, rpn_bbox_pred, image_shape, scale_factor=None):
+def process_rpn_proposals(anchors, rpn_cls_pred, rpn_bbox_pred, image_shape, scale_factor=None, is_training=True):
+    # Proposal budgets, the test time ones are smaller
+    if is_training:
+        top_k, max_proposals = frc.RPN_TOP_K_NMS_TRAIN, frc.RPN_PROPOSAL_MAX_TRAIN
+    else:
+        top_k, max_proposals = frc.RPN_TOP_K_NMS_TEST, frc.RPN_PROPOSAL_MAX_TEST
+
     # 1. Trans bboxes
     t_x, t_y, t_w, t_h = tf.unstack(rpn_bbox_pred, axis=1)
 
@@ -135,13 +230,13 @@ def process_rpn_proposals(anchors, rpn_cls_pred, rpn_bbox_pred, image_shape, sca
 
     predict_bboxes = tf.stack([predict_x_min, predict_y_min, predict_x_max, predict_y_max], axis=1)
 
-    predict_targets_count = tf.minimum(frc.RPN_TOP_K_NMS_TRAIN, tf.shape(predict_bboxes)[0])
+    predict_targets_count = tf.minimum(top_k, tf.shape(predict_bboxes)[0])
     sorted_rpn_cls_pred, sorted_pred_indeces = tf.nn.top_k(rpn_cls_pred[:, 1], predict_targets_count)
     sorted_bounding_boxes = tf.gather(predict_bboxes, sorted_pred_indeces)
 
     # 3. NMS
     selected_bboxes_indeces = tf.image.non_max_suppression(sorted_bounding_boxes, sorted_rpn_cls_pred,
-                                                           max_output_size=frc.RPN_PROPOSAL_MAX_TRAIN,
+                                                           max_output_size=max_proposals,
                                                            iou_threshold=frc.RPN_NMS_IOU_THRESHOLD)
 
     selected_bboxes = tf.gather(sorted_bounding_boxes, selected_bboxes_indeces)
@@ -150,6 +245,11 @@ def process_rpn_proposals(anchors, rpn_cls_pred, rpn_bbox_pred, image_shape, sca
 
 
 def make_anchors_in_image(anchor_base, feature_width, feature_height, feature_stride):
+    if isinstance(feature_width, int) and isinstance(feature_height, int):
+        all_anchors = cached_anchors([feature_height, feature_width], feature_stride, anchor_base,
+                                     frc.ANCHOR_SCALE, frc.ANCHOR_RATE, cache_size=frc.ANCHOR_CACHE_SIZE)
+        return tf.constant(all_anchors, dtype=tf.float32)
+
     _anchors = generate_anchors(original_anchor=[1, 1, anchor_base - 1, anchor_base - 1],
                                 scales=frc.ANCHOR_SCALE, ratios=frc.ANCHOR_RATE)
     shift_x = tf.range(feature_width, dtype=tf.float32) * feature_stride
@@ -163,6 +263,61 @@ def make_anchors_in_image(anchor_base, feature_width, feature_height, feature_st
     return tf.reshape(all_anchors, [-1, 4])
 
 
+def process_proposal_targets(rpn_rois, gt_bboxes):
+    """
+    Tensorflow version of process_proposal_targets_py, same sampling rules without py_func.
+    :param rpn_rois: Proposals [x1, y1, x2, y2].
+    :param gt_bboxes: Ground truth [x1, y1, x2, y2, label].
+    :return: rois, labels, bbox_targets
+    """
+    with tf.variable_scope('proposal_targets'):
+        gt_boxes = tf.to_float(gt_bboxes[:, :-1])
+        gt_labels = tf.to_int32(gt_bboxes[:, -1])
+
+        if frc.ADD_GT_BOX_TO_TRAIN:
+            # Add ground truth bboxes to train.
+            all_rois = tf.concat([rpn_rois, gt_boxes], axis=0)
+        else:
+            all_rois = rpn_rois
+
+        # 1. Calculates overlaps between rois and ground truth.
+        # 2. Get the maximum overlap area for each roi and set it label equal to the ground truth.
+        overlaps = bbox_overlaps_tf(all_rois, gt_boxes)
+        max_overlaps_gt_indexes = tf.argmax(overlaps, axis=1, output_type=tf.int32)
+        max_overlaps = tf.reduce_max(overlaps, axis=1)
+        labels = tf.gather(gt_labels, max_overlaps_gt_indexes)
+
+        # 3. Sample foreground rois up to the positive rate of the minibatch, background rois fill the rest of it.
+        fg_indices = tf.reshape(tf.where(max_overlaps >= frc.FASTER_RCNN_IOU_POSITIVE_THRESHOLD), [-1])
+        bg_indices = tf.reshape(tf.where((max_overlaps < frc.FASTER_RCNN_IOU_POSITIVE_THRESHOLD) &
+                                         (max_overlaps >= frc.FASTER_RCNN_IOU_NEGATIVE_THRESHOLD)), [-1])
+
+        fg_rois_per_image = tf.size(fg_indices)
+        bg_rois_per_image = tf.size(bg_indices)
+        if frc.FASTER_RCNN_MINIBATCH_SIZE != -1:
+            fg_rois_per_image = tf.minimum(
+                int(np.round(frc.FASTER_RCNN_POSITIVE_RATE * frc.FASTER_RCNN_MINIBATCH_SIZE)), fg_rois_per_image)
+            bg_rois_per_image = tf.minimum(frc.FASTER_RCNN_MINIBATCH_SIZE - fg_rois_per_image, bg_rois_per_image)
+
+        fg_indices = tf.random_shuffle(fg_indices)[:fg_rois_per_image]
+        bg_indices = tf.random_shuffle(bg_indices)[:bg_rois_per_image]
+        keep_indices = tf.concat([fg_indices, bg_indices], axis=0)
+
+        # 4. Make the negative labels equal to 0.
+        labels = tf.gather(labels, keep_indices)
+        labels = labels * tf.to_int32(tf.range(tf.size(keep_indices)) < fg_rois_per_image)
+        rois = tf.gather(all_rois, keep_indices)
+
+        # 5. Encodes bounding boxes to targets coordinates and place them at the columns of their class.
+        bbox_targets_data = encode_bboxes_tf(rois, tf.gather(gt_boxes, tf.gather(max_overlaps_gt_indexes,
+                                                                                 keep_indices)))
+        class_mask = tf.one_hot(labels, frc.NUM_CLS + 1) * tf.to_float(labels > 0)[:, tf.newaxis]
+        class_mask = tf.reshape(tf.tile(class_mask[:, :, tf.newaxis], [1, 1, 4]), [-1, 4 * (frc.NUM_CLS + 1)])
+        bbox_targets = tf.tile(bbox_targets_data, [1, frc.NUM_CLS + 1]) * class_mask
+
+    return rois, labels, bbox_targets
+
+
 def process_proposal_targets_py(rpn_rois, gt_bboxes):
     """
     Assign object detection proposals to ground truth. Produce proposal classification labels and
@@ -189,9 +344,8 @@ def process_proposal_targets_py(rpn_rois, gt_bboxes):
     # 1. Calculates overlaps between rois and ground truth.
     # 2. Get the maximum overlap area for each roi and set it label equal to the ground truth.
 
-    overlaps = get_overlaps_py(all_rois, gt_bboxes[:, :-1])
-    max_overlaps_gt_indexes = np.argmax(overlaps, axis=1)
-    max_overlaps = np.max(overlaps, axis=1)
+    max_overlaps_gt_indexes, max_overlaps, _, _, _ = bbox_overlaps_reduced(all_rois, gt_bboxes[:, :-1],
+                                                                           memory_cap=frc.IOU_CHUNK_MEMORY_CAP)
 
     labels = gt_bboxes[max_overlaps_gt_indexes, -1]
 
@@ -210,8 +364,8 @@ def process_proposal_targets_py(rpn_rois, gt_bboxes):
     # chose background indices
     bg_indices = np.where((max_overlaps < frc.FASTER_RCNN_IOU_POSITIVE_THRESHOLD) &
                           (max_overlaps >= frc.FASTER_RCNN_IOU_NEGATIVE_THRESHOLD))[0]
-    # bg_roi_per_image = rois_per_image - fg_rois_per_image
-    bg_roi_per_image = fg_rois_per_image
+    # Background rois fill the rest of the minibatch.
+    bg_roi_per_image = rois_per_image - fg_rois_per_image
     bg_roi_per_image = np.minimum(bg_roi_per_image, bg_indices.size)
 
     if bg_indices.size > 0:
@@ -239,7 +393,7 @@ def process_proposal_targets_py(rpn_rois, gt_bboxes):
     return rois, labels, bbox_targets
 
 
-def generate_rpn_labels_py(all_anchors, gt_bboxes, image_shape):
+def generate_rpn_labels_py(all_anchors, gt_bboxes, image_shape, feature_shape=None):
     def _unmap(data, count, indexes, fill=0):
         if len(data.shape) == 1:
             ret = np.empty((count,), dtype=np.float32)
@@ -278,36 +432,37 @@ def generate_rpn_labels_py(all_anchors, gt_bboxes, image_shape):
 
         return labels
 
-    inside_boarder_indices = _check_anchors(all_anchors, image_shape)
+    # The inside border indices and anchor areas are computed once for each feature map geometry.
+    if feature_shape is not None:
+        geometry = get_anchor_geometry(feature_shape, image_shape)
+        inside_boarder_indices = geometry.inside_indices
+        anchor_areas = geometry.areas
+    else:
+        inside_boarder_indices = _check_anchors(all_anchors, image_shape)
+        anchor_areas = None
     anchors = all_anchors[inside_boarder_indices, :]
 
     # labels: positive=1; negative=0; not_care=-1
     labels = np.empty((len(inside_boarder_indices),), dtype=np.float32)
     labels.fill(-1)
 
-    overlaps = get_overlaps_py(anchors, gt_bboxes)
     # overlaps: cross ious for each anchors and gt_boxes
     # rows: Anchors Indexes
     # columns: Ground Truth Bounding Box Indexes
     # For example K anchors with N ground truth bbox
-    # overlaps is matrix have shape of K * N
-
-    # For each anchor, get gt_bbox indices have max overlap region.
-    # Shape: K
-    max_overlap_gt_indices = np.argmax(overlaps, axis=1)
-    # Get the max overlap for each anchor
-    max_overlaps_for_each_anchor = overlaps[np.arange(len(inside_boarder_indices), dtype=np.int32),
-                                            max_overlap_gt_indices]
-
-    # For each gt_bbox, get anchor indices have max overlap region.
-    # Shape: N
-    max_overlap_anchor_indices = np.argmax(overlaps, axis=0)
-    # Get the max overlap for each gt_bbox
-    max_overlaps_for_each_gt = overlaps[max_overlap_anchor_indices,
-                                        np.arange(len(gt_bboxes), dtype=np.int32)]
-
-    # Find anchors have max overlap region
-    max_overlap_indices = np.where(overlaps == max_overlaps_for_each_gt)[0]
+    # overlaps is matrix have shape of K * N, it is walked through in chunks and only reductions are kept.
+    # max_overlap_gt_indices: for each anchor, get gt_bbox indices have max overlap region. Shape: K
+    # max_overlaps_for_each_anchor: the max overlap for each anchor. Shape: K
+    # max_overlap_indices: anchors have max overlap region of some gt_bbox, ties included.
+    # With the feature map shape known, the anchor grid is used as spatial index and only the anchors reaching a
+    # gt_bbox are compared with it.
+    if frc.RPN_GRID_MATCHING and feature_shape is not None:
+        max_overlap_gt_indices, max_overlaps_for_each_anchor, _, _, max_overlap_indices = \
+            grid_overlaps_reduced(all_anchors, feature_shape, frc.FEATURE_STRIDE, gt_bboxes,
+                                  rows=inside_boarder_indices, anchor_areas=anchor_areas)
+    else:
+        max_overlap_gt_indices, max_overlaps_for_each_anchor, _, _, max_overlap_indices = \
+            bbox_overlaps_reduced(anchors, gt_bboxes[:, :4], memory_cap=frc.IOU_CHUNK_MEMORY_CAP)
 
     # Set negative labels
     labels[max_overlaps_for_each_anchor < frc.RPN_IOU_NEGATIVE_THRESHOLD] = 0
@@ -330,6 +485,34 @@ def generate_rpn_labels_py(all_anchors, gt_bboxes, image_shape):
     return bbox_targets, labels
 
 
+def generate_rpn_targets_py(gt_bboxes, image_shape):
+    """
+    Compute rpn_bbox_targets and rpn_labels from ground truth and image shape only, without the graph. Used by the
+    input pipeline to assign rpn targets in data loader workers.
+    :param gt_bboxes: Ground truth bounding boxes [x1, y1, x2, y2, label].
+    :param image_shape: [image_height, image_width]
+    :return: rpn_bbox_targets, rpn_labels, same as generate_rpn_labels_py
+    """
+    feature_shape = rpn_feature_shape(image_shape)
+    geometry = get_anchor_geometry(feature_shape, image_shape)
+    return generate_rpn_labels_py(geometry.anchors, gt_bboxes, image_shape, feature_shape)
+
+
+def rpn_feature_shape(image_shape):
+    return [int(image_shape[0]) // frc.FEATURE_STRIDE, int(image_shape[1]) // frc.FEATURE_STRIDE]
+
+
+def get_anchor_geometry(feature_shape, image_shape):
+    """
+    Cached anchors, inside border indices and anchor areas for a feature map shape and an image shape.
+    :param feature_shape: [feature_height, feature_width]
+    :param image_shape: [image_height, image_width]
+    :return: AnchorGeometry(anchors, inside_indices, areas)
+    """
+    return anchor_geometry(feature_shape, frc.FEATURE_STRIDE, image_shape, frc.ANCHOR_BASE_SIZE,
+                           frc.ANCHOR_SCALE, frc.ANCHOR_RATE, cache_size=frc.ANCHOR_CACHE_SIZE)
+
+
 def get_overlaps_py(pred_bboxes, gt_bboxes):
     """
     Caluculate overlap area of predicted acnchors and ground truth. Inputs K anchors and N ground truth boxes, returns
@@ -338,32 +521,7 @@ def get_overlaps_py(pred_bboxes, gt_bboxes):
     :param gt_bboxes: Ground truth bounding boxes.
     :return: Intersection of Union of anchors and ground truth bounding box.
     """
-    len_pred_bboxes = len(pred_bboxes)
-    len_gt_bboxes = len(gt_bboxes)
-    pred_map_indeces = np.arange(len_pred_bboxes, dtype=np.int32)
-    pred_map_indeces = np.repeat(pred_map_indeces, (len_gt_bboxes,))
-    gt_map_indeces = np.arange(len_gt_bboxes, dtype=np.int32)
-    gt_map_indeces = np.repeat(gt_map_indeces[:, np.newaxis], (len_pred_bboxes,), axis=1).transpose().ravel()
-
-    intersection_boxes_x1 = np.maximum(gt_bboxes[gt_map_indeces, 0], pred_bboxes[pred_map_indeces, 0])
-    intersection_boxes_y1 = np.maximum(gt_bboxes[gt_map_indeces, 1], pred_bboxes[pred_map_indeces, 1])
-    intersection_boxes_x2 = np.minimum(gt_bboxes[gt_map_indeces, 2], pred_bboxes[pred_map_indeces, 2])
-    intersection_boxes_y2 = np.minimum(gt_bboxes[gt_map_indeces, 3], pred_bboxes[pred_map_indeces, 3])
-
-    iws = intersection_boxes_x2 - intersection_boxes_x1 + 1
-    ihs = intersection_boxes_y2 - intersection_boxes_y1 + 1
-
-    less_zero_indeces = np.bitwise_or(iws < 0, ihs < 0)
-    iws[less_zero_indeces] = 0
-    ihs[less_zero_indeces] = 0
-    gt_bboxes_areas = (gt_bboxes[gt_map_indeces, 2] - gt_bboxes[gt_map_indeces, 0] + 1) * \
-                      (gt_bboxes[gt_map_indeces, 3] - gt_bboxes[gt_map_indeces, 1] + 1)
-    pred_bboxes_areas = (pred_bboxes[pred_map_indeces, 2] - pred_bboxes[pred_map_indeces, 0] + 1) * \
-                        (pred_bboxes[pred_map_indeces, 3] - pred_bboxes[pred_map_indeces, 1] + 1)
-    intersection_areas = iws * ihs
-    ious = intersection_areas / (gt_bboxes_areas + pred_bboxes_areas - intersection_areas)
-
-    return ious.reshape([len_pred_bboxes, len_gt_bboxes])
+    return bbox_overlaps(pred_bboxes, gt_bboxes, memory_cap=frc.IOU_CHUNK_MEMORY_CAP)
 
 
 if __name__ == '__main__':
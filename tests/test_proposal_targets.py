@@ -0,0 +1,89 @@
+"""
+Parity of the in-graph proposal target sampler (process_proposal_targets) with the NumPy one
+(process_proposal_targets_py). The rois outnumber both the foreground and the background slots of the minibatch,
+so both samplers have to subsample; their random choices differ, so every kept roi is checked on its own against
+the labels and targets it must get.
+"""
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+
+import faster_rcnn_configs as frc  # noqa: E402
+from region_proposal_network import process_proposal_targets, process_proposal_targets_py  # noqa: E402
+from utils.anchor_utils import encode_bboxes  # noqa: E402
+from utils.overlaps import bbox_overlaps  # noqa: E402
+
+
+NUM_GT = 6
+NUM_FG_ROIS = 300
+NUM_BG_ROIS = 200
+
+
+def _inputs(seed):
+    random = np.random.RandomState(seed)
+    gt_xy = random.randint(0, 200, (NUM_GT, 2))
+    gt_bboxes = np.hstack([gt_xy, gt_xy + random.randint(64, 128, (NUM_GT, 2)),
+                           random.randint(1, frc.NUM_CLS + 1, (NUM_GT, 1))]).astype(np.int32)
+
+    # Foreground rois are slightly jittered ground truth, background rois are small boxes anywhere in the image.
+    fg_rois = gt_bboxes[random.randint(0, NUM_GT, NUM_FG_ROIS), :4] + random.uniform(-3, 3, (NUM_FG_ROIS, 4))
+    bg_xy = random.uniform(0, 400, (NUM_BG_ROIS, 2))
+    bg_rois = np.hstack([bg_xy, bg_xy + random.uniform(4, 12, (NUM_BG_ROIS, 2))])
+    return np.float32(np.vstack([fg_rois, bg_rois])), gt_bboxes
+
+
+def _expected(rois, gt_bboxes):
+    """
+    :return: label and bbox targets each of rois must get, and whether it is foreground.
+    """
+    overlaps = bbox_overlaps(np.float64(rois), np.float64(gt_bboxes[:, :4]))
+    gt_indices = overlaps.argmax(axis=1)
+    foreground = overlaps.max(axis=1) >= frc.FASTER_RCNN_IOU_POSITIVE_THRESHOLD
+    labels = np.where(foreground, gt_bboxes[gt_indices, -1], 0)
+
+    bbox_targets = np.zeros((len(rois), 4 * (frc.NUM_CLS + 1)), dtype=np.float32)
+    targets = encode_bboxes(rois, gt_bboxes[gt_indices, :4])
+    for i in np.where(foreground)[0]:
+        bbox_targets[i, 4 * labels[i]:4 * labels[i] + 4] = targets[i]
+    return labels, bbox_targets, foreground
+
+
+def _check(rois, labels, bbox_targets, rpn_rois, gt_bboxes):
+    all_rois = np.vstack([rpn_rois, gt_bboxes[:, :4]]) if frc.ADD_GT_BOX_TO_TRAIN else rpn_rois
+    _, _, all_foreground = _expected(np.float32(all_rois), gt_bboxes)
+    num_fg = int(all_foreground.sum())
+    fg_slots = int(np.round(frc.FASTER_RCNN_POSITIVE_RATE * frc.FASTER_RCNN_MINIBATCH_SIZE))
+    assert num_fg > fg_slots and (~all_foreground).sum() > frc.FASTER_RCNN_MINIBATCH_SIZE - fg_slots
+
+    assert len(rois) == len(labels) == len(bbox_targets) == frc.FASTER_RCNN_MINIBATCH_SIZE
+    # Every kept roi is a distinct input roi.
+    matches = np.all(np.isclose(rois[:, np.newaxis], np.float32(all_rois)[np.newaxis]), axis=2)
+    assert np.all(matches.sum(axis=1) >= 1)
+    assert len(np.unique(matches.argmax(axis=1))) == len(rois)
+
+    expected_labels, expected_bbox_targets, foreground = _expected(rois, gt_bboxes)
+    assert foreground.sum() == min(num_fg, fg_slots)
+    # Foreground rois come first.
+    assert np.all(foreground[:fg_slots]) and not np.any(foreground[fg_slots:])
+    np.testing.assert_array_equal(labels, expected_labels)
+    np.testing.assert_allclose(bbox_targets, expected_bbox_targets, atol=1e-4)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_numpy_sampler(seed):
+    rpn_rois, gt_bboxes = _inputs(seed)
+    np.random.seed(seed)
+    rois, labels, bbox_targets = process_proposal_targets_py(rpn_rois, gt_bboxes)
+    _check(np.float32(rois), labels, bbox_targets, rpn_rois, gt_bboxes)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_graph_sampler(seed):
+    rpn_rois, gt_bboxes = _inputs(seed)
+    with tf.Graph().as_default():
+        tf.set_random_seed(seed)
+        outputs = process_proposal_targets(tf.constant(rpn_rois), tf.constant(gt_bboxes))
+        with tf.Session() as sess:
+            rois, labels, bbox_targets = sess.run(outputs)
+    _check(rois, labels, bbox_targets, rpn_rois, gt_bboxes)
@@ -0,0 +1,83 @@
+"""
+Pre-render toy shape images into shards, so runs can replay exactly the same data.
+
+    python -m toy_dataset.build_shards --output ./data/shapes --num-images 10000 --images-per-shard 1000
+"""
+import argparse
+import os
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+from toy_dataset.shape_generator import generate_shape_images
+from toy_dataset.shards import shard_prefix, write_shard
+
+import faster_rcnn_configs as frc
+
+
+# Images generated by one call of generate_shape_images
+_GENERATE_BATCH_SIZE = 32
+
+
+def _build_shard(args):
+    output, shard_index, num_shards, first_seed, num_images, image_shape, num_objects = args
+    seeds = np.arange(first_seed, first_seed + num_images)
+    images, gt_bboxes_list = [], []
+    for start in range(0, num_images, _GENERATE_BATCH_SIZE):
+        batch_seeds = seeds[start:start + _GENERATE_BATCH_SIZE]
+        batch_images, bboxes, labels, _ = generate_shape_images(len(batch_seeds), image_shape, n=num_objects,
+                                                                seeds=batch_seeds)
+        images.append(batch_images)
+        gt_bboxes_list.extend(np.concatenate([bboxes, labels[:, :, np.newaxis]], axis=2))
+
+    prefix = shard_prefix(output, shard_index, num_shards)
+    write_shard(prefix, np.concatenate(images), gt_bboxes_list, seeds)
+    return prefix, num_images
+
+
+def build_shards(output, num_images, images_per_shard, image_shape, num_objects=9, seed=0, workers=1):
+    """
+    Render num_images images into shards of images_per_shard images. Image i is generated with seed + i, so the
+    dataset only depends on the arguments.
+    """
+    if not os.path.exists(output):
+        os.makedirs(output)
+
+    num_shards = (num_images + images_per_shard - 1) // images_per_shard
+    tasks = []
+    for shard_index in range(num_shards):
+        first = shard_index * images_per_shard
+        tasks.append((output, shard_index, num_shards, seed + first, min(images_per_shard, num_images - first),
+                      tuple(image_shape), num_objects))
+
+    if workers > 1:
+        with Pool(workers) as pool:
+            results = pool.map(_build_shard, tasks)
+    else:
+        results = [_build_shard(task) for task in tasks]
+    return results
+
+
+def _main():
+    parser = argparse.ArgumentParser(description='Pre-render toy shape images into shards.')
+    parser.add_argument('--output', required=True, help='Directory of the shards.')
+    parser.add_argument('--num-images', type=int, required=True)
+    parser.add_argument('--images-per-shard', type=int, default=1000)
+    parser.add_argument('--image-shape', type=int, nargs=2, default=frc.IMAGE_SHAPE, metavar=('HEIGHT', 'WIDTH'))
+    parser.add_argument('--num-objects', type=int, default=frc.TOY_OBJECTS_PER_IMAGE,
+                        help='Shapes drawn in each image.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the first image.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    start_time = time.time()
+    results = build_shards(args.output, args.num_images, args.images_per_shard, args.image_shape,
+                           num_objects=args.num_objects, seed=args.seed, workers=args.workers)
+    for prefix, num_images in results:
+        print(f'{prefix}: {num_images} images')
+    print(f'{args.num_images} images in {len(results)} shards, {time.time() - start_time:.3}s')
+
+
+if __name__ == '__main__':
+    _main()
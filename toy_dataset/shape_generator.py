@@ -1,153 +1,153 @@
 import numpy as np
 import cv2
-import time
+
+
+CIRCLE, RECTANGLE, TRIANGLE = 1, 2, 3
 
 
 def generate_shape_image(image_size, n=9):
+    """
+    Generate one image with the global numpy random state. See generate_shape_images.
+    """
+    images, bboxes, labels, areas = generate_shape_images(1, image_size, n=n,
+                                                          seeds=[np.random.randint(0, 2 ** 31 - 1)])
+    return images[0], bboxes[0], labels[0], areas[0]
+
+
+def generate_shape_images(batch_size, image_size, n=9, seeds=None, offset=15, board_rate=0.1):
+    """
+    Generate a batch of images with n circles, rectangles and triangles each. Every image draws its random numbers
+    from its own generator, so images only depend on their seed and can be split across processes. The geometry is
+    computed as [batch_size, n] arrays, only the rasterization loops over shapes.
+    :param batch_size: Number of images.
+    :param image_size: [image_height, image_width]
+    :param n: Number of shapes in each image, one shape for each cell of a grid over the image.
+    :param seeds: Seed or np.random.Generator of each image. Random seeds from the global random state if None.
+    :param offset: Margin added around each shape in its bounding box.
+    :param board_rate: Margin of the shape centers inside their grid cell, relative to the cell size.
+    :return: images [batch_size, height, width, 3] uint8, bboxes [batch_size, n, 4] [x1, y1, x2, y2],
+    labels [batch_size, n] and areas [batch_size, n], shapes sorted by area in descending order.
+    """
+    if seeds is None:
+        seeds = np.random.randint(0, 2 ** 31 - 1, batch_size)
+    assert len(seeds) == batch_size
+    generators = [seed if isinstance(seed, np.random.Generator) else np.random.default_rng(seed) for seed in seeds]
+
+    draws = [_draw_random(generator, n, image_size) for generator in generators]
+    backgrounds, radius_divisors, center_rates, shape_types, rect_rates, angles, directions, colors = \
+        [np.stack(values) for values in zip(*draws)]
+
+    centers, radius = _gen_centers(n, image_size, radius_divisors, center_rates, board_rate)
+    circle_rects, circle_areas = _gen_circles(image_size, centers, radius, offset)
+    rect_pts, rect_rects, rect_areas = _gen_rectangles(image_size, centers, radius, rect_rates, offset)
+    triangle_pts, triangle_rects, triangle_areas = _gen_triangles(image_size, centers, radius, angles, directions,
+                                                                  offset)
+
+    is_circle = (shape_types == CIRCLE)[:, :, np.newaxis]
+    is_rectangle = (shape_types == RECTANGLE)[:, :, np.newaxis]
+    bboxes = np.where(is_circle, circle_rects, np.where(is_rectangle, rect_rects, triangle_rects))
+    areas = np.where(is_circle[..., 0], circle_areas, np.where(is_rectangle[..., 0], rect_areas, triangle_areas))
+
+    # Large shapes first, so the small ones are drawn on top of them.
+    order = np.argsort(-areas, axis=1, kind='stable')
+    bboxes = np.take_along_axis(bboxes, order[:, :, np.newaxis], axis=1)
+    areas = np.take_along_axis(areas, order, axis=1)
+    labels = np.take_along_axis(shape_types, order, axis=1)
+
+    images = backgrounds
+    for b in range(batch_size):
+        image = images[b]
+        for i in order[b]:
+            color = tuple(int(c) for c in colors[b, i])
+            if shape_types[b, i] == CIRCLE:
+                cv2.circle(image, (int(centers[b, i, 0]), int(centers[b, i, 1])), int(radius[b, i]), color, -1)
+            elif shape_types[b, i] == RECTANGLE:
+                cv2.rectangle(image, tuple(int(v) for v in rect_pts[b, i, 0]), tuple(int(v) for v in rect_pts[b, i, 1]),
+                              color, -1)
+            else:
+                cv2.fillConvexPoly(image, triangle_pts[b, i], color)
+    return images, bboxes, labels, areas
+
+
+def _draw_random(generator, n, image_size):
+    """
+    All random numbers of one image, drawn from its own generator.
+    """
     img_h, img_w = image_size
-    image = np.random.randint(0, 255, (img_h, img_w, 3), dtype=np.uint8)
-    # image = np.zeros((img_h, img_w, 3), dtype=np.uint8)
-
-    centers, radius = _gen_centers(n, image_size)
-    bboxes = []
-    labels = []
-    areas = []
-    draw_data = []
-    for i in range(n):
-        rect, area, label, data = _gen_shape(image_size, centers[i], radius[i])
-        bboxes.append(rect)
-        areas.append(area)
-        labels.append(label)
-        draw_data.append(data)
-
-    sorted_index = np.argsort(areas)[::-1]
-    bboxes = np.array(bboxes)
-    labels = np.array(labels)
-    draw_data = np.array(draw_data)
-
-    bboxes = bboxes[sorted_index]
-    labels = labels[sorted_index]
-    areas = np.sort(areas)[::-1]
-    draw_data = draw_data[sorted_index]
-
-    for i in range(len(labels)):
-        data = draw_data[i]
-        color = _random_color()
-        if labels[i] == 1:
-            image = cv2.circle(image, (data[0][0], data[0][1]), data[1], color, -1)
-        elif labels[i] == 2:
-            # print(data[0], data[1])
-            image = cv2.rectangle(image, (data[0][0], data[0][1]), (data[1][0], data[1][1]), color, -1)
-        else:
-            image = cv2.fillConvexPoly(image, data, color)
-    return image, bboxes, labels, areas
-
-
-def _calc_box_area(box):
-    return (box[2] - box[0]) * (box[3] - box[1])
-
-
-def _gen_centers(n, image_size, board_rate=0.1):
-    # np.random.seed(round(time.time()) % 13)
+    background = generator.integers(0, 255, (img_h, img_w, 3), dtype=np.uint8)
+    radius_divisors = generator.integers(3, 6, n)
+    center_rates = generator.random((n, 2))
+    shape_types = generator.integers(CIRCLE, TRIANGLE + 1, n)
+    rect_rates = generator.random(n)
+    angles = generator.integers(70, 150, (n, 2))
+    directions = generator.random((n, 2)) + 1e-6
+    colors = generator.integers(50, 255, (n, 3))
+    return background, radius_divisors, center_rates, shape_types, rect_rates, angles, directions, colors
+
+
+def _gen_centers(n, image_size, radius_divisors, center_rates, board_rate):
     img_h, img_w = image_size
 
-    unit1 = np.round(np.sqrt(n))
-    unit2 = np.round(n / unit1)
-    xx, yy = np.meshgrid(np.arange(unit1), np.arange(unit2))
-    x_step = img_w // unit1
-    y_step = img_h // unit2
+    # One shape for each cell of a grid, cells are filled row by row.
+    unit_x = max(1, int(np.round(np.sqrt(n))))
+    unit_y = max(1, int(np.ceil(n / unit_x)))
+    x_step = img_w // unit_x
+    y_step = img_h // unit_y
     board_w = np.round(board_rate * x_step)
     board_h = np.round(board_rate * y_step)
-    radius = np.int32(np.round(np.minimum(x_step, y_step) / np.random.randint(3, 6, n)))
-    center_pos = []
-    for i in range(xx.shape[0]):
-        for j in range(xx.shape[1]):
-            pt = [np.random.randint(x_step * xx[i, j] + board_w, x_step * (xx[i, j] + 1) - board_w),
-                  np.random.randint(y_step * yy[i, j] + board_h, y_step * (yy[i, j] + 1) - board_h)]
-            center_pos.append(pt)
-    # print(center_pos)
-    center_pos = np.array(center_pos)
-    # print(center_pos)
-
-    # radius = np.int32(np.round(np.minimum(img_h, img_w) / np.random.randint(5, 10, n)))
-    # center_pos = np.concatenate([np.random.randint(board_w, img_w - board_w + 1, size=(n, 1), dtype=np.int32),
-    #                              np.random.randint(board_h, img_h - board_h + 1, size=(n, 1), dtype=np.int32)], axis=1)
-    # print(center_pos)
-
-    return center_pos, np.sort(radius)[::-1]
-
-
-def _gen_shape(image_shape, center_pos, radius, shape_type=None, offset=15):
-    if shape_type is None:
-        shape_type = np.random.randint(1, 4)
-
-    img_h, img_w = image_shape
-
-    if shape_type == 1:
-        rect = [np.maximum(0, int(center_pos[0] - radius - offset)),
-                np.maximum(0, int(center_pos[1] - radius - offset)),
-                np.minimum(img_w, int(center_pos[0] + radius + offset)),
-                np.minimum(img_h, int(center_pos[1] + radius + offset))]
-        area = np.pi * radius ** 2
-        data = [center_pos, radius]
-    elif shape_type == 2:
-        w = radius * 1.5
-        h = (np.random.rand() + 0.5) * w
-        pt1 = (int(np.maximum(0, center_pos[0] - w // 2)),
-               int(np.minimum(img_w, center_pos[1] - h // 2)))
-        pt2 = (int(np.maximum(0, center_pos[0] + w // 2)),
-               int(np.minimum(img_h, center_pos[1] + h // 2)))
-        rect = [np.maximum(0, pt1[0] - offset), np.maximum(0, pt1[1] - offset),
-                np.minimum(img_w, pt2[0] + offset), np.minimum(img_h, pt2[1] + offset)]
-        area = _calc_box_area(rect)
-        data = [pt1, pt2]
-    else:
-        data, rect, area = _gen_triangle(center_pos, radius)
-        rect[:2] = np.maximum(0, rect[:2] - offset)
-        rect[2:] = np.minimum([img_w, img_h], rect[2:] + offset)
-
-    return rect, area, shape_type, data
-
-
-def _random_color(colors=None):
-    if colors is not None:
-        assert type(colors) == list
-        delta = np.mean(np.vstack(colors), axis=0) - 127.5
-        color = np.zeros(3)
-        color[delta < 0] = 255
-    else:
-        color = np.random.randint(50, 255, (3,))
-
-    return int(color[0]), int(color[1]), int(color[2])
-
-
-def _gen_triangle(center_pos, radius):
-    angle = np.random.randint(70, 150, (2,))
-    vec1 = np.random.rand(2)
-    vec1 = vec1 / np.linalg.norm(vec1)
-    pt1 = center_pos + radius * vec1
-    cos_angle0 = np.cos(np.deg2rad(angle[0]))
-    sin_angle0 = np.sin(np.deg2rad(angle[0]))
-    cos_angle1 = np.cos(np.deg2rad(np.sum(angle)))
-    sin_angle1 = np.sin(np.deg2rad(np.sum(angle)))
-
-    rotate_mat0 = np.array([[cos_angle0, -sin_angle0], [sin_angle0, cos_angle0]])
-    rotate_mat1 = np.array([[cos_angle1, -sin_angle1], [sin_angle1, cos_angle1]])
-
-    vec2 = np.matmul(rotate_mat0, vec1)
-    vec3 = np.matmul(rotate_mat1, vec1)
-
-    pt2 = center_pos + radius * vec2
-    pt3 = center_pos + radius * vec3
-
-    pts = np.int32(np.vstack([pt1, pt2, pt3]))
-
-    rect = np.hstack([np.min(pts, axis=0), np.max(pts, axis=0)])
-
-    area = 0.5 * (np.sin(np.deg2rad(angle[0])) + np.sin(np.deg2rad(angle[1])) +
-                  np.sin(np.deg2rad(360 - np.sum(angle)))) * radius ** 2
-
-    return pts, rect, area
+
+    cells = np.arange(n)
+    low = np.stack([x_step * (cells % unit_x) + board_w, y_step * (cells // unit_x) + board_h], axis=1)
+    high = np.stack([x_step * (cells % unit_x + 1) - board_w, y_step * (cells // unit_x + 1) - board_h], axis=1)
+    centers = np.int32(low + np.floor(center_rates * np.maximum(high - low, 1)))
+
+    radius = np.int32(np.maximum(1, np.round(np.minimum(x_step, y_step) / radius_divisors)))
+    return centers, np.sort(radius, axis=1)[:, ::-1]
+
+
+def _clip_rects(image_size, rects, offset):
+    img_h, img_w = image_size
+    return np.stack([np.maximum(0, rects[..., 0] - offset), np.maximum(0, rects[..., 1] - offset),
+                     np.minimum(img_w, rects[..., 2] + offset), np.minimum(img_h, rects[..., 3] + offset)],
+                    axis=-1).astype(np.int32)
+
+
+def _gen_circles(image_size, centers, radius, offset):
+    rects = np.concatenate([centers - radius[..., np.newaxis], centers + radius[..., np.newaxis]], axis=-1)
+    return _clip_rects(image_size, rects, offset), np.pi * np.float64(radius) ** 2
+
+
+def _gen_rectangles(image_size, centers, radius, rect_rates, offset):
+    img_h, img_w = image_size
+    w = radius * 1.5
+    h = (rect_rates + 0.5) * w
+    half_size = np.stack([w // 2, h // 2], axis=-1)
+
+    pt1 = np.int32(np.maximum(0, centers - half_size))
+    pt2 = np.int32(np.minimum([img_w, img_h], centers + half_size))
+    rects = _clip_rects(image_size, np.concatenate([pt1, pt2], axis=-1), offset)
+    areas = np.float64((rects[..., 2] - rects[..., 0]) * (rects[..., 3] - rects[..., 1]))
+    return np.stack([pt1, pt2], axis=2), rects, areas
+
+
+def _gen_triangles(image_size, centers, radius, angles, directions, offset):
+    vec1 = directions / np.linalg.norm(directions, axis=-1, keepdims=True)
+
+    def _rotate(vec, degrees):
+        cos_angle, sin_angle = np.cos(np.deg2rad(degrees)), np.sin(np.deg2rad(degrees))
+        return np.stack([cos_angle * vec[..., 0] - sin_angle * vec[..., 1],
+                         sin_angle * vec[..., 0] + cos_angle * vec[..., 1]], axis=-1)
+
+    vec2 = _rotate(vec1, angles[..., 0])
+    vec3 = _rotate(vec1, np.sum(angles, axis=-1))
+
+    pts = np.int32(centers[:, :, np.newaxis, :] + radius[..., np.newaxis, np.newaxis] *
+                   np.stack([vec1, vec2, vec3], axis=2))
+    rects = _clip_rects(image_size, np.concatenate([pts.min(axis=2), pts.max(axis=2)], axis=-1), offset)
+
+    area = 0.5 * (np.sin(np.deg2rad(angles[..., 0])) + np.sin(np.deg2rad(angles[..., 1])) +
+                  np.sin(np.deg2rad(360 - np.sum(angles, axis=-1)))) * np.float64(radius) ** 2
+    return pts, rects, area
 
 
 if __name__ == '__main__':
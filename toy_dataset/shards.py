@@ -0,0 +1,126 @@
+import glob
+import os
+
+import numpy as np
+
+
+# A shard is two files sharing a prefix:
+#   <prefix>.images     raw uint8 blob of num_images x height x width x 3, read with memory mapping
+#   <prefix>.index.npz  image_shape, offsets (num_images + 1) and gt_bboxes [x1, y1, x2, y2, label] of all images,
+#                       the ground truth of image i is gt_bboxes[offsets[i]:offsets[i + 1]]
+_IMAGES_SUFFIX = '.images'
+_INDEX_SUFFIX = '.index.npz'
+
+
+def shard_prefix(dataset_path, shard_index, num_shards):
+    return os.path.join(dataset_path, 'shard-{:05d}-of-{:05d}'.format(shard_index, num_shards))
+
+
+def list_shards(dataset_path):
+    """
+    Sorted prefixes of the shards in dataset_path.
+    """
+    index_paths = sorted(glob.glob(os.path.join(dataset_path, '*' + _INDEX_SUFFIX)))
+    return [path[:-len(_INDEX_SUFFIX)] for path in index_paths]
+
+
+def write_shard(prefix, images, gt_bboxes_list, seeds=None):
+    """
+    Write one shard. Files are written under a temporary name and renamed, a shard is either complete or absent.
+    :param prefix: Path prefix of the shard files.
+    :param images: num_images x height x width x 3 uint8 images.
+    :param gt_bboxes_list: Ground truth [x1, y1, x2, y2, label] of each image.
+    :param seeds: Optional seed of each image, kept in the index to regenerate an image.
+    """
+    images = np.ascontiguousarray(images, dtype=np.uint8)
+    counts = [len(gt_bboxes) for gt_bboxes in gt_bboxes_list]
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    gt_bboxes = np.concatenate([np.reshape(gt_bboxes, (-1, 5)) for gt_bboxes in gt_bboxes_list] +
+                               [np.zeros((0, 5))]).astype(np.int32)
+    seeds = np.full((len(images),), -1, dtype=np.int64) if seeds is None else np.int64(seeds)
+
+    images.tofile(prefix + _IMAGES_SUFFIX + '.tmp')
+    with open(prefix + _INDEX_SUFFIX + '.tmp', 'wb') as f:
+        np.savez(f, image_shape=np.int32(images.shape[1:]), offsets=offsets, gt_bboxes=gt_bboxes, seeds=seeds)
+
+    os.replace(prefix + _IMAGES_SUFFIX + '.tmp', prefix + _IMAGES_SUFFIX)
+    os.replace(prefix + _INDEX_SUFFIX + '.tmp', prefix + _INDEX_SUFFIX)
+
+
+class Shard(object):
+    """
+    Read-only view of one shard. Images are slices of a memory map and ground truth are slices of the index, no
+    data is copied.
+    """
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        with np.load(prefix + _INDEX_SUFFIX) as index:
+            self.image_shape = tuple(int(size) for size in index['image_shape'])
+            self.offsets = index['offsets']
+            self.gt_bboxes = index['gt_bboxes']
+            self.seeds = index['seeds']
+        self.images = np.memmap(prefix + _IMAGES_SUFFIX, dtype=np.uint8, mode='r',
+                                shape=(len(self.offsets) - 1,) + self.image_shape)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.images[i], self.gt_bboxes[self.offsets[i]:self.offsets[i + 1]]
+
+
+class ShardReader(object):
+    """
+    Stream (image, gt_bboxes) from the shards of a dataset. With shuffle, the order of the shards and the order of
+    the images inside each shard are permuted every epoch, reads stay local to one shard at a time.
+    Task task_index of num_tasks data parallel trainers reads every num_tasks-th shard, or all of them in its own
+    order when there are fewer shards than tasks.
+    """
+
+    def __init__(self, dataset_path, shuffle=True, seed=None, repeat=True, task_index=0, num_tasks=1):
+        self.shards = [Shard(prefix) for prefix in list_shards(dataset_path)]
+        if not self.shards:
+            raise ValueError('No shard found in {}.'.format(dataset_path))
+        if len(self.shards) >= num_tasks:
+            self.shards = self.shards[task_index::num_tasks]
+
+        image_shapes = set(shard.image_shape for shard in self.shards)
+        if len(image_shapes) != 1:
+            raise ValueError('Shards of {} have different image shapes {}.'.format(dataset_path, image_shapes))
+        self.image_shape = image_shapes.pop()
+
+        self.shuffle = shuffle
+        self.repeat = repeat
+        self._random = np.random.RandomState(seed)
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+    def _epoch(self):
+        shard_order = np.arange(len(self.shards))
+        if self.shuffle:
+            self._random.shuffle(shard_order)
+
+        for shard_index in shard_order:
+            shard = self.shards[shard_index]
+            image_order = self._random.permutation(len(shard)) if self.shuffle else range(len(shard))
+            for i in image_order:
+                yield shard, int(i)
+
+    def positions(self):
+        """
+        Stream (shard prefix, image index) in the order of the samples, for readers in other processes.
+        """
+        while True:
+            for shard, i in self._epoch():
+                yield shard.prefix, i
+            if not self.repeat:
+                break
+
+    def __iter__(self):
+        while True:
+            for shard, i in self._epoch():
+                yield shard[i]
+            if not self.repeat:
+                break
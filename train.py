@@ -1,92 +1,52 @@
 import os
-import sys
 import time
-from importlib import import_module
 
-import numpy as np
 import tensorflow as tf
 from tensorflow.contrib import slim
 
-from toy_dataset.shape_generator import generate_shape_image
-from region_proposal_network import rpn
-from faster_rcnn import faster_rcnn, process_faster_rcnn, build_faster_rcnn_losses
+from input_pipeline import InputPipeline
+from region_proposal_network import rpn, unpad_gt_bboxes
+from faster_rcnn import backbone_features, faster_rcnn, process_faster_rcnn, build_faster_rcnn_losses
 
-from utils.image_draw import draw_rectangle_with_name, draw_rectangle
+from utils.checkpoint_writer import AsyncCheckpointWriter
+from utils.profiling import StageProfiler
+from utils.session_config import pin_process, session_config
+from utils.summary_renderer import SummaryRenderer
 import faster_rcnn_configs as frc
 
 
-def _network(inputs, image_shape, gt_bboxes):
-    if 'backbones' not in sys.path:
-        sys.path.append('backbones')
-    cnn = import_module(frc.BACKBONE, package='backbones')
+def build_network(inputs, image_shape, gt_bboxes, rpn_targets=None):
     # CNN
-    feature_map = cnn.inference(inputs)
-
-    features = slim.conv2d(feature_map, 512, [3, 3], normalizer_fn=slim.batch_norm,
-                           normalizer_params={'decay': 0.995, 'epsilon': 0.0001},
-                           weights_regularizer=slim.l2_regularizer(frc.L2_WEIGHT),
-                           scope='rpn_feature')
+    features = backbone_features(inputs)
 
     # RPN
-    rpn_cls_loss, rpn_cls_acc, rpn_bbox_loss, rois, labels, bbox_targets = rpn(features, image_shape, gt_bboxes)
-
-    # Image summary for RPN rois
-    class_names = frc.CLS_NAMES + ['circle', 'rectangle', 'triangle']
-    display_rois_img = tf.reshape(inputs, shape=[frc.IMAGE_SHAPE[0], frc.IMAGE_SHAPE[1], 3])
-    for i in range(frc.NUM_CLS + 1):
-        display_indices = tf.reshape(tf.where(tf.equal(labels, i)), [-1])
-        display_rois = tf.gather(rois, display_indices)
-        display_img = tf.py_func(draw_rectangle, [display_rois_img, display_rois], [tf.uint8])
-        tf.summary.image('class_rois/{}'.format(class_names[i]), display_img)
+    rpn_cls_loss, rpn_cls_acc, rpn_bbox_loss, rois, labels, bbox_targets, roi_batch_indices = \
+        rpn(features, image_shape, gt_bboxes, rpn_targets)
 
     # RCNN
-    cls_score, bbox_pred = faster_rcnn(features, rois, image_shape)
+    cls_score, bbox_pred = faster_rcnn(features, rois, image_shape, roi_batch_indices=roi_batch_indices)
 
     cls_prob = slim.softmax(cls_score)
     cls_categories = tf.cast(tf.argmax(cls_prob, axis=1), dtype=tf.int32)
     rcnn_cls_acc = tf.reduce_mean(tf.cast(tf.equal(cls_categories, tf.cast(labels, tf.int32)), tf.float32))
 
-    final_bbox, final_score, final_categories = process_faster_rcnn(rois, bbox_pred, cls_prob, image_shape)
+    # Detections of the first image for summaries
+    first_image_indices = tf.reshape(tf.where(tf.equal(roi_batch_indices, 0)), [-1])
+    final_bbox, final_score, final_categories = process_faster_rcnn(tf.gather(rois, first_image_indices),
+                                                                    tf.gather(bbox_pred, first_image_indices),
+                                                                    tf.gather(cls_prob, first_image_indices),
+                                                                    image_shape)
 
     rcnn_bbox_loss, rcnn_cls_loss = build_faster_rcnn_losses(bbox_pred, bbox_targets, cls_prob, labels, frc.NUM_CLS + 1)
 
-    # ------------------------------BEGIN SUMMARY--------------------------------
-    # Add predicted bbox with confidence 0.25, 0.5, 0.75 and ground truth in image summary.
-    with tf.name_scope('rcnn_image_summary'):
-        display_indices_25 = tf.reshape(tf.where(tf.greater_equal(final_score, 0.25) &
-                                                 tf.less(final_score, 0.5) &
-                                                 tf.not_equal(final_categories, 0)), [-1])
-        display_indices_50 = tf.reshape(tf.where(tf.greater_equal(final_score, 0.5) &
-                                                 tf.less(final_score, 0.75) &
-                                                 tf.not_equal(final_categories, 0)), [-1])
-        display_indices_75 = tf.reshape(tf.where(tf.greater_equal(final_score, 0.75) &
-                                                 tf.not_equal(final_categories, 0)), [-1])
-
-        display_bboxes_25 = tf.gather(final_bbox, display_indices_25)
-        display_bboxes_50 = tf.gather(final_bbox, display_indices_50)
-        display_bboxes_75 = tf.gather(final_bbox, display_indices_75)
-        display_categories_25 = tf.gather(final_categories, display_indices_25)
-        display_categories_50 = tf.gather(final_categories, display_indices_50)
-        display_categories_75 = tf.gather(final_categories, display_indices_75)
-
-        display_image_25 = tf.py_func(draw_rectangle_with_name,
-                                      [inputs[0], display_bboxes_25, display_categories_25, class_names],
-                                      [tf.uint8])
-        display_image_50 = tf.py_func(draw_rectangle_with_name,
-                                      [inputs[0], display_bboxes_50, display_categories_50, class_names],
-                                      [tf.uint8])
-        display_image_75 = tf.py_func(draw_rectangle_with_name,
-                                      [inputs[0], display_bboxes_75, display_categories_75, class_names],
-                                      [tf.uint8])
-        display_image_gt = tf.py_func(draw_rectangle_with_name,
-                                      [inputs[0], gt_bboxes[:, :-1], gt_bboxes[:, -1], class_names],
-                                      [tf.uint8])
-
-    tf.summary.image('detection/gt', display_image_gt)
-    tf.summary.image('detection/25', display_image_25)
-    tf.summary.image('detection/50', display_image_50)
-    tf.summary.image('detection/75', display_image_75)
-    # -------------------------------END SUMMARY---------------------------------
+    # Raw tensors of the first image, drawn into image summaries by the renderer process.
+    display = {'image': tf.cast(inputs[0], tf.uint8),
+               'rois': tf.gather(rois, first_image_indices),
+               'roi_labels': tf.gather(labels, first_image_indices),
+               'gt_bboxes': unpad_gt_bboxes(gt_bboxes[0]),
+               'final_bbox': final_bbox,
+               'final_score': final_score,
+               'final_categories': final_categories}
 
     loss_dict = {'rpn_cls_loss': rpn_cls_loss,
                  'rpn_bbox_loss': rpn_bbox_loss,
@@ -95,111 +55,167 @@ def _network(inputs, image_shape, gt_bboxes):
     acc_dict = {'rpn_cls_acc': rpn_cls_acc,
                 'rcnn_cls_acc': rcnn_cls_acc}
 
-    return final_bbox, final_score, final_categories, loss_dict, acc_dict
-
+    return final_bbox, final_score, final_categories, loss_dict, acc_dict, display
 
-def _image_batch(image_shape, batch_size=1):
-    batch_image, bboxes, labels, _ = generate_shape_image(image_shape)
-    batch_image = batch_image.reshape((batch_size, image_shape[0], image_shape[1], 3))
 
-    return batch_image, np.hstack([bboxes, labels[:, np.newaxis]]), image_shape
+def build_total_loss(loss_dict):
+    return frc.RPN_CLASSIFICATION_LOSS_WEIGHTS * loss_dict['rpn_cls_loss'] + \
+           frc.RPN_LOCATION_LOSS_WEIGHTS * loss_dict['rpn_bbox_loss'] + \
+           frc.FASTER_RCNN_CLASSIFICATION_LOSS_WEIGHTS * loss_dict['rcnn_cls_loss'] + \
+           frc.FASTER_RCNN_LOCATION_LOSS_WEIGHTS * loss_dict['rcnn_bbox_loss'] + \
+           tf.reduce_sum(tf.get_collection(tf.GraphKeys.REGULARIZATION_LOSSES))
 
 
 def _preprocess(inputs, image_shape=None):
     return inputs
 
 
-def _main():
-    with tf.name_scope('inputs'):
-        tf_images = tf.placeholder(dtype=tf.float32,
-                                   shape=[frc.IMAGE_BATCH_SIZE, frc.IMAGE_SHAPE[0], frc.IMAGE_SHAPE[1], 3],
-                                   name='images')
-        tf_labels = tf.placeholder(dtype=tf.int32, shape=[None, 5], name='ground_truth_bbox')
-        tf_shape = tf.placeholder(dtype=tf.int32, shape=[None], name='image_shape')
+def run_training(cluster=None, task_index=0, cpus=None):
+    """
+    Train on the input pipeline until MAXIMUM_ITERS global steps. With a tf.train.ClusterSpec, this process is the
+    worker task_index of a data parallel training: variables live on the ps tasks, the gradients of all workers are
+    averaged by a SyncReplicasOptimizer, so global_step and the learning rate advance once per averaged update, and
+    worker 0 is the chief, the only one writing summaries and checkpoints.
+    :param cpus: cpus the process is pinned to, as many intra op threads are used.
+    """
+    is_chief = task_index == 0
+    num_workers = cluster.num_tasks('worker') if cluster is not None else 1
 
-    # Preprocess input images
-    preprocessed_inputs = _preprocess(tf_images)
+    # Pinned before the input workers are forked, they share the cpus of this worker.
+    pin_process('train', cpus)
+    config = session_config('train', intra_op_threads=len(cpus) if cpus else None)
 
-    final_bbox, final_score, final_categories, loss_dict, acc_dict = _network(preprocessed_inputs, tf_shape, tf_labels)
+    # Samples are generated by worker processes and the chief's debug images by a renderer process, all started
+    # before the server and the session. Every trainer has its own random seed, or its own shards with DATASET_PATH.
+    pipeline = InputPipeline(task_index=task_index, num_tasks=num_workers)
 
-    total_loss = frc.RPN_CLASSIFICATION_LOSS_WEIGHTS * loss_dict['rpn_cls_loss'] + \
-                 frc.RPN_LOCATION_LOSS_WEIGHTS * loss_dict['rpn_bbox_loss'] + \
-                 frc.FASTER_RCNN_CLASSIFICATION_LOSS_WEIGHTS * loss_dict['rcnn_cls_loss'] + \
-                 frc.FASTER_RCNN_LOCATION_LOSS_WEIGHTS * loss_dict['rcnn_bbox_loss'] + \
-                 tf.reduce_sum(tf.get_collection(tf.GraphKeys.REGULARIZATION_LOSSES))
+    log_dir = None
+    if is_chief:
+        if not os.path.exists(frc.SUMMARY_PATH):
+            os.mkdir(frc.SUMMARY_PATH)
 
-    global_step = tf.train.get_or_create_global_step()
+        start_time = time.strftime('%Y_%m_%d_%H_%M_%S')
+        log_dir = os.path.join(frc.SUMMARY_PATH, start_time)
+        save_model_dir = os.path.join(log_dir, 'model')
 
-    learning_rate = tf.train.piecewise_constant(global_step, frc.LEARNING_RATE_BOUNDARIES, frc.LEARNING_RATE_SCHEDULAR)
+        if not os.path.exists(save_model_dir):
+            os.mkdir(log_dir)
+            os.mkdir(save_model_dir)
 
-    # Adam
-    train_op = tf.train.AdamOptimizer(learning_rate).minimize(total_loss, global_step=global_step)
+        # Debug images are drawn and written by a process started before the server.
+        summary_renderer = SummaryRenderer(log_dir, frc.CLS_NAMES + ['circle', 'rectangle', 'triangle'],
+                                           max_pending=frc.SUMMARY_RENDER_PENDING)
 
-    # Momentum
-    # train_op = tf.train.MomentumOptimizer(learning_rate, momentum=0.9).minimize(total_loss, global_step=global_step)
+    master, device = '', None
+    if cluster is not None:
+        # Workers only talk to the ps tasks, not to each other.
+        config.device_filters.extend(['/job:ps', '/job:worker/task:{}'.format(task_index)])
+        server = tf.train.Server(cluster, job_name='worker', task_index=task_index, config=config)
+        master = server.target
+        device = tf.train.replica_device_setter(worker_device='/job:worker/task:{}'.format(task_index),
+                                                cluster=cluster)
 
-    # RMS
-    # train_op = tf.train.RMSPropOptimizer(learning_rate, momentum=0.9).minimize(total_loss, global_step=global_step)
+    with tf.device(device):
+        tf_images, tf_labels, tf_shape, tf_rpn_targets = pipeline.get_next()
 
-    # Add train summary.
-    with tf.name_scope('loss'):
-        tf.summary.scalar('total_loss', total_loss)
-        tf.summary.scalar('rpn_cls_loss', loss_dict['rpn_cls_loss'])
-        tf.summary.scalar('rpn_bbox_loss', loss_dict['rpn_bbox_loss'])
-        tf.summary.scalar('rcnn_cls_loss', loss_dict['rcnn_cls_loss'])
-        tf.summary.scalar('rcnn_bbox_loss', loss_dict['rcnn_bbox_loss'])
-    with tf.name_scope('accuracy'):
-        tf.summary.scalar('rpn_acc',  acc_dict['rpn_cls_acc'])
-        tf.summary.scalar('rcnn_acc', acc_dict['rcnn_cls_acc'])
-    with tf.name_scope('train'):
-        tf.summary.scalar('learning_rate', learning_rate)
+        # Preprocess input images
+        preprocessed_inputs = _preprocess(tf_images)
 
-    summary_op = tf.summary.merge_all()
-    init_op = tf.group(tf.global_variables_initializer(), tf.local_variables_initializer())
+        final_bbox, final_score, final_categories, loss_dict, acc_dict, display = \
+            build_network(preprocessed_inputs, tf_shape, tf_labels, tf_rpn_targets)
 
-    saver = tf.train.Saver()
+        total_loss = build_total_loss(loss_dict)
 
-    if not os.path.exists(frc.SUMMARY_PATH):
-        os.mkdir(frc.SUMMARY_PATH)
+        global_step = tf.train.get_or_create_global_step()
 
-    with tf.Session() as sess:
-        if frc.PRE_TRAIN_MODEL_PATH:
-            print('Load pre-trained model:', frc.PRE_TRAIN_MODEL_PATH)
-            saver.restore(sess, frc.PRE_TRAIN_MODEL_PATH)
-        else:
-            sess.run(init_op)
+        learning_rate = tf.train.piecewise_constant(global_step, frc.LEARNING_RATE_BOUNDARIES,
+                                                    frc.LEARNING_RATE_SCHEDULAR)
 
-        start_time = time.strftime('%Y_%m_%d_%H_%M_%S')
-        log_dir = os.path.join(frc.SUMMARY_PATH, start_time)
-        save_model_dir = os.path.join(log_dir, 'model')
+        # Adam
+        optimizer = tf.train.AdamOptimizer(learning_rate)
 
-        if not os.path.exists(save_model_dir):
-            os.mkdir(log_dir)
-            os.mkdir(save_model_dir)
-        summary_writer = tf.summary.FileWriter(log_dir, graph=sess.graph)
+        # Momentum
+        # optimizer = tf.train.MomentumOptimizer(learning_rate, momentum=0.9)
 
-        coord = tf.train.Coordinator()
-        threads = tf.train.start_queue_runners(sess, coord)
+        # RMS
+        # optimizer = tf.train.RMSPropOptimizer(learning_rate, momentum=0.9)
 
-        try:
-            for step in range(frc.MAXIMUM_ITERS + 1):
-                images, gt_bboxes, image_shape = _image_batch(image_shape=frc.IMAGE_SHAPE)
-                feed_dict = {tf_images: images, tf_labels: gt_bboxes, tf_shape: image_shape}
+        hooks = []
+        if cluster is not None:
+            optimizer = tf.train.SyncReplicasOptimizer(optimizer, replicas_to_aggregate=num_workers,
+                                                       total_num_replicas=num_workers)
+            hooks.append(optimizer.make_session_run_hook(is_chief))
+        train_op = optimizer.minimize(total_loss, global_step=global_step)
+
+        # Add train summary.
+        with tf.name_scope('loss'):
+            tf.summary.scalar('total_loss', total_loss)
+            tf.summary.scalar('rpn_cls_loss', loss_dict['rpn_cls_loss'])
+            tf.summary.scalar('rpn_bbox_loss', loss_dict['rpn_bbox_loss'])
+            tf.summary.scalar('rcnn_cls_loss', loss_dict['rcnn_cls_loss'])
+            tf.summary.scalar('rcnn_bbox_loss', loss_dict['rcnn_bbox_loss'])
+        with tf.name_scope('accuracy'):
+            tf.summary.scalar('rpn_acc',  acc_dict['rpn_cls_acc'])
+            tf.summary.scalar('rcnn_acc', acc_dict['rcnn_cls_acc'])
+        with tf.name_scope('train'):
+            tf.summary.scalar('learning_rate', learning_rate)
+
+        summary_op = tf.summary.merge_all()
+        init_op = tf.group(tf.global_variables_initializer(), tf.local_variables_initializer())
+
+        saver = tf.train.Saver()
+
+    def init_fn(scaffold, sess):
+        if frc.PRE_TRAIN_MODEL_PATH:
+            print('Load pre-trained model:', frc.PRE_TRAIN_MODEL_PATH)
+            saver.restore(sess, frc.PRE_TRAIN_MODEL_PATH)
 
-                if step % frc.REFRESH_LOGS_ITERS != 0:
-                    _, global_step_ = sess.run([train_op, global_step], feed_dict)
+    # Only the chief initializes the variables, the other workers wait for them.
+    scaffold = tf.train.Scaffold(init_op=init_op, init_fn=init_fn, saver=saver)
+
+    with tf.train.MonitoredTrainingSession(master=master, is_chief=is_chief, scaffold=scaffold, hooks=hooks,
+                                           config=config) as sess:
+        if is_chief:
+            summary_writer = tf.summary.FileWriter(log_dir, graph=tf.get_default_graph())
+            checkpoint_writer = AsyncCheckpointWriter(tf.global_variables(), save_model_dir, frc.MODEL_NAME,
+                                                      keep_last=frc.SAVE_MODEL_KEEP_LAST,
+                                                      keep_every=frc.SAVE_MODEL_MAXIMUM_ITERS)
+
+        # Opt-in per stage profile of PROFILE_STEPS traced steps of the chief, written to the log directory.
+        profiler = StageProfiler() if frc.PROFILE_STEPS > 0 and is_chief else None
+        profile_end = frc.PROFILE_WARMUP_STEPS + frc.PROFILE_STEPS
+        # Time of the steps without summaries between two log steps.
+        total_train_time, num_train_steps = 0., 0
+        # Checkpoints are named after the global step, with several workers it advances between two chief steps.
+        next_save_step = frc.SAVE_MODEL_ITER
+
+        step = 0
+        try:
+            while not sess.should_stop():
+                if profiler is not None and frc.PROFILE_WARMUP_STEPS <= step < profile_end:
+                    # Traced steps run no summaries.
+                    _, global_step_ = profiler.run(sess, [train_op, global_step])
+                    if step == profile_end - 1:
+                        print(profiler.table())
+                        profiler.write_chrome_trace(os.path.join(log_dir, 'profile_trace.json'))
+                elif step % frc.REFRESH_LOGS_ITERS != 0 or not is_chief:
+                    train_time = time.time()
+                    _, global_step_ = sess.run([train_op, global_step])
+                    total_train_time += time.time() - train_time
+                    num_train_steps += 1
                 else:
                     step_time = time.time()
 
                     _, total_loss_, rpn_cls_loss_, rpn_bbox_loss_, rcnn_cls_loss_, rcnn_bbox_loss_, \
-                    rpn_cls_acc_, rcnn_cls_acc_, summary_str, global_step_ = \
+                    rpn_cls_acc_, rcnn_cls_acc_, summary_str, global_step_, display_ = \
                         sess.run([train_op, total_loss, loss_dict['rpn_cls_loss'], loss_dict['rpn_bbox_loss'],
                                   loss_dict['rcnn_cls_loss'], loss_dict['rcnn_bbox_loss'],
-                                  acc_dict['rpn_cls_acc'], acc_dict['rcnn_cls_acc'], summary_op, global_step], feed_dict)
+                                  acc_dict['rpn_cls_acc'], acc_dict['rcnn_cls_acc'], summary_op, global_step,
+                                  display])
 
                     step_time = time.time() - step_time
 
-                    print(f'Iter: {step}',
+                    print(f'Iter: {global_step_}',
                           f'| total_loss: {total_loss_:.3}',
                           f'| rpn_cls_loss: {rpn_cls_loss_:.3}',
                           f'| rpn_bbox_loss: {rpn_bbox_loss_:.3}',
@@ -207,19 +223,49 @@ def _main():
                           f'| rcnn_bbox_loss: {rcnn_bbox_loss_:.3}',
                           f'| rpn_cls_acc: {rpn_cls_acc_:.3}',
                           f'| rcnn_cls_acc: {rcnn_cls_acc_:.3}',
-                          f'| time: {step_time:.3}s')
+                          f'| time: {step_time:.3}s',
+                          f'| mean step: {total_train_time / max(1, num_train_steps):.3}s')
+                    total_train_time, num_train_steps = 0., 0
+
+                    num_batches, num_stalls, stall_time = pipeline.stats()
+                    print(f'Input: step waited for {num_stalls}/{num_batches} batches',
+                          f'| wait time: {stall_time:.3}s')
 
-                    summary_writer.add_summary(summary_str, step)
+                    summary_writer.add_summary(summary_str, global_step_)
                     summary_writer.flush()
+                    summary_renderer.submit(global_step_, display_)
 
-                    saver.save(sess, os.path.join(save_model_dir, frc.MODEL_NAME + '.ckpt'), step)
+                if is_chief and global_step_ >= next_save_step:
+                    stall_time = checkpoint_writer.save(sess, global_step_)
+                    print(f'Checkpoint {global_step_} queued | trainer stalled: {stall_time:.1f}ms')
+                    next_save_step = (global_step_ // frc.SAVE_MODEL_ITER + 1) * frc.SAVE_MODEL_ITER
+
+                step += 1
+                if global_step_ >= frc.MAXIMUM_ITERS:
+                    break
 
         except tf.errors.OutOfRangeError:
             print('done')
         finally:
-            coord.request_stop()
-        coord.join(threads)
-    summary_writer.close()
+            pipeline.close()
+            if is_chief:
+                checkpoint_writer.close()
+                summary_renderer.close()
+                summary_writer.close()
+                print(f'Image summaries: {summary_renderer.num_submitted} submitted',
+                      f'| {summary_renderer.num_dropped} dropped')
+                stall_times = checkpoint_writer.stall_times
+                if stall_times:
+                    print(f'Checkpoints: {len(stall_times)}',
+                          f'| mean stall: {sum(stall_times) / len(stall_times):.1f}ms',
+                          f'| max stall: {max(stall_times):.1f}ms')
+            else:
+                print(f'Worker {task_index}: {step} steps',
+                      f'| mean step: {total_train_time / max(1, num_train_steps):.3}s')
+
+
+def _main():
+    run_training()
 
 
 if __name__ == '__main__':
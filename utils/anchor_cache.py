@@ -0,0 +1,95 @@
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+from utils.anchor_utils import generate_anchors
+
+
+# anchors: all anchors of the feature map, [x1, y1, x2, y2], float32
+# inside_indices: indexes of the anchors inside the image border
+# areas: area of each anchor, float32
+AnchorGeometry = namedtuple('AnchorGeometry', ['anchors', 'inside_indices', 'areas'])
+
+_anchors_cache = OrderedDict()
+_geometry_cache = OrderedDict()
+
+
+def _lru_get(cache, key):
+    value = cache.get(key)
+    if value is not None:
+        cache.move_to_end(key)
+    return value
+
+
+def _lru_put(cache, key, value, cache_size):
+    cache[key] = value
+    while len(cache) > max(1, cache_size):
+        cache.popitem(last=False)
+    return value
+
+
+def shift_anchors(base_anchors, feature_shape, feature_stride):
+    """
+    NumPy version of region_proposal_network.make_anchors_in_image. Same float32 arithmetic, same layout:
+    index = (y * feature_width + x) * anchor_num + anchor_shape.
+    """
+    feature_height, feature_width = feature_shape
+    shift_x = np.arange(feature_width, dtype=np.float32) * np.float32(feature_stride)
+    shift_y = np.arange(feature_height, dtype=np.float32) * np.float32(feature_stride)
+    shift_x, shift_y = np.meshgrid(shift_x, shift_y)
+
+    shifts = np.stack([shift_x.ravel(), shift_y.ravel(), shift_x.ravel(), shift_y.ravel()], axis=1)
+    all_anchors = np.float32(base_anchors)[np.newaxis, :, :] + shifts[:, np.newaxis, :]
+    return all_anchors.reshape([-1, 4])
+
+
+def cached_anchors(feature_shape, feature_stride, anchor_base, scales, ratios, cache_size=8):
+    """
+    All anchors of a feature map, built once for each (feature_height, feature_width, feature_stride,
+    anchor_base, scales, ratios). The returned array is shared, do not modify it.
+    """
+    key = (int(feature_shape[0]), int(feature_shape[1]), float(feature_stride), float(anchor_base),
+           tuple(scales), tuple(ratios))
+    anchors = _lru_get(_anchors_cache, key)
+    if anchors is None:
+        base_anchors = generate_anchors(original_anchor=[1, 1, anchor_base - 1, anchor_base - 1],
+                                        scales=scales, ratios=ratios)
+        anchors = shift_anchors(base_anchors, key[:2], feature_stride)
+        anchors.setflags(write=False)
+        _lru_put(_anchors_cache, key, anchors, cache_size)
+    return anchors
+
+
+def anchor_geometry(feature_shape, feature_stride, image_shape, anchor_base, scales, ratios,
+                    allowed_border=0, cache_size=8):
+    """
+    Anchors, inside border indexes and areas of a feature map, computed once for each (feature_height,
+    feature_width, feature_stride, anchor_base, scales, ratios, image_shape). Least recently used entries are
+    dropped when more than cache_size geometries are seen. The returned arrays are shared, do not modify them.
+    :return: AnchorGeometry(anchors, inside_indices, areas)
+    """
+    key = (int(feature_shape[0]), int(feature_shape[1]), float(feature_stride), float(anchor_base),
+           tuple(scales), tuple(ratios), int(image_shape[0]), int(image_shape[1]), allowed_border)
+    geometry = _lru_get(_geometry_cache, key)
+    if geometry is not None:
+        return geometry
+
+    anchors = cached_anchors(feature_shape, feature_stride, anchor_base, scales, ratios, cache_size)
+
+    image_height, image_width = key[6], key[7]
+    inside_indices = np.where(
+        (anchors[:, 0] >= -allowed_border) &
+        (anchors[:, 1] >= -allowed_border) &
+        (anchors[:, 2] < image_width + allowed_border) &
+        (anchors[:, 3] < image_height + allowed_border)
+    )[0]
+    areas = (anchors[:, 2] - anchors[:, 0] + 1) * (anchors[:, 3] - anchors[:, 1] + 1)
+
+    inside_indices.setflags(write=False)
+    areas.setflags(write=False)
+    return _lru_put(_geometry_cache, key, AnchorGeometry(anchors, inside_indices, areas), cache_size)
+
+
+def clear_anchor_cache():
+    _anchors_cache.clear()
+    _geometry_cache.clear()
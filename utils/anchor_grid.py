@@ -0,0 +1,118 @@
+import numpy as np
+
+from utils.overlaps import paired_overlaps
+
+
+def _grid_range(gt_min, gt_max, anchor_min, anchor_max, feature_stride, size):
+    """
+    Range [lo, hi) of grid positions i for which an anchor [anchor_min + i * stride, anchor_max + i * stride]
+    can intersect [gt_min, gt_max]. Widened by one cell on both sides, the exact ious decide afterwards.
+    """
+    lo = np.floor((gt_min - anchor_max - 1) / feature_stride).astype(np.int64)
+    hi = np.ceil((gt_max - anchor_min + 1) / feature_stride).astype(np.int64) + 1
+    return np.clip(lo, 0, size), np.clip(hi, 0, size)
+
+
+def _expand_ranges(y_lo, y_hi, x_lo, x_hi):
+    """
+    Expand N rectangles of grid cells [y_lo, y_hi) x [x_lo, x_hi) into flat (owner, y, x) arrays.
+    """
+    heights = np.maximum(y_hi - y_lo, 0)
+    widths = np.maximum(x_hi - x_lo, 0)
+    counts = heights * widths
+
+    owners = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    owner_widths = widths[owners]
+    return owners, y_lo[owners] + offsets // owner_widths, x_lo[owners] + offsets % owner_widths
+
+
+def _group_argmax(groups, values, ties, num_groups):
+    """
+    Maximum value of each group and, among the elements reaching it, the smallest tie index, same as np.argmax.
+    """
+    group_max = np.zeros((num_groups,), dtype=values.dtype)
+    np.maximum.at(group_max, groups, values)
+
+    reached = values == group_max[groups]
+    group_argmax = np.full((num_groups,), np.iinfo(np.int64).max, dtype=np.int64)
+    np.minimum.at(group_argmax, groups[reached], ties[reached])
+    group_argmax[group_argmax == np.iinfo(np.int64).max] = 0
+    return group_argmax, group_max
+
+
+def grid_overlap_pairs(all_anchors, feature_shape, feature_stride, gt_bboxes, anchor_areas=None):
+    """
+    Find all (anchor, gt_bbox) pairs with iou > 0 using the anchor grid as spatial index. Anchors are laid out as
+    make_anchors_in_image does: index = (y * feature_width + x) * anchor_num + anchor_shape, and the anchors of
+    cell (0, 0) are the base anchors. Only the anchors whose extent can reach a gt_bbox are visited.
+    :param all_anchors: All anchors of the feature map.
+    :param feature_shape: [feature_height, feature_width]
+    :param feature_stride: Stride of the feature map.
+    :param gt_bboxes: Ground truth bounding boxes [x1, y1, x2, y2, ...], extra columns are ignored.
+    :param anchor_areas: Precomputed float32 areas of all anchors, optional.
+    :return: anchor indexes, gt_bbox indexes and ious of the overlapping pairs.
+    """
+    feature_height, feature_width = int(feature_shape[0]), int(feature_shape[1])
+    anchor_num = len(all_anchors) // max(1, feature_height * feature_width)
+    gt_bboxes = np.asarray(gt_bboxes)[:, :4].astype(np.float32)
+
+    anchor_indexes, gt_indexes = [], []
+    for a in range(anchor_num):
+        x1, y1, x2, y2 = all_anchors[a]
+        y_lo, y_hi = _grid_range(gt_bboxes[:, 1], gt_bboxes[:, 3], y1, y2, feature_stride, feature_height)
+        x_lo, x_hi = _grid_range(gt_bboxes[:, 0], gt_bboxes[:, 2], x1, x2, feature_stride, feature_width)
+
+        owners, ys, xs = _expand_ranges(y_lo, y_hi, x_lo, x_hi)
+        anchor_indexes.append((ys * feature_width + xs) * anchor_num + a)
+        gt_indexes.append(owners)
+
+    anchor_indexes = np.concatenate(anchor_indexes)
+    gt_indexes = np.concatenate(gt_indexes)
+
+    pair_areas = None if anchor_areas is None else anchor_areas[anchor_indexes]
+    ious = paired_overlaps(all_anchors[anchor_indexes], gt_bboxes[gt_indexes], boxes_areas=pair_areas)
+    positive = ious > 0
+    return anchor_indexes[positive], gt_indexes[positive], ious[positive]
+
+
+def grid_overlaps_reduced(all_anchors, feature_shape, feature_stride, gt_bboxes, rows=None, anchor_areas=None):
+    """
+    Same outputs as utils.overlaps.bbox_overlaps_reduced(all_anchors[rows], gt_bboxes), computed from the
+    overlapping pairs only. The cost follows the number of real overlaps instead of K * N.
+    :param all_anchors: All anchors of the feature map.
+    :param feature_shape: [feature_height, feature_width]
+    :param feature_stride: Stride of the feature map.
+    :param gt_bboxes: Ground truth bounding boxes [x1, y1, x2, y2, ...], extra columns are ignored.
+    :param rows: Indexes of the anchors to match, as the inside border anchors. None means all anchors.
+    :param anchor_areas: Precomputed float32 areas of all anchors, optional.
+    :return: row_argmax (K), row_max (K), col_argmax (N), col_max (N) and col_max_rows, indexes relative to rows.
+    """
+    if rows is None:
+        rows = np.arange(len(all_anchors))
+    num_rows, num_gt = len(rows), len(gt_bboxes)
+
+    row_argmax = np.zeros((num_rows,), dtype=np.int64)
+    row_max = np.zeros((num_rows,), dtype=np.float32)
+    col_argmax = np.zeros((num_gt,), dtype=np.int64)
+    col_max = np.zeros((num_gt,), dtype=np.float32)
+    if num_rows == 0 or num_gt == 0:
+        return row_argmax, row_max, col_argmax, col_max, np.zeros((0,), dtype=np.int64)
+
+    anchor_indexes, gt_indexes, ious = grid_overlap_pairs(all_anchors, feature_shape, feature_stride, gt_bboxes,
+                                                          anchor_areas=anchor_areas)
+
+    # Map anchor indexes to positions in rows, drop the anchors out of rows.
+    positions = np.full((len(all_anchors),), -1, dtype=np.int64)
+    positions[rows] = np.arange(num_rows)
+    pair_rows = positions[anchor_indexes]
+    selected = pair_rows >= 0
+    pair_rows, gt_indexes, ious = pair_rows[selected], gt_indexes[selected], ious[selected]
+    if len(ious) == 0:
+        return row_argmax, row_max, col_argmax, col_max, np.zeros((0,), dtype=np.int64)
+
+    row_argmax, row_max = _group_argmax(pair_rows, ious, gt_indexes, num_rows)
+    col_argmax, col_max = _group_argmax(gt_indexes, ious, pair_rows, num_gt)
+
+    col_max_rows = np.unique(pair_rows[ious == col_max[gt_indexes]])
+    return row_argmax, row_max, col_argmax, col_max, col_max_rows
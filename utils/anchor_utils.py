@@ -112,3 +112,52 @@ def decode_bboxes(encoded_pred_bboxes, gt_bboxes, scale_factor=None):
     pred_yy2 = pred_y_centers + pred_heights / 2.0 - 0.5
 
     return tf.stack([pred_xx1, pred_yy1, pred_xx2, pred_yy2], axis=1)
+
+
+def encode_bboxes_tf(pred_bboxes, gt_bboxes, scale_factor=None):
+    """
+    Tensorflow version of encode_bboxes.
+    """
+    def _bboxes2anchors(bboxes):
+        xx1, yy1, xx2, yy2 = tf.unstack(bboxes, axis=1)
+        return (xx2 + xx1) / 2.0, (yy2 + yy1) / 2.0, xx2 - xx1 + 1, yy2 - yy1 + 1
+
+    pred_x_centers, pred_y_centers, pred_widths, pred_heigths = _bboxes2anchors(pred_bboxes)
+    gt_x_centers, gt_y_centers, gt_widths, gt_heigths = _bboxes2anchors(gt_bboxes)
+
+    # Avoid divide zero
+    pred_widths = pred_widths + 1e-8
+    pred_heigths = pred_heigths + 1e-8
+    gt_widths = gt_widths + 1e-8
+    gt_heigths = gt_heigths + 1e-8
+
+    t_x = (pred_x_centers - gt_x_centers) / gt_widths
+    t_y = (pred_y_centers - gt_y_centers) / gt_heigths
+    t_w = tf.log(pred_widths / gt_widths)
+    t_h = tf.log(pred_heigths / gt_heigths)
+
+    if scale_factor:
+        t_x *= scale_factor[0]
+        t_y *= scale_factor[1]
+        t_w *= scale_factor[2]
+        t_h *= scale_factor[3]
+    return tf.stack([t_x, t_y, t_w, t_h], axis=1)
+
+
+def bbox_overlaps_tf(boxes, query_boxes):
+    """
+    Tensorflow version of utils.overlaps.bbox_overlaps. Broadcasts K boxes against N query boxes.
+    :param boxes: K * 4 boxes [x1, y1, x2, y2]
+    :param query_boxes: N * 4 boxes [x1, y1, x2, y2]
+    :return: K * N ious.
+    """
+    x1, y1, x2, y2 = tf.split(boxes, 4, axis=1)
+    qx1, qy1, qx2, qy2 = tf.unstack(query_boxes, axis=1)
+
+    iws = tf.maximum(tf.minimum(x2, qx2) - tf.maximum(x1, qx1) + 1, 0.)
+    ihs = tf.maximum(tf.minimum(y2, qy2) - tf.maximum(y1, qy1) + 1, 0.)
+    intersection_areas = iws * ihs
+
+    areas = (x2 - x1 + 1) * (y2 - y1 + 1)
+    query_areas = (qx2 - qx1 + 1) * (qy2 - qy1 + 1)
+    return intersection_areas / (areas + query_areas - intersection_areas)
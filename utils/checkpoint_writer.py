@@ -0,0 +1,129 @@
+import glob
+import os
+import queue
+import threading
+import time
+
+import tensorflow as tf
+
+
+class AsyncCheckpointWriter(object):
+    """
+    Save checkpoints off the training thread. save() only copies the variables out of the session, a background
+    thread writes them under a temporary name and renames the files, so a checkpoint on disk is always complete.
+    Checkpoints are restored as usual with tf.train.Saver and tf.train.latest_checkpoint.
+
+    Retention: the keep_last latest checkpoints are kept, and those whose step is a multiple of keep_every.
+    """
+
+    def __init__(self, variables, save_dir, model_name, keep_last=5, keep_every=None):
+        self.variables = list(variables)
+        self.save_dir = save_dir
+        self.model_name = model_name
+        self.keep_last = keep_last
+        self.keep_every = keep_every
+
+        # Snapshots wait here for the writer thread, one write at a time and at most one snapshot pending.
+        self._queue = queue.Queue(maxsize=1)
+        self._checkpoints = []
+        self._error = None
+
+        # Milliseconds each save stalled the trainer, and the time the writer took.
+        self.stall_times = []
+        self.write_times = []
+
+        # The writer has its own graph, variables with the same names as the training variables.
+        self._graph = tf.Graph()
+        with self._graph.as_default():
+            self._placeholders = []
+            assign_ops = []
+            var_list = {}
+            for variable in self.variables:
+                dtype = variable.dtype.base_dtype
+                shape = variable.get_shape()
+                snapshot = tf.Variable(tf.zeros(shape, dtype), name='snapshot', trainable=False)
+                placeholder = tf.placeholder(dtype, shape)
+                assign_ops.append(tf.assign(snapshot, placeholder))
+                self._placeholders.append(placeholder)
+                var_list[variable.op.name] = snapshot
+            self._assign_op = tf.group(*assign_ops)
+            self._saver = tf.train.Saver(var_list, max_to_keep=None)
+        self._sess = tf.Session(graph=self._graph)
+
+        self._thread = threading.Thread(target=self._run, name='checkpoint-writer', daemon=True)
+        self._thread.start()
+
+    def save(self, sess, step):
+        """
+        Copy the variables of sess and queue them to be written as checkpoint step. Blocks only when the previous
+        checkpoint is still being written.
+        :return: milliseconds the caller was stalled.
+        """
+        if self._error is not None:
+            raise self._error
+
+        start_time = time.time()
+        values = sess.run(self.variables)
+        self._queue.put((int(step), values))
+        stall_time = (time.time() - start_time) * 1000
+        self.stall_times.append(stall_time)
+        return stall_time
+
+    def _prefix(self, step):
+        return os.path.join(self.save_dir, '{}.ckpt-{}'.format(self.model_name, step))
+
+    def _write(self, step, values):
+        start_time = time.time()
+        self._sess.run(self._assign_op, feed_dict=dict(zip(self._placeholders, values)))
+
+        prefix = self._prefix(step)
+        temporary_prefix = prefix + '.tmp'
+        self._saver.save(self._sess, temporary_prefix, write_meta_graph=False, write_state=False)
+
+        # The index is renamed last, a checkpoint without index is never read.
+        temporary_files = sorted(glob.glob(temporary_prefix + '.*'), key=lambda path: path.endswith('.index'))
+        for path in temporary_files:
+            os.replace(path, prefix + path[len(temporary_prefix):])
+
+        self._checkpoints.append(step)
+        self._apply_retention()
+        tf.train.update_checkpoint_state(self.save_dir, prefix,
+                                         all_model_checkpoint_paths=[self._prefix(s) for s in self._checkpoints])
+        self.write_times.append((time.time() - start_time) * 1000)
+
+    def _apply_retention(self):
+        latest = set(self._checkpoints[-self.keep_last:]) if self.keep_last else set()
+        kept = []
+        for step in self._checkpoints:
+            if step in latest or (self.keep_every and step % self.keep_every == 0):
+                kept.append(step)
+            else:
+                for path in glob.glob(self._prefix(step) + '.*'):
+                    os.remove(path)
+        self._checkpoints = kept
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            try:
+                self._write(*item)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        """
+        Wait until all queued checkpoints are written.
+        """
+        self._queue.join()
+        if self._error is not None:
+            raise self._error
+
+    def close(self):
+        self.flush()
+        self._queue.put(None)
+        self._thread.join()
+        self._sess.close()
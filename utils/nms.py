@@ -0,0 +1,186 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+# Boxes suppressed together: each block is first checked against all kept boxes at once, then inside itself.
+_BLOCK_SIZE = 256
+
+_SOFT_NMS_METHODS = ('linear', 'gaussian')
+
+
+def _prepare(boxes, scores):
+    boxes = np.asarray(boxes)[:, :4].astype(np.float32, copy=False)
+    scores = np.asarray(scores).astype(np.float32, copy=False)
+    if len(boxes) != len(scores):
+        raise ValueError('Got {} boxes and {} scores.'.format(len(boxes), len(scores)))
+    return boxes, scores
+
+
+def _areas(boxes):
+    # Same box convention as tf.image.non_max_suppression, no +1 on widths and heights.
+    return (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+
+
+def _ious(boxes, areas, query_boxes, query_areas):
+    """
+    K x N ious of boxes and query_boxes, 0 when the union is empty.
+    """
+    iws = np.minimum(boxes[:, 2:3], query_boxes[:, 2])
+    iws -= np.maximum(boxes[:, 0:1], query_boxes[:, 0])
+    np.maximum(iws, 0, out=iws)
+
+    ihs = np.minimum(boxes[:, 3:4], query_boxes[:, 3])
+    ihs -= np.maximum(boxes[:, 1:2], query_boxes[:, 1])
+    np.maximum(ihs, 0, out=ihs)
+
+    iws *= ihs
+    np.add(areas[:, np.newaxis], query_areas, out=ihs)
+    ihs -= iws
+    return np.divide(iws, ihs, out=np.zeros_like(iws), where=ihs > 0)
+
+
+def nms(boxes, scores, iou_threshold, max_output_size=None, score_threshold=None):
+    """
+    Greedy NMS, same selection as tf.image.non_max_suppression: boxes are visited by decreasing score and a box is
+    dropped when its iou with a kept box is greater than iou_threshold.
+    Sorted boxes are processed in blocks, every block is compared with the kept boxes in one array operation, so
+    only the suppression inside a block is sequential.
+    :param boxes: N * 4 boxes [x1, y1, x2, y2], extra columns are ignored.
+    :param scores: N scores.
+    :param iou_threshold: Iou above which a box is suppressed.
+    :param max_output_size: Maximum number of kept boxes, None means no limit.
+    :param score_threshold: Boxes with a lower score are dropped before NMS, optional.
+    :return: indexes of the kept boxes, by decreasing score.
+    """
+    boxes, scores = _prepare(boxes, scores)
+    max_output_size = len(boxes) if max_output_size is None else min(int(max_output_size), len(boxes))
+
+    order = np.argsort(-scores, kind='stable')
+    if score_threshold is not None:
+        order = order[scores[order] >= score_threshold]
+    if len(order) == 0 or max_output_size <= 0:
+        return np.zeros((0,), dtype=np.int64)
+
+    sorted_boxes = boxes[order]
+    sorted_areas = _areas(sorted_boxes)
+
+    keep = np.empty((max_output_size,), dtype=np.int64)
+    num_keep = 0
+    for start in range(0, len(order), _BLOCK_SIZE):
+        block = slice(start, start + _BLOCK_SIZE)
+        block_boxes, block_areas = sorted_boxes[block], sorted_areas[block]
+
+        # Suppressed by the boxes kept in the previous blocks
+        if num_keep > 0:
+            kept = keep[:num_keep]
+            alive = np.all(_ious(sorted_boxes[kept], sorted_areas[kept], block_boxes, block_areas) <= iou_threshold,
+                           axis=0)
+        else:
+            alive = np.ones((len(block_boxes),), dtype=np.bool_)
+
+        # Suppressed inside the block, the upper triangle holds the ious with the higher scored boxes
+        suppress = _ious(block_boxes, block_areas, block_boxes, block_areas) > iou_threshold
+        for i in range(len(block_boxes)):
+            if alive[i]:
+                keep[num_keep] = start + i
+                num_keep += 1
+                if num_keep == max_output_size:
+                    return order[keep]
+                alive[i + 1:] &= ~suppress[i, i + 1:]
+
+    return order[keep[:num_keep]]
+
+
+def soft_nms(boxes, scores, iou_threshold=0.3, sigma=0.5, method='linear', max_output_size=None,
+             score_threshold=0.001):
+    """
+    Soft-NMS, Bodla et al. 2017. The highest scored box is kept and the scores of the remaining boxes are decayed
+    by their iou with it, linear: score * (1 - iou) when iou > iou_threshold, gaussian: score * exp(-iou^2 / sigma).
+    Boxes falling under score_threshold are dropped.
+    :param boxes: N * 4 boxes [x1, y1, x2, y2], extra columns are ignored.
+    :param scores: N scores.
+    :param iou_threshold: Iou above which the linear method decays a score.
+    :param sigma: Spread of the gaussian method.
+    :param method: 'linear' or 'gaussian'.
+    :param max_output_size: Maximum number of kept boxes, None means no limit.
+    :param score_threshold: Minimum score of a kept box.
+    :return: indexes of the kept boxes and their decayed scores, by decreasing decayed score.
+    """
+    if method not in _SOFT_NMS_METHODS:
+        raise ValueError('Unknown soft-NMS method {}, use one of {}.'.format(method, _SOFT_NMS_METHODS))
+
+    boxes, scores = _prepare(boxes, scores)
+    max_output_size = len(boxes) if max_output_size is None else min(int(max_output_size), len(boxes))
+
+    remaining = np.flatnonzero(scores >= score_threshold)
+    remaining_boxes = boxes[remaining]
+    remaining_areas = _areas(remaining_boxes)
+    remaining_scores = scores[remaining].copy()
+
+    keep, keep_scores = [], []
+    while len(remaining) > 0 and len(keep) < max_output_size:
+        top = np.argmax(remaining_scores)
+        keep.append(remaining[top])
+        keep_scores.append(remaining_scores[top])
+
+        ious = _ious(remaining_boxes[top:top + 1], remaining_areas[top:top + 1], remaining_boxes, remaining_areas)[0]
+        if method == 'linear':
+            decay = np.where(ious > iou_threshold, 1 - ious, 1)
+        else:
+            decay = np.exp(-(ious * ious) / sigma)
+        remaining_scores *= decay
+
+        # Drop the kept box and the boxes decayed under the threshold
+        alive = remaining_scores >= score_threshold
+        alive[top] = False
+        remaining, remaining_boxes = remaining[alive], remaining_boxes[alive]
+        remaining_areas, remaining_scores = remaining_areas[alive], remaining_scores[alive]
+
+    return np.int64(keep), np.float32(keep_scores)
+
+
+def batched_nms(boxes, scores, categories, iou_threshold, max_output_size=None, max_output_per_class=None,
+                score_threshold=None, soft_nms_method=None, sigma=0.5, num_threads=1):
+    """
+    Class aware NMS: boxes only suppress boxes of the same category. Each category is an independent NMS, with
+    num_threads > 1 the categories are spread over a thread pool, NumPy releases the GIL in the iou computation.
+    :param boxes: N * 4 boxes [x1, y1, x2, y2], extra columns are ignored.
+    :param scores: N scores.
+    :param categories: N integer categories.
+    :param iou_threshold: Iou threshold of the NMS of each category.
+    :param max_output_size: Maximum number of kept boxes over all categories, None means no limit.
+    :param max_output_per_class: Maximum number of kept boxes of each category, None means no limit.
+    :param score_threshold: Minimum score of a kept box, optional. soft-NMS uses 0.001 by default.
+    :param soft_nms_method: None for greedy NMS, 'linear' or 'gaussian' for soft-NMS.
+    :param sigma: Spread of the gaussian soft-NMS.
+    :param num_threads: Number of threads running the categories.
+    :return: indexes of the kept boxes and their scores (decayed with soft-NMS), by decreasing score.
+    """
+    boxes, scores = _prepare(boxes, scores)
+    categories = np.asarray(categories)
+    if len(categories) != len(boxes):
+        raise ValueError('Got {} boxes and {} categories.'.format(len(boxes), len(categories)))
+
+    def _category_nms(indexes):
+        if soft_nms_method is None:
+            keep = nms(boxes[indexes], scores[indexes], iou_threshold, max_output_per_class, score_threshold)
+            return indexes[keep], scores[indexes[keep]]
+        keep, keep_scores = soft_nms(boxes[indexes], scores[indexes], iou_threshold, sigma, soft_nms_method,
+                                     max_output_per_class, 0.001 if score_threshold is None else score_threshold)
+        return indexes[keep], keep_scores
+
+    category_indexes = [np.flatnonzero(categories == category) for category in np.unique(categories)]
+    if num_threads > 1 and len(category_indexes) > 1:
+        with ThreadPoolExecutor(min(num_threads, len(category_indexes))) as executor:
+            results = list(executor.map(_category_nms, category_indexes))
+    else:
+        results = [_category_nms(indexes) for indexes in category_indexes]
+
+    if not results:
+        return np.zeros((0,), dtype=np.int64), np.zeros((0,), dtype=np.float32)
+
+    keep = np.concatenate([result[0] for result in results]).astype(np.int64)
+    keep_scores = np.concatenate([result[1] for result in results]).astype(np.float32)
+    order = np.argsort(-keep_scores, kind='stable')[:max_output_size]
+    return keep[order], keep_scores[order]
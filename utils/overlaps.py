@@ -0,0 +1,162 @@
+import numpy as np
+
+
+# Number of K x N float32 temporaries alive at once while computing one chunk
+# (intersection width, intersection height, union and one min/max scratch array).
+_CHUNK_TEMPORARIES = 4
+
+
+def _chunk_rows(num_boxes, num_query_boxes, memory_cap):
+    """
+    Number of rows of boxes processed at once so the chunk temporaries stay under memory_cap bytes.
+    """
+    if not memory_cap:
+        return max(1, num_boxes)
+    bytes_per_row = _CHUNK_TEMPORARIES * np.dtype(np.float32).itemsize * max(1, num_query_boxes)
+    return int(max(1, min(num_boxes, memory_cap // bytes_per_row)))
+
+
+def _areas(boxes):
+    return (boxes[:, 2] - boxes[:, 0] + 1) * (boxes[:, 3] - boxes[:, 1] + 1)
+
+
+def _chunk_overlaps(boxes, boxes_areas, query_boxes, query_areas):
+    # Broadcast [k, 1] against [n] instead of repeating indexes, all in float32.
+    iws = np.minimum(boxes[:, 2:3], query_boxes[:, 2])
+    iws -= np.maximum(boxes[:, 0:1], query_boxes[:, 0])
+    iws += 1
+    np.maximum(iws, 0, out=iws)
+
+    ihs = np.minimum(boxes[:, 3:4], query_boxes[:, 3])
+    ihs -= np.maximum(boxes[:, 1:2], query_boxes[:, 1])
+    ihs += 1
+    np.maximum(ihs, 0, out=ihs)
+
+    # intersection areas
+    iws *= ihs
+
+    # union areas, reuse the buffer of ihs
+    np.add(boxes_areas[:, np.newaxis], query_areas, out=ihs)
+    ihs -= iws
+
+    return np.divide(iws, ihs, out=iws)
+
+
+def _prepare(boxes, query_boxes):
+    boxes = np.asarray(boxes)[:, :4].astype(np.float32, copy=False)
+    query_boxes = np.asarray(query_boxes)[:, :4].astype(np.float32, copy=False)
+    return boxes, _areas(boxes), query_boxes, _areas(query_boxes)
+
+
+def paired_overlaps(boxes, query_boxes, boxes_areas=None):
+    """
+    Calculate ious of paired boxes, boxes[i] with query_boxes[i]. Same float32 arithmetic as bbox_overlaps, so
+    both give bitwise equal ious for the same pair.
+    :param boxes: P * 4 boxes [x1, y1, x2, y2], extra columns are ignored.
+    :param query_boxes: P * 4 boxes [x1, y1, x2, y2], extra columns are ignored.
+    :param boxes_areas: Precomputed float32 areas of boxes, optional.
+    :return: P float32 ious.
+    """
+    if boxes_areas is None:
+        boxes, boxes_areas, query_boxes, query_areas = _prepare(boxes, query_boxes)
+    else:
+        boxes = np.asarray(boxes)[:, :4].astype(np.float32, copy=False)
+        query_boxes = np.asarray(query_boxes)[:, :4].astype(np.float32, copy=False)
+        query_areas = _areas(query_boxes)
+
+    iws = np.minimum(boxes[:, 2], query_boxes[:, 2])
+    iws -= np.maximum(boxes[:, 0], query_boxes[:, 0])
+    iws += 1
+    np.maximum(iws, 0, out=iws)
+
+    ihs = np.minimum(boxes[:, 3], query_boxes[:, 3])
+    ihs -= np.maximum(boxes[:, 1], query_boxes[:, 1])
+    ihs += 1
+    np.maximum(ihs, 0, out=ihs)
+
+    iws *= ihs
+    np.add(boxes_areas, query_areas, out=ihs)
+    ihs -= iws
+
+    return np.divide(iws, ihs, out=iws)
+
+
+def bbox_overlaps(boxes, query_boxes, memory_cap=None):
+    """
+    Calculate ious of K boxes and N query boxes. Boxes are processed in chunks of rows, so the temporaries
+    never exceed memory_cap bytes. Only the K * N float32 output is allocated in full.
+    :param boxes: K * 4 boxes [x1, y1, x2, y2], extra columns are ignored.
+    :param query_boxes: N * 4 boxes [x1, y1, x2, y2], extra columns are ignored.
+    :param memory_cap: Bytes allowed for the temporaries of one chunk. None or 0 means no limit.
+    :return: K * N float32 array of ious.
+    """
+    boxes, boxes_areas, query_boxes, query_areas = _prepare(boxes, query_boxes)
+    num_boxes, num_query_boxes = len(boxes), len(query_boxes)
+
+    overlaps = np.empty((num_boxes, num_query_boxes), dtype=np.float32)
+    if num_boxes == 0 or num_query_boxes == 0:
+        return overlaps
+
+    chunk = _chunk_rows(num_boxes, num_query_boxes, memory_cap)
+    for start in range(0, num_boxes, chunk):
+        end = start + chunk
+        overlaps[start:end] = _chunk_overlaps(boxes[start:end], boxes_areas[start:end], query_boxes, query_areas)
+    return overlaps
+
+
+def bbox_overlaps_reduced(boxes, query_boxes, memory_cap=None):
+    """
+    Same ious as bbox_overlaps, but the K * N matrix never exists. Only the reductions used by target
+    assignment are kept while walking through the chunks.
+    :param boxes: K * 4 boxes [x1, y1, x2, y2], extra columns are ignored.
+    :param query_boxes: N * 4 boxes [x1, y1, x2, y2], extra columns are ignored.
+    :param memory_cap: Bytes allowed for the temporaries of one chunk. None or 0 means no limit.
+    :return: row_argmax (K), row_max (K), col_argmax (N), col_max (N) and col_max_rows, the sorted indexes of
+    rows reaching the maximum of at least one column (ties included, columns without any overlap ignored).
+    """
+    boxes, boxes_areas, query_boxes, query_areas = _prepare(boxes, query_boxes)
+    num_boxes, num_query_boxes = len(boxes), len(query_boxes)
+
+    row_argmax = np.zeros((num_boxes,), dtype=np.int64)
+    row_max = np.zeros((num_boxes,), dtype=np.float32)
+    col_argmax = np.zeros((num_query_boxes,), dtype=np.int64)
+    col_max = np.full((num_query_boxes,), -1, dtype=np.float32)
+    if num_boxes == 0 or num_query_boxes == 0:
+        return row_argmax, row_max, col_argmax, np.maximum(col_max, 0), np.zeros((0,), dtype=np.int64)
+
+    # Rows tying with the running column maximums, filtered against the final maximums at the end.
+    candidate_rows, candidate_cols, candidate_values = [], [], []
+
+    chunk = _chunk_rows(num_boxes, num_query_boxes, memory_cap)
+    for start in range(0, num_boxes, chunk):
+        end = min(start + chunk, num_boxes)
+        ious = _chunk_overlaps(boxes[start:end], boxes_areas[start:end], query_boxes, query_areas)
+
+        chunk_row_argmax = np.argmax(ious, axis=1)
+        row_argmax[start:end] = chunk_row_argmax
+        row_max[start:end] = ious[np.arange(end - start), chunk_row_argmax]
+
+        chunk_col_argmax = np.argmax(ious, axis=0)
+        chunk_col_max = ious[chunk_col_argmax, np.arange(num_query_boxes)]
+
+        # Strictly greater keeps the first maximum, as np.argmax over the full matrix does.
+        better = chunk_col_max > col_max
+        col_argmax[better] = chunk_col_argmax[better] + start
+        col_max[better] = chunk_col_max[better]
+
+        tracked = (chunk_col_max >= col_max) & (chunk_col_max > 0)
+        if np.any(tracked):
+            rows, cols = np.nonzero((ious == chunk_col_max) & tracked)
+            candidate_rows.append(rows + start)
+            candidate_cols.append(cols)
+            candidate_values.append(chunk_col_max[cols])
+
+    if candidate_rows:
+        candidate_rows = np.concatenate(candidate_rows)
+        candidate_cols = np.concatenate(candidate_cols)
+        candidate_values = np.concatenate(candidate_values)
+        col_max_rows = np.unique(candidate_rows[candidate_values == col_max[candidate_cols]])
+    else:
+        col_max_rows = np.zeros((0,), dtype=np.int64)
+
+    return row_argmax, row_max, col_argmax, col_max, col_max_rows
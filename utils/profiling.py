@@ -0,0 +1,195 @@
+import functools
+import json
+import re
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+import tensorflow as tf
+
+
+# Stage of an op, first pattern matching its name. Gradient ops are counted in <stage>/backward.
+STAGES = [('optimizer', r'^(Adam|beta\d_power|train)'),
+          ('input', r'^(inputs/|IteratorGetNext|OneShotIterator)'),
+          ('rpn_feature', r'^rpn_feature/'),
+          ('backbone', r'^(vgg|resnext)'),
+          ('rpn_labels', r'generate_rpn_labels'),
+          ('rpn_proposals', r'^rpn/rpn_proposals'),
+          ('proposal_targets', r'^rpn/proposal_targets'),
+          ('losses', r'^(rpn/rpn_losses|rcnn_losses|(add|mul|Sum)(_\d+)?$)'),
+          ('rpn', r'^rpn/'),
+          ('roi_pooling', r'^rcnn/roi_pooling'),
+          ('head', r'^rcnn/'),
+          ('postprocess', r'^postprocess_faster_rcnn')]
+
+
+class _PyFuncTimer(object):
+    """
+    Wall time of the python functions of py_funcs, measured in python, recorded only while enabled.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.records = []
+        self._lock = threading.Lock()
+
+    def wrap(self, func):
+        @functools.wraps(func)
+        def timed(*args):
+            if not self.enabled:
+                return func(*args)
+            start_time = time.time()
+            try:
+                return func(*args)
+            finally:
+                end_time = time.time()
+                with self._lock:
+                    self.records.append((func.__name__, start_time, end_time, threading.get_ident()))
+        return timed
+
+    def take(self):
+        with self._lock:
+            records, self.records = self.records, []
+        return records
+
+
+py_func_timer = _PyFuncTimer()
+
+
+def timed_py_func(func):
+    """
+    Wrap the python function of a tf.py_func, its calls are timed while a StageProfiler runs.
+    """
+    return py_func_timer.wrap(func)
+
+
+def op_stage(node_name, stages=STAGES):
+    if node_name.startswith('gradients/'):
+        return op_stage(node_name[len('gradients/'):], stages) + '/backward'
+    for stage, pattern in stages:
+        if re.search(pattern, node_name):
+            return stage
+    return 'other'
+
+
+def _busy_time(intervals):
+    # Length of the union of the intervals, ops of a stage running in parallel are counted once.
+    busy, end = 0, None
+    for start, stop in sorted(intervals):
+        if end is None or start > end:
+            busy += stop - start
+            end = stop
+        elif stop > end:
+            busy += stop - end
+            end = stop
+    return busy
+
+
+class StageProfiler(object):
+    """
+    Run session steps with full tracing and aggregate the op times per stage of the detector. Traced steps are
+    slower than untraced ones, compare the stages with each other rather than with untraced step times.
+    """
+
+    def __init__(self, stages=STAGES):
+        self.stages = stages
+        self._stage_cache = {}
+        # Per step: wall time in seconds, {stage: busy microseconds}, op events and py_func records.
+        self.step_times = []
+        self.stage_times = []
+        self._events = []
+        self._py_func_records = []
+
+    def _stage(self, node_name):
+        if node_name not in self._stage_cache:
+            self._stage_cache[node_name] = op_stage(node_name, self.stages)
+        return self._stage_cache[node_name]
+
+    def run(self, sess, fetches, feed_dict=None):
+        run_options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+        run_metadata = tf.RunMetadata()
+
+        py_func_timer.take()
+        py_func_timer.enabled = True
+        start_time = time.time()
+        try:
+            results = sess.run(fetches, feed_dict=feed_dict, options=run_options, run_metadata=run_metadata)
+        finally:
+            step_time = time.time() - start_time
+            py_func_timer.enabled = False
+        self.add_step(run_metadata.step_stats, step_time, py_func_timer.take())
+        return results
+
+    def add_step(self, step_stats, step_time, py_func_records=()):
+        step = len(self.step_times)
+        intervals = defaultdict(list)
+        for device_stats in step_stats.dev_stats:
+            for node_stats in device_stats.node_stats:
+                # Stream devices name their ops <name>:<type>.
+                node_name = node_stats.node_name.split(':')[0]
+                start = node_stats.all_start_micros
+                duration = node_stats.all_end_rel_micros or node_stats.op_end_rel_micros
+                stage = self._stage(node_name)
+                intervals[stage].append((start, start + duration))
+                self._events.append((step, device_stats.device, node_stats.thread_id, node_name, stage, start,
+                                     duration))
+
+        self.step_times.append(step_time)
+        self.stage_times.append({stage: _busy_time(stage_intervals) for stage, stage_intervals in intervals.items()})
+        self._py_func_records.extend((step,) + tuple(record) for record in py_func_records)
+
+    def table(self):
+        """
+        :return: text table of the mean and p95 busy time of each stage per step and its share of the step time.
+        """
+        num_steps = len(self.step_times)
+        if num_steps == 0:
+            return 'No profiled steps.'
+
+        step_ms = np.mean(self.step_times) * 1000
+        rows = []
+        for stage in set().union(*self.stage_times):
+            times = np.float64([step_stages.get(stage, 0) for step_stages in self.stage_times]) / 1000
+            rows.append((stage, np.mean(times), np.percentile(times, 95)))
+
+        py_func_times = defaultdict(lambda: np.zeros(num_steps))
+        for step, name, start_time, end_time, _ in self._py_func_records:
+            py_func_times[name][step] += (end_time - start_time) * 1000
+        for name, times in sorted(py_func_times.items()):
+            rows.append(('py_func ' + name, np.mean(times), np.percentile(times, 95)))
+
+        lines = [f'{"stage":<32}{"mean ms":>10}{"p95 ms":>10}{"% step":>8}']
+        for name, mean, p95 in sorted(rows, key=lambda row: -row[1]):
+            lines.append(f'{name:<32}{mean:>10.2f}{p95:>10.2f}{100 * mean / step_ms:>8.1f}')
+        lines.append(f'{"step wall time":<32}{step_ms:>10.2f}'
+                     f'{np.percentile(self.step_times, 95) * 1000:>10.2f}{100.:>8.1f}')
+        lines.append(f'{num_steps} traced steps, stages overlap when ops run in parallel.')
+        return '\n'.join(lines)
+
+    def write_chrome_trace(self, path):
+        """
+        Write the traced ops and py_func calls in the Chrome trace event format, open it in chrome://tracing.
+        """
+        origin = min([event[5] for event in self._events] +
+                     [int(record[2] * 1e6) for record in self._py_func_records] or [0])
+
+        pids = {}
+        trace_events = []
+        for step, device, thread_id, node_name, stage, start, duration in self._events:
+            if device not in pids:
+                pids[device] = len(pids)
+                trace_events.append({'name': 'process_name', 'ph': 'M', 'pid': pids[device],
+                                     'args': {'name': device}})
+            trace_events.append({'name': node_name, 'cat': stage, 'ph': 'X', 'pid': pids[device], 'tid': thread_id,
+                                 'ts': start - origin, 'dur': duration, 'args': {'stage': stage, 'step': step}})
+
+        python_pid = len(pids)
+        trace_events.append({'name': 'process_name', 'ph': 'M', 'pid': python_pid, 'args': {'name': 'python'}})
+        for step, name, start_time, end_time, thread_id in self._py_func_records:
+            trace_events.append({'name': name, 'cat': 'py_func', 'ph': 'X', 'pid': python_pid, 'tid': thread_id,
+                                 'ts': int(start_time * 1e6) - origin, 'dur': int((end_time - start_time) * 1e6),
+                                 'args': {'step': step}})
+
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, f)
@@ -0,0 +1,95 @@
+import json
+import os
+import platform
+
+import tensorflow as tf
+
+import faster_rcnn_configs as frc
+
+
+PURPOSES = ('train', 'inference')
+
+
+def _host():
+    return {'node': platform.node(), 'cpus': os.cpu_count()}
+
+
+def load_tuned(purpose, path=None):
+    """
+    Settings of purpose written by autotune_session.py, None without file or when it was tuned on another host.
+    :return: {'intra_op_threads', 'inter_op_threads', 'cpus'} or None, cpus [] runs on all cpus.
+    """
+    path = frc.SESSION_CONFIG_PATH if path is None else path
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        tuned = json.load(f)
+    if tuned.get('host') != _host():
+        return None
+    return tuned.get(purpose)
+
+
+def save_tuned(settings, path=None):
+    """
+    :param settings: {purpose: {'intra_op_threads', 'inter_op_threads', 'cpus', ...}}
+    """
+    path = frc.SESSION_CONFIG_PATH if path is None else path
+    with open(path, 'w') as f:
+        json.dump(dict(settings, host=_host()), f, indent=2)
+
+
+def session_settings(purpose='train', intra_op_threads=None, inter_op_threads=None, cpus=None, path=None):
+    """
+    Thread counts and cpus of purpose. Arguments win over INTRA_OP_THREADS and INTER_OP_THREADS, which win over the
+    tuned settings, 0 leaves the choice to tensorflow.
+    :return: {'intra_op_threads', 'inter_op_threads', 'cpus'}
+    """
+    if purpose not in PURPOSES:
+        raise ValueError('purpose is one of {}, got {}.'.format(PURPOSES, purpose))
+    tuned = load_tuned(purpose, path) or {}
+
+    def _pick(argument, configured, name):
+        if argument is not None:
+            return argument
+        return configured or tuned.get(name, 0)
+
+    return {'intra_op_threads': _pick(intra_op_threads, frc.INTRA_OP_THREADS, 'intra_op_threads'),
+            'inter_op_threads': _pick(inter_op_threads, frc.INTER_OP_THREADS, 'inter_op_threads'),
+            'cpus': cpus if cpus is not None else tuned.get('cpus')}
+
+
+def session_config(purpose='train', intra_op_threads=None, inter_op_threads=None, path=None):
+    """
+    tf.ConfigProto of MODE, GPU_ID and the thread counts of purpose. Ops without kernel on the device, as the
+    py_funcs and NMS on GPU, are placed on the CPU.
+    """
+    settings = session_settings(purpose, intra_op_threads, inter_op_threads, path=path)
+    config = tf.ConfigProto(allow_soft_placement=True,
+                            intra_op_parallelism_threads=settings['intra_op_threads'],
+                            inter_op_parallelism_threads=settings['inter_op_threads'])
+    if frc.MODE == 0:
+        config.gpu_options.visible_device_list = str(frc.GPU_ID)
+        config.gpu_options.allow_growth = True
+    else:
+        config.device_count['GPU'] = 0
+    return config
+
+
+def pin_process(purpose='train', cpus=None, path=None):
+    """
+    Restrict the process to the cpus of purpose, when they are set. The thread pools of tensorflow are created
+    with the first session, pin the process before it.
+    :return: cpus the process runs on.
+    """
+    cpus = session_settings(purpose, cpus=cpus, path=path)['cpus']
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+    return sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else None
+
+
+def create_session(purpose='train', graph=None, target=''):
+    """
+    Session configured for purpose, train or inference.
+    """
+    pin_process(purpose)
+    return tf.Session(target, graph=graph, config=session_config(purpose))
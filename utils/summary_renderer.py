@@ -0,0 +1,97 @@
+import queue
+from multiprocessing import get_context
+
+import cv2
+import numpy as np
+import tensorflow as tf
+
+from utils.image_draw import draw_rectangle_with_name, draw_rectangle
+
+
+def _image_summary(tag, image):
+    # cv2 encodes BGR, the images are RGB as tf.summary.image expects them.
+    _, png = cv2.imencode('.png', cv2.cvtColor(np.uint8(image), cv2.COLOR_RGB2BGR))
+    return tf.Summary.Value(tag=tag, image=tf.Summary.Image(height=image.shape[0], width=image.shape[1],
+                                                            colorspace=image.shape[2],
+                                                            encoded_image_string=png.tobytes()))
+
+
+def render_summaries(display, class_names):
+    """
+    Draw the debug images of one training step.
+    :param display: {name: value} of the display tensors of train.build_network.
+    :return: tf.Summary of the rois per class, the detections per score bucket and the ground truth.
+    """
+    image = display['image']
+    values = []
+    for i, class_name in enumerate(class_names):
+        rois = display['rois'][display['roi_labels'] == i]
+        values.append(_image_summary('class_rois/{}'.format(class_name), draw_rectangle(image.copy(), rois)))
+
+    gt_bboxes = display['gt_bboxes']
+    values.append(_image_summary('detection/gt', draw_rectangle_with_name(image, gt_bboxes[:, :-1],
+                                                                          gt_bboxes[:, -1], class_names)))
+
+    bboxes, scores, categories = display['final_bbox'], display['final_score'], display['final_categories']
+    for low, high, name in ((0.25, 0.5, '25'), (0.5, 0.75, '50'), (0.75, np.inf, '75')):
+        selected = (scores >= low) & (scores < high) & (categories != 0)
+        values.append(_image_summary('detection/{}'.format(name),
+                                     draw_rectangle_with_name(image, bboxes[selected], categories[selected],
+                                                              class_names)))
+    return tf.Summary(value=values)
+
+
+def _render(render_queue, log_dir, class_names):
+    summary_writer = tf.summary.FileWriter(log_dir)
+    while True:
+        item = render_queue.get()
+        if item is None:
+            break
+        step, display = item
+        summary_writer.add_summary(render_summaries(display, class_names), step)
+        summary_writer.flush()
+    summary_writer.close()
+
+
+class SummaryRenderer(object):
+    """
+    Process drawing the debug images of training steps and writing them as image summaries to log_dir. The trainer
+    only hands over the raw arrays, when the renderer is max_pending steps behind new steps are dropped.
+    The process is spawned, not forked: it inherits neither the threads of the input pipeline, the session or the
+    server, nor their locks, and can be created at any time.
+    """
+
+    def __init__(self, log_dir, class_names, max_pending=2):
+        context = get_context('spawn')
+        self._queue = context.Queue(maxsize=max_pending)
+        self._process = context.Process(target=_render, args=(self._queue, log_dir, list(class_names)),
+                                        name='summary-renderer', daemon=True)
+        self._process.start()
+
+        self.num_submitted = 0
+        self.num_dropped = 0
+
+    def submit(self, step, display):
+        """
+        Queue the display arrays of step, dropped when the renderer is behind.
+        :return: whether the step was queued.
+        """
+        try:
+            self._queue.put_nowait((int(step), display))
+        except queue.Full:
+            self.num_dropped += 1
+            return False
+        self.num_submitted += 1
+        return True
+
+    def close(self, timeout=30.):
+        if self._process is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self._process.join(timeout)
+        if self._process.is_alive():
+            self._process.terminate()
+        self._process = None